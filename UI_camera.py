@@ -1,5 +1,12 @@
 from get_library import *
 from backend_count import *
+from metrics import draw_overlay
+from asset_cache import ASSETS, CTkFrameSequence
+from gif_player import GifPlayer
+from print_spooler import PrintSpooler
+from ledger import Ledger
+from event_bus import CountEvent, EventBus, FrameEvent
+from accounts import AccountStore, is_phone
 # from toUart import *
 
 
@@ -64,26 +71,49 @@ class RecyclingApp(ctk.CTk):
         self._set_appearance_mode("light")
         self.configure(bg=SECONDARY_GREEN)
 
+        # --- Sổ giao dịch: khôi phục số liệu dashboard từ lần chạy trước ---
+        self.ledger = Ledger(r"data/ledger.db")
+        summary = self.ledger.summary()
+        # --- Tài khoản khách hàng (SĐT / mã QR), None = khách vãng lai ---
+        self.accounts = AccountStore(r"data/ledger.db")
+        self.accounts.close_stale_sessions()
+        self.session = None
+
         # --- Data Attributes ---
-        self.bottles_counted, self.cans_counted, self.total_points = 0, 0, 0
+        self.bottles_counted, self.cans_counted, self.total_points = summary["bottles"], summary["cans"], summary["balance"]
         self.current_yolo_bottle_count, self.current_yolo_can_count = 0, 0
         self.last_confirmed_bottle_count, self.last_confirmed_can_count = 0, 0
 
-        # --- THÊM MỚI: Khởi tạo đối tượng in ấn ---
-        self.printer = ReceiptPrinter()
+        # --- Hàng đợi in chạy nền: máy in chậm / mất kết nối không làm treo giao diện ---
+        self.print_spooler = PrintSpooler(on_update=self.ledger.record_receipt)
 
         # #--- Khởi tạo truyền gói tin---
         # self.send_uart = ESP32_UART(port='COM4', baudrate=9600)
 
-        # --- Threading and Queue Setup ---
-        self.yolo_queue = queue.Queue(maxsize=2)
+        # --- Threading and Event Bus Setup ---
+        # Frame: chỉ lấy frame mới nhất; lượt đếm: hàng đợi riêng, không bao giờ mất
+        self.bus = EventBus()
+        self.frame_events = self.bus.subscribe(FrameEvent)
+        self.count_events = self.bus.subscribe(CountEvent)
+        self.bus.subscribe(CountEvent, self.ledger.record_crossing)  # Chỉ đưa vào hàng đợi, không ghi đĩa trên luồng YOLO
         # Change to 0 for webcam, or keep the path for a video file
         video_source = 0
         self.yolo_thread = YOLOProcessor(
             video_path=video_source,
             model_path=r"model/best.pt",
-            output_queue=self.yolo_queue
+            output_queue=None,
+            display_size=(640, 480),
+            display_rgb=True,
+            bus=self.bus,
+            adaptive={"budget_ms": 100},  # Tự hạ imgsz / bỏ frame khi máy chậm, None = tắt
+            metrics_port=9108  # http://127.0.0.1:9108/metrics
         )
+        # Một PhotoImage duy nhất, cập nhật tại chỗ bằng paste() thay vì tạo ảnh mới mỗi frame
+        self.camera_photo = None
+        # Overlay số liệu từng bước (bật/tắt bằng F3), chữ chỉ làm mới mỗi 0.5 s
+        self.show_metrics_overlay = False
+        self.overlay_lines, self.overlay_updated = [], 0.0
+        self.bind("<F3>", self.toggle_metrics_overlay)
         self.yolo_thread.start()
 
         self.grid_columnconfigure(0, weight=45)
@@ -157,7 +187,12 @@ class RecyclingApp(ctk.CTk):
             print(f"Xác nhận {newly_detected_bottles} chai và {newly_detected_cans} lon mới.")
             self.bottles_counted += newly_detected_bottles
             self.cans_counted += newly_detected_cans
-            self.total_points += ((newly_detected_bottles * 1.5) +( newly_detected_cans * 0.5)) 
+            points = compute_points(newly_detected_bottles, newly_detected_cans)
+            if self.session:
+                self.total_points = self.accounts.credit(self.session, newly_detected_bottles, newly_detected_cans, points)
+            else:
+                self.total_points += points
+            self.ledger.record_confirm(newly_detected_bottles, newly_detected_cans, points, user=self.session_user())
             
             self.last_confirmed_bottle_count = self.current_yolo_bottle_count
             self.last_confirmed_can_count = self.current_yolo_can_count
@@ -168,22 +203,64 @@ class RecyclingApp(ctk.CTk):
 
     def update_camera_feed(self):
         """
-        Lấy frame mới nhất từ queue và hiển thị lên giao diện.
+        Cập nhật số đếm từ mọi CountEvent và hiển thị frame mới nhất trên bus.
+        Frame đã được luồng YOLO chuyển sang RGB 640x480, ở đây chỉ paste vào ảnh sẵn có.
         """
+        metrics = self.yolo_thread.metrics
         try:
-            frame, bottle_count, can_count = self.yolo_queue.get_nowait()
-            self.current_yolo_bottle_count = bottle_count
-            self.current_yolo_can_count = can_count
-
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(frame_rgb)
-            ctk_image = ctk.CTkImage(light_image=pil_image, size=(640, 480))
-            self.camera_label.configure(image=ctk_image, text="")
-            self.camera_label.image = ctk_image
-        except queue.Empty:
-            pass # No new frame available yet
+            for event in self.count_events.drain():
+                self.current_yolo_bottle_count = event.bottle_count
+                self.current_yolo_can_count = event.can_count
+
+            event = self.frame_events.poll()
+            if event is None:
+                return
+            start = time.perf_counter()
+            metrics.record("handoff", start - event.published)
+            frame = event.frame
+
+            if self.show_metrics_overlay:
+                self.draw_metrics_overlay(frame)
+
+            pil_image = Image.fromarray(frame)
+            if self.camera_photo is None or self.camera_photo.width() != pil_image.width or self.camera_photo.height() != pil_image.height:
+                self.camera_photo = ImageTk.PhotoImage(pil_image)
+                self.camera_label.configure(image=self.camera_photo, text="")
+            else:
+                self.camera_photo.paste(pil_image)
+            metrics.record("render", time.perf_counter() - start)
         finally:
-            self.after(20, self.update_camera_feed)
+            self.after(self.camera_poll_interval(), self.update_camera_feed)
+
+    def toggle_metrics_overlay(self, event=None):
+        self.show_metrics_overlay = not self.show_metrics_overlay
+
+    def draw_metrics_overlay(self, frame):
+        """
+        Vẽ FPS và p50/p95 từng bước lên frame hiển thị (không ảnh hưởng frame đưa vào model).
+        """
+        now = time.monotonic()
+        if now - self.overlay_updated > 0.5:
+            stats = self.yolo_thread.frame_stats()
+            self.overlay_lines = [
+                f"fps {self.yolo_thread.fps:5.1f}  drop {stats['dropped']}  dup {stats['duplicated']}  skip {stats['skipped']}",
+                *self.yolo_thread.metrics.overlay_lines(),
+            ]
+            adaptive = self.yolo_thread.adaptive
+            if adaptive:
+                a = adaptive.stats()
+                self.overlay_lines.append(f"imgsz {a['imgsz']}  1/{a['skip']} frame  {a['latency_ms']:.0f}/{adaptive.budget_ms:.0f} ms")
+            self.overlay_updated = now
+        draw_overlay(frame, self.overlay_lines)
+
+    def camera_poll_interval(self):
+        """
+        Nhịp lấy frame (ms) theo FPS thực tế của luồng YOLO, giới hạn 10-100 ms.
+        """
+        fps = self.yolo_thread.fps
+        if fps <= 0:
+            return 50
+        return int(min(100, max(10, 1000.0 / fps)))
 
     def on_closing(self):
         """
@@ -192,6 +269,11 @@ class RecyclingApp(ctk.CTk):
         print("Đang đóng ứng dụng...")
         self.yolo_thread.stop()
         self.yolo_thread.join(timeout=1.0) # Wait for the thread to finish
+        self.print_spooler.close(timeout=1.0)  # Phiếu chưa in vẫn nằm trong spool/ cho lần sau
+        if self.session:
+            self.accounts.end_session(self.session)
+        self.accounts.close()
+        self.ledger.close(timeout=2.0)
         print("Luồng xử lý đã dừng. Đóng cửa sổ.")
         self.destroy()
 
@@ -207,7 +289,17 @@ class RecyclingApp(ctk.CTk):
         header_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=(0, 20))
         header_frame.grid_columnconfigure(0, weight=1)
         dashboard_label = ctk.CTkLabel(header_frame, text="Dashboard", font=ctk.CTkFont(size=24, weight="bold"), text_color=DARK_GREEN)
-        dashboard_label.grid(row=0, column=0, sticky="w", pady=20)
+        dashboard_label.grid(row=0, column=0, sticky="w", pady=(20, 0))
+        self.customer_label = ctk.CTkLabel(header_frame, text="Khách vãng lai", font=ctk.CTkFont(size=14), text_color=PRIMARY_GREEN)
+        self.customer_label.grid(row=1, column=0, sticky="w")
+
+        # --- NÚT KHÁCH HÀNG: đăng nhập bằng SĐT / quét QR, bấm lần nữa để kết thúc phiên ---
+        self.customer_button = ctk.CTkButton(
+            header_frame, text="Khách hàng", font=ctk.CTkFont(weight="bold"),
+            fg_color="transparent", border_color=PRIMARY_GREEN, text_color=PRIMARY_GREEN,
+            border_width=2, hover_color=SECONDARY_GREEN, command=self.prompt_customer
+        )
+        self.customer_button.grid(row=0, column=1, rowspan=2, sticky="e", padx=(0, 10))
 
         # --- NÚT EXPORT MỚI ---
         try:
@@ -226,7 +318,7 @@ class RecyclingApp(ctk.CTk):
                 fg_color="transparent", border_color=PRIMARY_GREEN, text_color=PRIMARY_GREEN,
                 border_width=2, hover_color=SECONDARY_GREEN, command=self.prompt_export
             )
-        export_button.grid(row=0, column=1, sticky="e")
+        export_button.grid(row=0, column=2, rowspan=2, sticky="e")
         
         stats_frame = ctk.CTkFrame(self.right_frame, fg_color="transparent")
         stats_frame.grid(row=1, column=0, sticky="ew", pady=10)
@@ -258,8 +350,74 @@ class RecyclingApp(ctk.CTk):
         )
         reset_button.grid(row=4, column=0, padx=10, pady=(5, 10), sticky="ew")
 
+    def session_user(self):
+        """Id khách hàng ghi vào sổ giao dịch (None với khách vãng lai)."""
+        return self.session.user if self.session else None
+
+    def prompt_customer(self):
+        """
+        Bắt đầu phiên khách hàng: nhập SĐT hoặc quét mã QR (máy quét gõ như bàn phím),
+        chưa có tài khoản thì hỏi tên để đăng ký. Đang có phiên thì hỏi kết thúc phiên.
+        """
+        if self.session:
+            message = f"Kết thúc phiên của '{self.session.customer.name}'?"
+            CustomDialog(self, title="Kết thúc phiên", message=message, is_confirm=True, command=self.end_customer_session)
+            return
+        key = ctk.CTkInputDialog(text="Nhập số điện thoại hoặc quét mã QR:", title="Khách hàng").get_input()
+        if not key:
+            return
+        customer = self.accounts.find(key)
+        if customer is None:
+            name = ctk.CTkInputDialog(text="Khách hàng mới, vui lòng nhập họ và tên:", title="Đăng ký").get_input()
+            if not name:
+                return
+            phone = is_phone(key)
+            try:
+                customer = self.accounts.register(name, phone=key if phone else None, qr_id=None if phone else key)
+            except ValueError as e:
+                CustomDialog(self, title="Lỗi", message=str(e))
+                return
+        self.start_customer_session(customer)
+
+    def start_customer_session(self, customer):
+        self.session = self.accounts.start_session(customer)
+        print(f"Bắt đầu phiên khách hàng {customer}")
+        self.bottles_counted, self.cans_counted, self.total_points = 0, 0, customer.balance
+        self.customer_label.configure(text=f"{customer.name} - {customer.phone or customer.qr_id or customer.id}")
+        self.customer_button.configure(text="Kết thúc phiên")
+        self.update_dashboard_display()
+
+    def end_customer_session(self):
+        """Kết thúc phiên, dashboard quay về số liệu chung của máy (lấy từ sổ giao dịch)."""
+        if not self.session:
+            return
+        self.accounts.end_session(self.session)
+        print(f"Kết thúc phiên khách hàng {self.session.customer}")
+        self.session = None
+        self.customer_label.configure(text="Khách vãng lai")
+        self.customer_button.configure(text="Khách hàng")
+        self.show_machine_totals(self.ledger.request_flush())
+
+    def show_machine_totals(self, flushed, deadline=None):
+        """
+        Hiện số liệu chung của máy sau khi luồng ghi sổ đã commit các giao dịch của phiên
+        (kiểm tra mỗi 50 ms trên luồng Tk, tối đa 1 giây), không chặn giao diện.
+        """
+        if self.session:
+            return  # Khách mới đã đăng nhập trong lúc chờ: giữ số liệu của phiên mới
+        deadline = deadline or time.monotonic() + 1.0
+        if not flushed.is_set() and time.monotonic() < deadline:
+            self.after(50, self.show_machine_totals, flushed, deadline)
+            return
+        summary = self.ledger.summary()
+        self.bottles_counted, self.cans_counted, self.total_points = summary["bottles"], summary["cans"], summary["balance"]
+        self.update_dashboard_display()
+
     def prompt_export(self):
         """Mở hộp thoại để người dùng nhập tên và gọi hàm xuất phiếu."""
+        if self.session:
+            self.export_receipt(self.session.customer.name)
+            return
         dialog = ctk.CTkInputDialog(text="Vui lòng nhập họ và tên để xuất phiếu:", title="Xuất Phiếu Tích Điểm")
         user_name = dialog.get_input()
         if user_name:
@@ -267,20 +425,31 @@ class RecyclingApp(ctk.CTk):
         else:
             print("Hủy xuất phiếu.")
 
-    # HÀM ĐƯỢC CẬP NHẬT: Giờ đây nó sử dụng class ReceiptPrinter
     def export_receipt(self, user_name):
         """
-        Xử lý logic gọi class in và hiển thị hộp thoại kết quả.
+        Đưa phiếu vào hàng đợi in (trả về ngay) và theo dõi kết quả để báo cho người dùng.
         """
-        success, message = self.printer.print_receipt(
+        job = self.print_spooler.submit(
             user_name=user_name,
             bottles=self.bottles_counted,
             cans=self.cans_counted,
-            points=self.total_points
+            points=self.session.points_earned if self.session else self.total_points,
+            balance=self.total_points if self.session else None,
+            user=self.session_user()
         )
-        if success:
-            CustomDialog(self, title="Thành Công", message=message)
-        else:
+        CustomDialog(self, title="Đang In", message=f"Phiếu của '{user_name}' đã được đưa vào hàng đợi in.")
+        self.watch_print_job(job)
+
+    def watch_print_job(self, job, warned=False):
+        """Kiểm tra trạng thái phiếu mỗi 500 ms trên luồng Tk, chỉ báo lại khi máy in treo hoặc in lỗi hẳn."""
+        if not job.done:
+            if job.status == job.UNKNOWN and not warned:
+                message = f"Máy in không phản hồi khi in phiếu của '{job.user_name}'.\n\nPhiếu sẽ không được in lại tự động, vui lòng kiểm tra máy in."
+                CustomDialog(self, title="Máy In Không Phản Hồi", message=message)
+                warned = True
+            self.after(500, self.watch_print_job, job, warned)
+        elif job.status == job.FAILED:
+            message = f"Không thể in phiếu của '{job.user_name}':\n{job.error}\n\nVui lòng kiểm tra lại kết nối máy in."
             CustomDialog(self, title="Lỗi In Ấn", message=message)
 
     def prompt_reset_stats(self):
@@ -293,7 +462,9 @@ class RecyclingApp(ctk.CTk):
     def reset_stats(self):
         """Đặt lại toàn bộ số liệu thống kê về 0."""
         print("Resetting statistics...")
+        self.end_customer_session()
         self.bottles_counted, self.cans_counted, self.total_points = 0, 0, 0
+        self.ledger.record_reset()
         self.last_confirmed_bottle_count = self.current_yolo_bottle_count
         self.last_confirmed_can_count = self.current_yolo_can_count
         self.update_dashboard_display()
@@ -330,7 +501,7 @@ class RecyclingApp(ctk.CTk):
 
         ## KÍCH THƯỚC VẬT PHẨM
         try:
-            img = Image.open(image_text)
+            img = ASSETS.image(image_text, (100, 220))
             ctk_img = ctk.CTkImage(light_image=img, size=(100, 220))
             ctk.CTkLabel(img_placeholder, image=ctk_img, text="").pack(expand=True)
         except Exception as e:
@@ -361,7 +532,15 @@ class RecyclingApp(ctk.CTk):
         """
         Trừ điểm khi người dùng đổi phần thưởng và cập nhật lại số điểm.
         """
-        self.total_points -= points_to_deduct
+        if self.session:
+            try:
+                self.total_points = self.accounts.debit(self.session, points_to_deduct)
+            except ValueError as e:
+                CustomDialog(self, title="Lỗi", message=str(e))
+                return
+        else:
+            self.total_points -= points_to_deduct
+        self.ledger.record_redeem(points_to_deduct, user=self.session_user())
         self.points_value_label.configure(text=str(self.total_points))
         print(f"Đã đổi vật phẩm! Trừ {points_to_deduct} điểm. Điểm còn lại: {self.total_points}")
 
@@ -390,21 +569,12 @@ def create_splash_screen(master):
     splash.overrideredirect(True)
     splash.configure(fg_color="#F9F9F9")  # Nền sáng
 
-    # --- Load và xử lý GIF ---
+    # --- Load GIF: giải mã dần từng frame, lần sau đọc thẳng từ cache đã resize ---
     frames = []
     gif_path = r"image\giphy.gif"  
 
     if os.path.exists(gif_path):
-        gif = Image.open(gif_path)
-        try:
-            while True:
-                frame = gif.copy().convert("RGBA").resize((315, 315))
-                # Sử dụng CTkImage
-                ctk_image = ctk.CTkImage(light_image=frame, dark_image=frame, size=(315, 315))
-                frames.append(ctk_image)
-                gif.seek(len(frames))
-        except EOFError:
-            pass
+        frames = CTkFrameSequence(ASSETS.gif(gif_path, (315, 315)), (315, 315))
     else:
         print(f"Warning: '{gif_path}' not found. Hiển thị placeholder.")
         frames = None
@@ -413,16 +583,9 @@ def create_splash_screen(master):
     image_label = ctk.CTkLabel(splash, text="")
     image_label.pack(pady=(50, 20))
 
-    # --- Hàm chạy GIF ---
-    def animate(frame_index=0):
-        if frames:
-            frame = frames[frame_index]
-            image_label.configure(image=frame)
-            next_index = (frame_index + 1) % len(frames)
-            splash.after(29, animate, next_index)
-
+    # --- Chạy GIF ---
     if frames:
-        animate()
+        GifPlayer(image_label).play(frames, loop=True)
     else:
         # Nếu không có GIF, hiện placeholder text
         image_label.configure(text="</>", font=ctk.CTkFont(size=100, family="Courier New", weight="bold"), text_color="#00FF7F")
@@ -457,14 +620,13 @@ def create_splash_screen(master):
     percentage_label.pack()
 
     # --- Hàm cập nhật tiến trình ---
+    # Chưa biết trước thời gian nạp model: thanh chạy chậm dần về 95%, splash đóng khi pipeline sẵn sàng
     def update_progress(value=0):
-        if value <= 1.0:
-            progress_bar.set(value)
-            percentage_label.configure(text=f"{int(value * 100)}%")
-            splash.after(28, update_progress, value + 0.01)
-        else:
-            progress_bar.set(1)
-            percentage_label.configure(text="100%")
+        if not splash.winfo_exists():
+            return
+        progress_bar.set(value)
+        percentage_label.configure(text=f"{int(value * 100)}%")
+        splash.after(28, update_progress, value + (0.95 - value) * 0.02)
 
     update_progress()
 
@@ -476,9 +638,13 @@ if __name__ == "__main__":
     app.withdraw()
     splash = create_splash_screen(app)
     def show_main_window():
-        splash.destroy()
-        app.deiconify()
+        # Đóng splash ngay khi luồng YOLO báo sẵn sàng (hoặc đã dừng vì lỗi) thay vì chờ cố định
+        if app.yolo_thread.ready.is_set() or not app.yolo_thread.is_alive():
+            splash.destroy()
+            app.deiconify()
+        else:
+            app.after(50, show_main_window)
 
-    app.after(3000, show_main_window)
+    app.after(50, show_main_window)
     app.iconbitmap(r"image\logo.ico") 
     app.mainloop()
@@ -1,5 +1,11 @@
 from get_library import *
 from backend_count import *
+from asset_cache import ASSETS, CTkFrameSequence
+from gif_player import GifPlayer
+from print_spooler import PrintSpooler
+from ledger import Ledger
+from event_bus import CountEvent, EventBus
+from accounts import AccountStore, is_phone
 # from toUart import *
 
 
@@ -70,28 +76,42 @@ class RecyclingApp(ctk.CTk):
         self.gif2_frames = []
         self.current_gif = 1
         self.gif_label = None
-        self.gif_animation_id = None
+        self.gif_player = None
         self.is_playing_gif2 = False
 
+        # --- Sổ giao dịch: khôi phục số liệu dashboard từ lần chạy trước ---
+        self.ledger = Ledger(r"data/ledger.db")
+        summary = self.ledger.summary()
+        # --- Tài khoản khách hàng (SĐT / mã QR), None = khách vãng lai ---
+        self.accounts = AccountStore(r"data/ledger.db")
+        self.accounts.close_stale_sessions()
+        self.session = None
+
         # --- Data Attributes ---
-        self.bottles_counted, self.cans_counted, self.total_points = 0, 0, 0
+        self.bottles_counted, self.cans_counted, self.total_points = summary["bottles"], summary["cans"], summary["balance"]
         self.current_yolo_bottle_count, self.current_yolo_can_count = 0, 0
         self.last_confirmed_bottle_count, self.last_confirmed_can_count = 0, 0
 
-        # --- THÊM MỚI: Khởi tạo đối tượng in ấn ---
-        self.printer = ReceiptPrinter()
+        # --- Hàng đợi in chạy nền: máy in chậm / mất kết nối không làm treo giao diện ---
+        self.print_spooler = PrintSpooler(on_update=self.ledger.record_receipt)
 
         # #--- Khởi tạo truyền gói tin---
         # self.send_uart = ESP32_UART(port='COM4', baudrate=9600)
 
-        # --- Threading and Queue Setup ---
-        self.yolo_queue = queue.Queue(maxsize=2)
+        # --- Threading and Event Bus Setup ---
+        # Giao diện này không hiển thị camera nên chỉ nhận lượt đếm (luồng YOLO không phải vẽ frame)
+        self.bus = EventBus()
+        self.count_events = self.bus.subscribe(CountEvent)
+        self.bus.subscribe(CountEvent, self.ledger.record_crossing)  # Chỉ đưa vào hàng đợi, không ghi đĩa trên luồng YOLO
         # Change to 0 for webcam, or keep the path for a video file
         video_source = 0
         self.yolo_thread = YOLOProcessor(
             video_path=video_source,
             model_path=r"model/best.pt",
-            output_queue=self.yolo_queue
+            output_queue=None,
+            bus=self.bus,
+            adaptive={"budget_ms": 100},  # Tự hạ imgsz / bỏ frame khi máy chậm, None = tắt
+            metrics_port=9108  # http://127.0.0.1:9108/metrics
         )
         self.yolo_thread.start()
 
@@ -144,6 +164,7 @@ class RecyclingApp(ctk.CTk):
         # self.camera_label.grid(row=1, column=0, padx=20, pady=5, sticky="ew") 
         self.gif_label = ctk.CTkLabel(self.left_frame, text="")
         self.gif_label.grid(row=1, column=0, padx=20, pady=5, sticky="ew")
+        self.gif_player = GifPlayer(self.gif_label)
         self.gif_frames = self.load_gif_frames(self.gif1_path)
         self.gif2_frames = self.load_gif_frames(self.gif2_path)
         self.play_gif(self.gif_frames, loop=True)
@@ -156,39 +177,15 @@ class RecyclingApp(ctk.CTk):
         confirm_button.grid(row=2, column=0, padx=120, pady=(5, 20), sticky="ew")
 
     def load_gif_frames(self, gif_path):
-        frames = []
+        """Dãy frame GIF 480x480 giải mã khi cần (lần sau đọc từ cache trên đĩa)."""
         if os.path.exists(gif_path):
-            gif = Image.open(gif_path)
-            try:
-                while True:
-                    frame = gif.copy().convert("RGBA")
-                    ctk_image = ctk.CTkImage(light_image=frame, size=(480, 480))
-                    frames.append(ctk_image)
-                    gif.seek(len(frames))
-            except EOFError:
-                pass
-        return frames
+            return CTkFrameSequence(ASSETS.gif(gif_path, (480, 480)), (480, 480))
+        return []
 
     def play_gif(self, frames, loop=True, on_complete=None):
-        if not frames:
-            return
-        if self.gif_animation_id:
-            self.after_cancel(self.gif_animation_id)
-        self._play_gif_frame(frames, 0, loop, on_complete)
-
-    def _play_gif_frame(self, frames, idx, loop, on_complete):
-        if not self.gif_label:
-            return
-        self.gif_label.configure(image=frames[idx])
-        self.gif_label.image = frames[idx]
-        next_idx = idx + 1
-        if next_idx < len(frames):
-            self.gif_animation_id = self.after(20, self._play_gif_frame, frames, next_idx, loop, on_complete)
-        else:
-            if loop:
-                self.gif_animation_id = self.after(20, self._play_gif_frame, frames, 0, loop, on_complete)
-            elif on_complete:
-                on_complete()
+        """Phát GIF lên gif_label theo thời gian từng frame, bỏ frame nếu Tk đang trễ."""
+        if self.gif_player:
+            self.gif_player.play(frames, loop=loop, on_complete=on_complete)
 
     def animate_title(self, colors=None, idx=0):
         """
@@ -206,7 +203,12 @@ class RecyclingApp(ctk.CTk):
             print(f"Xác nhận {newly_detected_bottles} chai và {newly_detected_cans} lon mới.")
             self.bottles_counted += newly_detected_bottles
             self.cans_counted += newly_detected_cans
-            self.total_points += ((newly_detected_bottles * 1.5) +( newly_detected_cans * 0.5)) 
+            points = compute_points(newly_detected_bottles, newly_detected_cans)
+            if self.session:
+                self.total_points = self.accounts.credit(self.session, newly_detected_bottles, newly_detected_cans, points)
+            else:
+                self.total_points += points
+            self.ledger.record_confirm(newly_detected_bottles, newly_detected_cans, points, user=self.session_user())
             
             self.last_confirmed_bottle_count = self.current_yolo_bottle_count
             self.last_confirmed_can_count = self.current_yolo_can_count
@@ -217,21 +219,19 @@ class RecyclingApp(ctk.CTk):
 
     def update_camera_feed(self):
         """
-        Lấy frame mới nhất từ queue và hiển thị lên giao diện.
+        Nhận các CountEvent mới (mỗi vật đi qua line một sự kiện) và phát GIF khi có vật mới.
         """
         try:
-            frame, bottle_count, can_count = self.yolo_queue.get_nowait()
-            # Phát hiện có vật mới đi qua line
-            if (bottle_count > self.current_yolo_bottle_count or can_count > self.current_yolo_can_count) and not self.is_playing_gif2:
-                self.is_playing_gif2 = True
-                def on_gif2_done():
-                    self.is_playing_gif2 = False
-                    self.play_gif(self.gif_frames, loop=True)
-                self.play_gif(self.gif2_frames, loop=False, on_complete=on_gif2_done)
-            self.current_yolo_bottle_count = bottle_count
-            self.current_yolo_can_count = can_count
-        except queue.Empty:
-            pass
+            events = self.count_events.drain()
+            if events:
+                self.current_yolo_bottle_count = events[-1].bottle_count
+                self.current_yolo_can_count = events[-1].can_count
+                if not self.is_playing_gif2:
+                    self.is_playing_gif2 = True
+                    def on_gif2_done():
+                        self.is_playing_gif2 = False
+                        self.play_gif(self.gif_frames, loop=True)
+                    self.play_gif(self.gif2_frames, loop=False, on_complete=on_gif2_done)
         finally:
             self.after(20, self.update_camera_feed)
 
@@ -242,6 +242,11 @@ class RecyclingApp(ctk.CTk):
         print("Đang đóng ứng dụng...")
         self.yolo_thread.stop()
         self.yolo_thread.join(timeout=1.0) # Wait for the thread to finish
+        self.print_spooler.close(timeout=1.0)  # Phiếu chưa in vẫn nằm trong spool/ cho lần sau
+        if self.session:
+            self.accounts.end_session(self.session)
+        self.accounts.close()
+        self.ledger.close(timeout=2.0)
         print("Luồng xử lý đã dừng. Đóng cửa sổ.")
         self.destroy()
 
@@ -257,7 +262,17 @@ class RecyclingApp(ctk.CTk):
         header_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=(0, 20))
         header_frame.grid_columnconfigure(0, weight=1)
         dashboard_label = ctk.CTkLabel(header_frame, text="Dashboard", font=ctk.CTkFont(size=24, weight="bold"), text_color=DARK_GREEN)
-        dashboard_label.grid(row=0, column=0, sticky="w", pady=20)
+        dashboard_label.grid(row=0, column=0, sticky="w", pady=(20, 0))
+        self.customer_label = ctk.CTkLabel(header_frame, text="Khách vãng lai", font=ctk.CTkFont(size=14), text_color=PRIMARY_GREEN)
+        self.customer_label.grid(row=1, column=0, sticky="w")
+
+        # --- NÚT KHÁCH HÀNG: đăng nhập bằng SĐT / quét QR, bấm lần nữa để kết thúc phiên ---
+        self.customer_button = ctk.CTkButton(
+            header_frame, text="Khách hàng", font=ctk.CTkFont(weight="bold"),
+            fg_color="transparent", border_color=PRIMARY_GREEN, text_color=PRIMARY_GREEN,
+            border_width=2, hover_color=SECONDARY_GREEN, command=self.prompt_customer
+        )
+        self.customer_button.grid(row=0, column=1, rowspan=2, sticky="e", padx=(0, 10))
 
         # --- NÚT EXPORT MỚI ---
         try:
@@ -276,7 +291,7 @@ class RecyclingApp(ctk.CTk):
                 fg_color="transparent", border_color=PRIMARY_GREEN, text_color=PRIMARY_GREEN,
                 border_width=2, hover_color=SECONDARY_GREEN, command=self.prompt_export
             )
-        export_button.grid(row=0, column=1, sticky="e")
+        export_button.grid(row=0, column=2, rowspan=2, sticky="e")
         
         stats_frame = ctk.CTkFrame(self.right_frame, fg_color="transparent")
         stats_frame.grid(row=1, column=0, sticky="ew", pady=10)
@@ -308,8 +323,74 @@ class RecyclingApp(ctk.CTk):
         )
         reset_button.grid(row=4, column=0, padx=10, pady=(5, 10), sticky="ew")
 
+    def session_user(self):
+        """Id khách hàng ghi vào sổ giao dịch (None với khách vãng lai)."""
+        return self.session.user if self.session else None
+
+    def prompt_customer(self):
+        """
+        Bắt đầu phiên khách hàng: nhập SĐT hoặc quét mã QR (máy quét gõ như bàn phím),
+        chưa có tài khoản thì hỏi tên để đăng ký. Đang có phiên thì hỏi kết thúc phiên.
+        """
+        if self.session:
+            message = f"Kết thúc phiên của '{self.session.customer.name}'?"
+            CustomDialog(self, title="Kết thúc phiên", message=message, is_confirm=True, command=self.end_customer_session)
+            return
+        key = ctk.CTkInputDialog(text="Nhập số điện thoại hoặc quét mã QR:", title="Khách hàng").get_input()
+        if not key:
+            return
+        customer = self.accounts.find(key)
+        if customer is None:
+            name = ctk.CTkInputDialog(text="Khách hàng mới, vui lòng nhập họ và tên:", title="Đăng ký").get_input()
+            if not name:
+                return
+            phone = is_phone(key)
+            try:
+                customer = self.accounts.register(name, phone=key if phone else None, qr_id=None if phone else key)
+            except ValueError as e:
+                CustomDialog(self, title="Lỗi", message=str(e))
+                return
+        self.start_customer_session(customer)
+
+    def start_customer_session(self, customer):
+        self.session = self.accounts.start_session(customer)
+        print(f"Bắt đầu phiên khách hàng {customer}")
+        self.bottles_counted, self.cans_counted, self.total_points = 0, 0, customer.balance
+        self.customer_label.configure(text=f"{customer.name} - {customer.phone or customer.qr_id or customer.id}")
+        self.customer_button.configure(text="Kết thúc phiên")
+        self.update_dashboard_display()
+
+    def end_customer_session(self):
+        """Kết thúc phiên, dashboard quay về số liệu chung của máy (lấy từ sổ giao dịch)."""
+        if not self.session:
+            return
+        self.accounts.end_session(self.session)
+        print(f"Kết thúc phiên khách hàng {self.session.customer}")
+        self.session = None
+        self.customer_label.configure(text="Khách vãng lai")
+        self.customer_button.configure(text="Khách hàng")
+        self.show_machine_totals(self.ledger.request_flush())
+
+    def show_machine_totals(self, flushed, deadline=None):
+        """
+        Hiện số liệu chung của máy sau khi luồng ghi sổ đã commit các giao dịch của phiên
+        (kiểm tra mỗi 50 ms trên luồng Tk, tối đa 1 giây), không chặn giao diện.
+        """
+        if self.session:
+            return  # Khách mới đã đăng nhập trong lúc chờ: giữ số liệu của phiên mới
+        deadline = deadline or time.monotonic() + 1.0
+        if not flushed.is_set() and time.monotonic() < deadline:
+            self.after(50, self.show_machine_totals, flushed, deadline)
+            return
+        summary = self.ledger.summary()
+        self.bottles_counted, self.cans_counted, self.total_points = summary["bottles"], summary["cans"], summary["balance"]
+        self.update_dashboard_display()
+
     def prompt_export(self):
         """Mở hộp thoại để người dùng nhập tên và gọi hàm xuất phiếu."""
+        if self.session:
+            self.export_receipt(self.session.customer.name)
+            return
         dialog = ctk.CTkInputDialog(text="Vui lòng nhập họ và tên để xuất phiếu:", title="Xuất Phiếu Tích Điểm")
         user_name = dialog.get_input()
         if user_name:
@@ -317,20 +398,31 @@ class RecyclingApp(ctk.CTk):
         else:
             print("Hủy xuất phiếu.")
 
-    # HÀM ĐƯỢC CẬP NHẬT: Giờ đây nó sử dụng class ReceiptPrinter
     def export_receipt(self, user_name):
         """
-        Xử lý logic gọi class in và hiển thị hộp thoại kết quả.
+        Đưa phiếu vào hàng đợi in (trả về ngay) và theo dõi kết quả để báo cho người dùng.
         """
-        success, message = self.printer.print_receipt(
+        job = self.print_spooler.submit(
             user_name=user_name,
             bottles=self.bottles_counted,
             cans=self.cans_counted,
-            points=self.total_points
+            points=self.session.points_earned if self.session else self.total_points,
+            balance=self.total_points if self.session else None,
+            user=self.session_user()
         )
-        if success:
-            CustomDialog(self, title="Thành Công", message=message)
-        else:
+        CustomDialog(self, title="Đang In", message=f"Phiếu của '{user_name}' đã được đưa vào hàng đợi in.")
+        self.watch_print_job(job)
+
+    def watch_print_job(self, job, warned=False):
+        """Kiểm tra trạng thái phiếu mỗi 500 ms trên luồng Tk, chỉ báo lại khi máy in treo hoặc in lỗi hẳn."""
+        if not job.done:
+            if job.status == job.UNKNOWN and not warned:
+                message = f"Máy in không phản hồi khi in phiếu của '{job.user_name}'.\n\nPhiếu sẽ không được in lại tự động, vui lòng kiểm tra máy in."
+                CustomDialog(self, title="Máy In Không Phản Hồi", message=message)
+                warned = True
+            self.after(500, self.watch_print_job, job, warned)
+        elif job.status == job.FAILED:
+            message = f"Không thể in phiếu của '{job.user_name}':\n{job.error}\n\nVui lòng kiểm tra lại kết nối máy in."
             CustomDialog(self, title="Lỗi In Ấn", message=message)
 
     def prompt_reset_stats(self):
@@ -343,7 +435,9 @@ class RecyclingApp(ctk.CTk):
     def reset_stats(self):
         """Đặt lại toàn bộ số liệu thống kê về 0."""
         print("Resetting statistics...")
+        self.end_customer_session()
         self.bottles_counted, self.cans_counted, self.total_points = 0, 0, 0
+        self.ledger.record_reset()
         self.last_confirmed_bottle_count = self.current_yolo_bottle_count
         self.last_confirmed_can_count = self.current_yolo_can_count
         self.update_dashboard_display()
@@ -380,7 +474,7 @@ class RecyclingApp(ctk.CTk):
 
         ## KÍCH THƯỚC VẬT PHẨM
         try:
-            img = Image.open(image_text)
+            img = ASSETS.image(image_text, (100, 220))
             ctk_img = ctk.CTkImage(light_image=img, size=(100, 220))
             ctk.CTkLabel(img_placeholder, image=ctk_img, text="").pack(expand=True)
         except Exception as e:
@@ -411,7 +505,15 @@ class RecyclingApp(ctk.CTk):
         """
         Trừ điểm khi người dùng đổi phần thưởng và cập nhật lại số điểm.
         """
-        self.total_points -= points_to_deduct
+        if self.session:
+            try:
+                self.total_points = self.accounts.debit(self.session, points_to_deduct)
+            except ValueError as e:
+                CustomDialog(self, title="Lỗi", message=str(e))
+                return
+        else:
+            self.total_points -= points_to_deduct
+        self.ledger.record_redeem(points_to_deduct, user=self.session_user())
         self.points_value_label.configure(text=str(self.total_points))
         print(f"Đã đổi vật phẩm! Trừ {points_to_deduct} điểm. Điểm còn lại: {self.total_points}")
 
@@ -440,21 +542,12 @@ def create_splash_screen(master):
     splash.overrideredirect(True)
     splash.configure(fg_color="#F9F9F9")  # Nền sáng
 
-    # --- Load và xử lý GIF ---
+    # --- Load GIF: giải mã dần từng frame, lần sau đọc thẳng từ cache đã resize ---
     frames = []
     gif_path = r"image\giphy.gif"  
 
     if os.path.exists(gif_path):
-        gif = Image.open(gif_path)
-        try:
-            while True:
-                frame = gif.copy().convert("RGBA").resize((315, 315))
-                # Sử dụng CTkImage
-                ctk_image = ctk.CTkImage(light_image=frame, dark_image=frame, size=(315, 315))
-                frames.append(ctk_image)
-                gif.seek(len(frames))
-        except EOFError:
-            pass
+        frames = CTkFrameSequence(ASSETS.gif(gif_path, (315, 315)), (315, 315))
     else:
         print(f"Warning: '{gif_path}' not found. Hiển thị placeholder.")
         frames = None
@@ -463,16 +556,9 @@ def create_splash_screen(master):
     image_label = ctk.CTkLabel(splash, text="")
     image_label.pack(pady=(50, 20))
 
-    # --- Hàm chạy GIF ---
-    def animate(frame_index=0):
-        if frames:
-            frame = frames[frame_index]
-            image_label.configure(image=frame)
-            next_index = (frame_index + 1) % len(frames)
-            splash.after(29, animate, next_index)
-
+    # --- Chạy GIF ---
     if frames:
-        animate()
+        GifPlayer(image_label).play(frames, loop=True)
     else:
         # Nếu không có GIF, hiện placeholder text
         image_label.configure(text="</>", font=ctk.CTkFont(size=100, family="Courier New", weight="bold"), text_color="#00FF7F")
@@ -507,14 +593,13 @@ def create_splash_screen(master):
     percentage_label.pack()
 
     # --- Hàm cập nhật tiến trình ---
+    # Chưa biết trước thời gian nạp model: thanh chạy chậm dần về 95%, splash đóng khi pipeline sẵn sàng
     def update_progress(value=0):
-        if value <= 1.0:
-            progress_bar.set(value)
-            percentage_label.configure(text=f"{int(value * 100)}%")
-            splash.after(28, update_progress, value + 0.01)
-        else:
-            progress_bar.set(1)
-            percentage_label.configure(text="100%")
+        if not splash.winfo_exists():
+            return
+        progress_bar.set(value)
+        percentage_label.configure(text=f"{int(value * 100)}%")
+        splash.after(28, update_progress, value + (0.95 - value) * 0.02)
 
     update_progress()
 
@@ -526,9 +611,15 @@ if __name__ == "__main__":
     app.withdraw()
     splash = create_splash_screen(app)
     def show_main_window():
-        splash.destroy()
-        app.deiconify()
+        # Đóng splash ngay khi luồng YOLO báo sẵn sàng (hoặc đã dừng vì lỗi) thay vì chờ cố định
+        if app.yolo_thread.ready.is_set() or not app.yolo_thread.is_alive():
+            splash.destroy()
+            app.deiconify()
+        else:
+            app.after(50, show_main_window)
 
-    app.after(3000, show_main_window)
+    # GIF ăn mừng chưa hiện ngay: tạo sẵn cache ở luồng nền trong lúc chờ model
+    ASSETS.warm(gifs=[(app.gif2_path, (480, 480))])
+    app.after(50, show_main_window)
     app.iconbitmap(r"image\logo.ico") 
     app.mainloop()
@@ -0,0 +1,221 @@
+import re
+import sqlite3
+import threading
+import time
+
+from ledger import connect
+
+# ===============================================================
+# TÀI KHOẢN KHÁCH HÀNG: số dư điểm, phiên sử dụng, lịch sử
+# ===============================================================
+#
+# Dùng chung file SQLite với sổ giao dịch (data/ledger.db) nhưng kết nối
+# riêng. Mọi tra cứu đi qua index (số điện thoại, mã QR, tên, id khách trong
+# sessions) nên vẫn là O(log n) khi có hàng trăm nghìn khách. Số dư được cập
+# nhật đồng bộ trong một transaction (chỉ khi người dùng bấm nút, không nằm
+# trên luồng nhận diện); trừ điểm dùng điều kiện balance >= ? trong chính câu
+# UPDATE nên không bao giờ âm.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id        INTEGER PRIMARY KEY,
+    name      TEXT NOT NULL,
+    phone     TEXT UNIQUE,
+    qr_id     TEXT UNIQUE,
+    balance   REAL NOT NULL DEFAULT 0,
+    bottles   INTEGER NOT NULL DEFAULT 0,
+    cans      INTEGER NOT NULL DEFAULT 0,
+    created   REAL NOT NULL,
+    last_seen REAL
+);
+CREATE INDEX IF NOT EXISTS customers_name ON customers (name COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id              INTEGER PRIMARY KEY,
+    customer_id     INTEGER NOT NULL REFERENCES customers (id),
+    started         REAL NOT NULL,
+    ended           REAL,
+    bottles         INTEGER NOT NULL DEFAULT 0,
+    cans            INTEGER NOT NULL DEFAULT 0,
+    points_earned   REAL NOT NULL DEFAULT 0,
+    points_redeemed REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_customer ON sessions (customer_id, started);
+"""
+
+CUSTOMER_COLUMNS = ("id", "name", "phone", "qr_id", "balance", "bottles", "cans", "created", "last_seen")
+SESSION_COLUMNS = ("id", "customer_id", "started", "ended", "bottles", "cans", "points_earned", "points_redeemed")
+
+
+def normalize_phone(phone):
+    """Chỉ giữ chữ số, đổi +84 thành 0 (0912 345 678, +84912345678 -> 0912345678)."""
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("84") and len(digits) == 11:
+        digits = "0" + digits[2:]
+    return digits or None
+
+
+def is_phone(key):
+    """
+    Chuỗi nhập vào là số điện thoại Việt Nam hay mã QR. Số điện thoại bắt đầu bằng
+    0 hoặc +84, sau khi chuẩn hoá là 10-11 chữ số bắt đầu bằng 0 (cho phép khoảng
+    trắng, ( ) . -). Mã thẻ / QR toàn chữ số không đúng dạng này được coi là mã QR.
+    """
+    key = (key or "").strip()
+    if not re.fullmatch(r"\(?(0|\+\s*84)[\d\s().-]+", key):
+        return False
+    return re.fullmatch(r"0\d{9,10}", normalize_phone(key) or "") is not None
+
+
+class Customer:
+    def __init__(self, id, name, phone, qr_id, balance, bottles, cans, created, last_seen):
+        self.id = id
+        self.name = name
+        self.phone = phone
+        self.qr_id = qr_id
+        self.balance = balance
+        self.bottles = bottles
+        self.cans = cans
+        self.created = created
+        self.last_seen = last_seen
+
+    def __repr__(self):
+        return f"Customer({self.id}, {self.name!r}, {self.balance:g} điểm)"
+
+
+class Session:
+    """Một lượt khách đứng ở máy: từ lúc đăng nhập (SĐT/QR) tới lúc kết thúc."""
+    def __init__(self, id, customer, started):
+        self.id = id
+        self.customer = customer
+        self.started = started
+        self.bottles = 0
+        self.cans = 0
+        self.points_earned = 0.0
+        self.points_redeemed = 0.0
+
+    @property
+    def user(self):
+        """Giá trị cột user trong sổ giao dịch."""
+        return str(self.customer.id)
+
+
+class AccountStore:
+    def __init__(self, path=r"data/ledger.db"):
+        self.conn = connect(path)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def _customer(self, where, args):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(CUSTOMER_COLUMNS)} FROM customers WHERE {where}", args).fetchone()
+        return Customer(*row) if row else None
+
+    # --- Tra cứu ---
+
+    def get(self, customer_id):
+        return self._customer("id = ?", (customer_id,))
+
+    def find(self, key):
+        """Tìm theo số điện thoại hoặc mã QR (chuỗi quét được từ thẻ / app)."""
+        key = (key or "").strip()
+        if not key:
+            return None
+        if is_phone(key):
+            customer = self._customer("phone = ?", (normalize_phone(key),))
+            if customer:
+                return customer
+        return self._customer("qr_id = ?", (key,))
+
+    def search(self, name_prefix, limit=10):
+        """Khách có tên bắt đầu bằng name_prefix (không phân biệt hoa thường), dùng index theo tên."""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(CUSTOMER_COLUMNS)} FROM customers "
+                "WHERE name LIKE ? ESCAPE '\\' ORDER BY name COLLATE NOCASE LIMIT ?",
+                (re.sub(r"([%_\\])", r"\\\1", name_prefix) + "%", limit)).fetchall()
+        return [Customer(*row) for row in rows]
+
+    def register(self, name, phone=None, qr_id=None):
+        name = (name or "").strip()
+        if not name:
+            raise ValueError("Tên khách hàng không được để trống.")
+        try:
+            with self.lock, self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO customers (name, phone, qr_id, created) VALUES (?, ?, ?, ?)",
+                    (name, normalize_phone(phone), (qr_id or "").strip() or None, time.time()))
+        except sqlite3.IntegrityError:
+            raise ValueError("Số điện thoại hoặc mã QR đã được đăng ký cho khách khác.")
+        return self.get(cursor.lastrowid)
+
+    # --- Phiên ---
+
+    def start_session(self, customer):
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute("INSERT INTO sessions (customer_id, started) VALUES (?, ?)",
+                                       (customer.id, now))
+            self.conn.execute("UPDATE customers SET last_seen = ? WHERE id = ?", (now, customer.id))
+        return Session(cursor.lastrowid, customer, now)
+
+    def end_session(self, session):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE sessions SET ended = ? WHERE id = ? AND ended IS NULL",
+                              (time.time(), session.id))
+
+    def close_stale_sessions(self):
+        """Đóng các phiên còn mở do ứng dụng bị tắt đột ngột ở lần chạy trước."""
+        with self.lock, self.conn:
+            return self.conn.execute("UPDATE sessions SET ended = started WHERE ended IS NULL").rowcount
+
+    # --- Điểm ---
+
+    def credit(self, session, bottles, cans, points):
+        """Cộng chai/lon/điểm vào tài khoản và phiên; trả về số dư mới."""
+        customer = session.customer
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE customers SET balance = balance + ?, bottles = bottles + ?, cans = cans + ?, last_seen = ? "
+                "WHERE id = ?", (points, bottles, cans, time.time(), customer.id))
+            self.conn.execute(
+                "UPDATE sessions SET bottles = bottles + ?, cans = cans + ?, points_earned = points_earned + ? "
+                "WHERE id = ?", (bottles, cans, points, session.id))
+            customer.balance, customer.bottles, customer.cans = self.conn.execute(
+                "SELECT balance, bottles, cans FROM customers WHERE id = ?", (customer.id,)).fetchone()
+        session.bottles += bottles
+        session.cans += cans
+        session.points_earned += points
+        return customer.balance
+
+    def debit(self, session, points):
+        """Trừ điểm khi đổi quà; ValueError nếu số dư không đủ. Trả về số dư mới."""
+        customer = session.customer
+        with self.lock, self.conn:
+            updated = self.conn.execute(
+                "UPDATE customers SET balance = balance - ?, last_seen = ? WHERE id = ? AND balance >= ?",
+                (points, time.time(), customer.id, points)).rowcount
+            if updated:
+                self.conn.execute("UPDATE sessions SET points_redeemed = points_redeemed + ? WHERE id = ?",
+                                  (points, session.id))
+            customer.balance = self.conn.execute(
+                "SELECT balance FROM customers WHERE id = ?", (customer.id,)).fetchone()[0]
+        if not updated:
+            raise ValueError(f"Không đủ điểm (còn {customer.balance:g}, cần {points:g}).")
+        session.points_redeemed += points
+        return customer.balance
+
+    # --- Lịch sử ---
+
+    def history(self, customer_id, limit=20):
+        """Các phiên gần nhất của khách (mới nhất trước)."""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions WHERE customer_id = ? "
+                "ORDER BY started DESC LIMIT ?", (customer_id, limit)).fetchall()
+        return [dict(zip(SESSION_COLUMNS, row)) for row in rows]
+
+    def close(self):
+        self.conn.close()
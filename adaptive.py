@@ -0,0 +1,155 @@
+import math
+
+# ===============================================================
+# ĐIỀU KHIỂN THÍCH ỨNG: imgsz / bỏ frame / tracker theo độ trễ đo được
+# ===============================================================
+#
+# Cùng một bản build chạy trên máy có GPU lẫn máy Celeron, nên thay vì cố định
+# imgsz=640 và suy luận mọi frame, bộ điều khiển chọn lại sau mỗi lần suy luận:
+#   imgsz   thấp nhất trong thang (vd. 320) khi máng trống hoặc vật còn xa line;
+#           chỉ nâng lên khi có vật nằm trong near_margin pixel quanh line đếm,
+#           và chỉ tới mức mà độ trễ ước tính vẫn nằm trong budget_ms.
+#   skip    suy luận 1 frame mỗi skip frame (cổng chuyển động mở nhưng chưa có
+#           vật, hoặc quá tải ngay cả ở imgsz thấp nhất). Khi có vật gần line
+#           luôn suy luận mọi frame để không lỡ lần cắt line.
+#   tracker khi bỏ frame, vật đi xa hơn giữa hai lần cập nhật tracker: nới
+#           match_thresh và rút số lần cập nhật được phép mất dấu để thời gian
+#           giữ track (tính bằng giây) không đổi.
+# Độ trễ mỗi mức imgsz được làm trơn riêng (EMA); mức chưa đo thì ước tính theo
+# diện tích ảnh từ mức gần nhất đã đo.
+
+
+class AdaptiveController:
+    def __init__(self, budget_ms=120.0, sizes=(320, 416, 640), max_imgsz=640, near_margin=80,
+                 max_skip=3, idle_skip=2, hold_frames=15, smoothing=0.2):
+        """
+        Args:
+            budget_ms (float): Độ trễ tối đa cho một frame (cổng + suy luận + tracker + đếm).
+            sizes (tuple): Thang imgsz, mức lớn hơn max_imgsz bị bỏ.
+            max_imgsz (int): imgsz của model / ROI (không bao giờ vượt quá).
+            near_margin (float): Khoảng cách (pixel, toạ độ frame) tới line coi là "gần line".
+            max_skip (int): Số frame tối đa giữa hai lần suy luận khi quá tải.
+            idle_skip (int): Số frame giữa hai lần suy luận khi cổng mở nhưng chưa thấy vật.
+            hold_frames (int): Số lần suy luận giữ mức imgsz cao sau khi vật rời vùng gần line.
+            smoothing (float): Hệ số EMA của độ trễ.
+        """
+        self.sizes = sorted(s for s in set(sizes) if s <= max_imgsz) or [max_imgsz]
+        self.budget_ms = budget_ms
+        self.near_margin = near_margin
+        self.max_skip = max(1, max_skip)
+        self.idle_skip = max(1, idle_skip)
+        self.hold_frames = hold_frames
+        self.smoothing = smoothing
+
+        self.level = 0
+        self.skip = 1
+        self.latency = [None] * len(self.sizes)
+        self.hold = 0
+        self.countdown = 0
+
+        # Tham số gốc của tracker (lấy ở lần tune_tracker đầu tiên)
+        self.tracker_base = None
+        self.tracker_skip = 1
+
+        # --- Thống kê ---
+        self.inferred = 0
+        self.skipped = 0
+        self.escalations = 0
+        self.over_budget = 0
+
+    @property
+    def imgsz(self):
+        return self.sizes[self.level]
+
+    def estimate(self, level):
+        """Độ trễ (ms) dự kiến ở mức level; None nếu chưa đo được mức nào."""
+        if self.latency[level] is not None:
+            return self.latency[level]
+        measured = [i for i, value in enumerate(self.latency) if value is not None]
+        if not measured:
+            return None
+        nearest = min(measured, key=lambda i: abs(i - level))
+        return self.latency[nearest] * (self.sizes[level] / self.sizes[nearest]) ** 2
+
+    def _fits(self, level):
+        latency = self.estimate(level)
+        return latency is None or latency <= self.budget_ms
+
+    def should_infer(self):
+        """Gọi mỗi frame khi cổng chuyển động mở; False = bỏ suy luận frame này."""
+        if self.countdown > 0:
+            self.countdown -= 1
+            self.skipped += 1
+            return False
+        self.countdown = self.skip - 1
+        self.inferred += 1
+        return True
+
+    def observe(self, latency_ms, distances=None):
+        """
+        Cập nhật sau một lần suy luận và chọn imgsz / skip cho các frame tiếp theo.
+
+        Args:
+            latency_ms (float): Thời gian xử lý frame vừa rồi.
+            distances: Khoảng cách từ tâm từng track tới line (None / rỗng = không có vật).
+        """
+        previous = self.latency[self.level]
+        self.latency[self.level] = latency_ms if previous is None else \
+            previous + self.smoothing * (latency_ms - previous)
+        over = self.latency[self.level] > self.budget_ms
+        if over:
+            self.over_budget += 1
+
+        active = distances is not None and len(distances) > 0
+        near = active and min(distances) <= self.near_margin
+
+        if near:
+            # Nâng lên mức cao nhất còn vừa budget
+            target = 0
+            for level in range(len(self.sizes)):
+                if self._fits(level):
+                    target = level
+            if target > self.level:
+                self.escalations += 1
+                self.level = target
+            elif over and self.level > 0:
+                self.level -= 1
+            self.hold = self.hold_frames
+        elif self.level > 0:
+            # Giữ mức cao thêm hold_frames lần để vật vừa qua line không bị đổi imgsz giữa chừng
+            self.hold -= 1
+            if self.hold <= 0 or over:
+                self.level -= 1
+
+        if near:
+            self.skip = 1
+        else:
+            lowest = self.estimate(0) or 0.0
+            overload = min(self.max_skip, math.ceil(lowest / self.budget_ms)) if lowest > self.budget_ms else 1
+            self.skip = max(overload, 1 if active else self.idle_skip)
+        self.countdown = min(self.countdown, self.skip - 1)
+
+    def idle(self):
+        """Cổng chuyển động đóng (máng trống): quay về mức thấp nhất."""
+        self.level = 0
+        self.hold = 0
+        self.countdown = 0
+
+    def tune_tracker(self, tracker):
+        """Chỉnh tracker Ultralytics (BYTETracker / BOTSORT) theo skip hiện tại."""
+        if tracker is None or self.tracker_skip == self.skip and self.tracker_base is not None:
+            return
+        # Ultralytics < 8.3 dùng max_time_lost, bản mới dùng max_frames_lost
+        lost_attr = "max_frames_lost" if hasattr(tracker, "max_frames_lost") else "max_time_lost"
+        if self.tracker_base is None:
+            self.tracker_base = (tracker.args.match_thresh, getattr(tracker, lost_attr))
+        match_thresh, max_lost = self.tracker_base
+        tracker.args.match_thresh = min(0.95, match_thresh + 0.05 * (self.skip - 1))
+        setattr(tracker, lost_attr, max(1, math.ceil(max_lost / self.skip)))
+        self.tracker_skip = self.skip
+
+    def stats(self):
+        latency = self.latency[self.level]
+        return {"imgsz": self.imgsz, "skip": self.skip, "latency_ms": round(latency or 0.0, 1),
+                "inferred": self.inferred, "skipped": self.skipped,
+                "escalations": self.escalations, "over_budget": self.over_budget}
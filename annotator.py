@@ -0,0 +1,67 @@
+import time
+
+import cv2
+import numpy as np
+
+# Bảng màu theo track id (giống color_mode='instance' của Ultralytics), BGR
+PALETTE = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+           (10, 249, 72), (23, 204, 146), (134, 219, 61), (211, 188, 0), (209, 85, 0),
+           (255, 115, 0), (255, 149, 200), (236, 24, 0), (255, 56, 132), (133, 0, 82)]
+
+
+class Annotator:
+    """
+    Vẽ kết quả lên frame hiển thị, tại chỗ (không tạo bản sao như results.plot()).
+
+    Gồm box + nhãn/id theo màu của track, tâm box, line đếm (đỏ khi vừa có vật đi
+    qua), khung ROI và bộ đếm. Chỉ nên gọi cho luồng hình đang được hiển thị;
+    due() giới hạn số frame được vẽ mỗi giây (max_fps=None = vẽ mọi frame).
+    """
+    def __init__(self, class_names, max_fps=15.0, font_scale=0.5):
+        self.class_names = class_names
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.font_scale = font_scale
+        self.next_due = 0.0
+
+        # --- Thống kê ---
+        self.drawn = 0
+        self.skipped = 0
+
+    def due(self):
+        """Đã tới lượt vẽ frame tiếp theo chưa (gọi một lần mỗi frame)."""
+        now = time.monotonic()
+        if now < self.next_due:
+            self.skipped += 1
+            return False
+        # Bám theo lịch thay vì now + interval để tốc độ trung bình đúng max_fps
+        self.next_due = max(self.next_due + self.min_interval, now)
+        return True
+
+    def draw(self, frame, tracks, counter=None, roi=None, counts=None, highlight=False):
+        """
+        Args:
+            frame: Ảnh BGR, được vẽ đè tại chỗ.
+            tracks: Mảng (N, 7) [x1, y1, x2, y2, track_id, conf, cls] theo toạ độ frame.
+            counter (LineCounter), roi (RegionOfInterest): Vẽ line đếm / khung ROI nếu có.
+            counts: Danh sách (nhãn, giá trị, màu) vẽ ở góc trên bên trái.
+            highlight: Vừa có vật đi qua line (line vẽ màu đỏ).
+        """
+        self.drawn += 1
+        if roi is not None:
+            roi.draw(frame)
+        if counter is not None:
+            counter.draw(frame, (0, 0, 255) if highlight else (0, 255, 255))
+        if len(tracks):
+            boxes = tracks[:, :4].astype(np.int32)
+            ids = tracks[:, 4].astype(np.int64)
+            cls_ids = tracks[:, 6].astype(np.int64)
+            centers = (boxes[:, :2] + boxes[:, 2:]) // 2
+            for (x1, y1, x2, y2), track_id, cls_id, center in zip(boxes, ids, cls_ids, centers):
+                color = PALETTE[track_id % len(PALETTE)]
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                label = f"{self.class_names.get(int(cls_id), int(cls_id))} id:{track_id}"
+                cv2.putText(frame, label, (x1, max(12, y1 - 5)), cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, color, 1)
+                cv2.circle(frame, (int(center[0]), int(center[1])), 3, (0, 255, 0), -1)
+        for i, (name, value, color) in enumerate(counts or ()):
+            cv2.putText(frame, f"{name}: {value}", (20, 30 + 30 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+        return frame
@@ -0,0 +1,308 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+# ===============================================================
+# CACHE ẢNH / GIF ĐÃ RESIZE TRÊN ĐĨA
+# ===============================================================
+#
+# Lần chạy đầu: GIF được giải mã lần lượt từng frame khi cần (frame đầu hiện
+# ngay, không chờ giải mã cả file), resize về kích thước hiển thị rồi ghi
+# thành file .npy. Các lần sau chỉ cần np.load(mmap_mode="r"): không giải mã,
+# không resize, frame nào được hiển thị mới thực sự được đọc từ đĩa.
+# Khoá cache gồm đường dẫn, mtime, dung lượng file gốc và kích thước đích,
+# nên thay ảnh là cache tự làm mới.
+
+CACHE_VERSION = 1
+DEFAULT_DURATION_MS = 100
+
+
+class GifFrames:
+    """
+    Dãy frame của một GIF ở kích thước hiển thị, truy cập theo chỉ số như list.
+
+    frames[i] trả về PIL.Image; duration(i) là thời gian hiển thị frame i (ms).
+    """
+    def __init__(self, path, size, cache_path):
+        self.path = path
+        self.size = tuple(size) if size else None
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.array = None      # Mảng (N, H, W, C) memmap khi đã có cache trên đĩa
+        self.durations = []
+        self._decoded = []     # Frame đã giải mã (lần chạy đầu, trước khi ghi cache)
+        self._gif = None
+
+        meta = _read_meta(cache_path)
+        if meta is not None:
+            self.array = np.load(cache_path + ".npy", mmap_mode="r")
+            self.durations = meta["durations"]
+            self.n_frames = meta["n_frames"]
+        else:
+            self._gif = Image.open(path)
+            self.n_frames = getattr(self._gif, "n_frames", 1)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.n_frames:
+            raise IndexError(index)
+        with self.lock:
+            if self.array is None:
+                self._decode_until(index)
+                data = self._decoded[index] if self.array is None else self.array[index]
+            else:
+                data = self.array[index]
+        return Image.fromarray(np.asarray(data))
+
+    def duration(self, index):
+        """Thời gian hiển thị frame (ms); frame chưa giải mã dùng giá trị mặc định."""
+        if index < len(self.durations):
+            return self.durations[index]
+        return DEFAULT_DURATION_MS
+
+    def _decode_until(self, index):
+        while len(self._decoded) <= index:
+            self._gif.seek(len(self._decoded))
+            frame = self._gif.convert("RGBA")
+            if self.size and frame.size != self.size:
+                frame = frame.resize(self.size, Image.LANCZOS)
+            self._decoded.append(np.asarray(frame))
+            # GIF ghi 0/thiếu duration thường được trình duyệt hiển thị ~100 ms
+            self.durations.append(self._gif.info.get("duration") or DEFAULT_DURATION_MS)
+        if len(self._decoded) == self.n_frames:
+            self._finish()
+
+    def _finish(self):
+        """Giải mã xong toàn bộ: ghi cache và chuyển sang đọc từ file memmap."""
+        frames = np.stack(self._decoded)
+        # Bỏ kênh alpha nếu GIF không có pixel trong suốt (file cache nhỏ hơn 1/4)
+        if frames[..., 3].min() == 255:
+            frames = np.ascontiguousarray(frames[..., :3])
+        self._gif.close()
+        self._gif = None
+        try:
+            _write_cache(self.cache_path, frames, {"n_frames": self.n_frames, "durations": self.durations})
+            self.array = np.load(self.cache_path + ".npy", mmap_mode="r")
+        except OSError as e:
+            print(f"⚠️ Không ghi được cache ảnh {self.cache_path}: {e}")
+            self.array = frames
+        self._decoded = []
+
+
+class AssetCache:
+    """Nạp ảnh tĩnh và GIF đã resize, dùng chung một thư mục cache trên đĩa."""
+    def __init__(self, cache_dir=r".cache/assets"):
+        self.cache_dir = cache_dir
+        self.gifs = {}
+        self.lock = threading.Lock()
+
+    def cache_path(self, path, size):
+        stat = os.stat(path)
+        key = json.dumps([CACHE_VERSION, os.path.abspath(path), stat.st_mtime_ns, stat.st_size, size])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.cache_dir, f"{name}-{digest}")
+
+    def gif(self, path, size=None):
+        """GifFrames của path ở kích thước size (None = giữ nguyên), dùng chung giữa các lần gọi."""
+        key = (os.path.abspath(path), tuple(size) if size else None)
+        with self.lock:
+            frames = self.gifs.get(key)
+            if frames is None:
+                frames = self.gifs[key] = GifFrames(path, size, self.cache_path(path, key[1] and list(key[1])))
+            return frames
+
+    def image(self, path, size=None):
+        """Ảnh tĩnh đã resize về size (PIL.Image), lấy từ cache nếu có."""
+        size = tuple(size) if size else None
+        cache_path = self.cache_path(path, size and list(size))
+        if _read_meta(cache_path) is not None:
+            return Image.fromarray(np.load(cache_path + ".npy"))
+        with Image.open(path) as img:
+            img = img.convert("RGBA")
+            if size and img.size != size:
+                img = img.resize(size, Image.LANCZOS)
+        try:
+            _write_cache(cache_path, np.asarray(img), {"n_frames": 1})
+        except OSError as e:
+            print(f"⚠️ Không ghi được cache ảnh {cache_path}: {e}")
+        return img
+
+    def warm(self, gifs=(), images=()):
+        """
+        Tạo sẵn cache trong luồng nền (gifs/images: list (path, size)).
+        Chỉ tốn thời gian ở lần chạy đầu hoặc khi ảnh gốc thay đổi.
+        """
+        def work():
+            for path, size in gifs:
+                if os.path.exists(path):
+                    frames = self.gif(path, size)
+                    frames[len(frames) - 1]
+            for path, size in images:
+                if os.path.exists(path):
+                    self.image(path, size)
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        return thread
+
+
+def _read_meta(cache_path):
+    try:
+        with open(cache_path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if os.path.exists(cache_path + ".npy") else None
+
+
+def _write_cache(cache_path, array, meta):
+    """Ghi .npy rồi mới ghi .json (đánh dấu hoàn tất), cả hai qua file tạm + os.replace."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp = cache_path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, cache_path + ".npy")
+    with open(cache_path + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(cache_path + ".json.tmp", cache_path + ".json")
+
+
+class FrameLRU:
+    """
+    Cache LRU giới hạn theo dung lượng (byte) cho ảnh đã sẵn sàng hiển thị.
+
+    Ảnh thuộc một nhóm (một GIF ở một kích thước). GIF phát lặp truy cập frame
+    theo vòng, với LRU thuần thì vòng dài hơn giới hạn sẽ bị bỏ đúng frame sắp
+    cần và mọi frame phải tạo lại mãi. Vì vậy nhóm đang phát được pin() và
+    không bao giờ bị bỏ (có thể vượt max_bytes); vượt giới hạn thì chỉ bỏ ảnh
+    ít dùng nhất của các nhóm không còn phát, tạo lại từ GifFrames khi cần.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.items = collections.OrderedDict()
+        self.pinned = collections.Counter()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory, nbytes, group=None):
+        item = self.items.get(key)
+        if item is not None:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+        self.misses += 1
+        value = factory()
+        self.items[key] = (value, nbytes, group)
+        self.bytes += nbytes
+        self._evict()
+        return value
+
+    def pin(self, group):
+        """Giữ mọi frame của group (GIF đang phát) cho tới khi unpin()."""
+        self.pinned[group] += 1
+
+    def unpin(self, group):
+        self.pinned[group] -= 1
+        if self.pinned[group] <= 0:
+            del self.pinned[group]
+        self._evict()
+
+    def _evict(self):
+        # Không bỏ ảnh vừa thêm (phần tử cuối) và ảnh của nhóm đang pin
+        for key in list(self.items)[:-1]:
+            if self.bytes <= self.max_bytes:
+                break
+            _, size, group = self.items[key]
+            if group in self.pinned:
+                continue
+            del self.items[key]
+            self.bytes -= size
+
+    def stats(self):
+        return {"items": len(self.items), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "pinned": len(self.pinned)}
+
+
+class CTkFrameSequence:
+    """
+    Bọc GifFrames thành dãy CTkImage cho label customtkinter. CTkImage của một
+    frame chỉ được tạo khi cần và nằm trong FRAME_CACHE dùng chung, nên nhiều
+    player cùng phát một GIF không giữ nhiều bản. GifPlayer gọi pin() khi bắt
+    đầu phát và unpin() khi dừng: GIF đang phát giữ đủ mọi frame, chỉ GIF
+    không còn phát mới bị giới hạn bộ nhớ.
+    """
+    def __init__(self, frames, size, cache=None):
+        self.frames = frames
+        self.size = tuple(size)
+        self.cache = FRAME_CACHE if cache is None else cache
+        # PIL + PhotoImage của Tk, mỗi bên ~4 byte/pixel
+        self.frame_bytes = self.size[0] * self.size[1] * 8
+        self.group = (self.frames.path, self.frames.size, self.size)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.cache.get((*self.group, index), lambda: self._create(index), self.frame_bytes, self.group)
+
+    def pin(self):
+        self.cache.pin(self.group)
+
+    def unpin(self):
+        self.cache.unpin(self.group)
+
+    def _create(self, index):
+        import customtkinter as ctk
+        frame = self.frames[index]
+        return ctk.CTkImage(light_image=frame, dark_image=frame, size=self.size)
+
+    def duration(self, index):
+        return self.frames.duration(index)
+
+
+# Cache dùng chung cho cả ứng dụng
+ASSETS = AssetCache()
+FRAME_CACHE = FrameLRU()
+
+
+def check_playback(path, size, loops=3, cache=None):
+    """
+    Mô phỏng GifPlayer phát lặp path ở kích thước size qua FrameLRU.
+    True nếu từ vòng thứ hai mọi frame đều lấy từ cache (không tạo lại).
+    """
+    cache = cache if cache is not None else FrameLRU()
+    sequence = CTkFrameSequence(ASSETS.gif(path, size), size, cache=cache)
+    sequence.pin()
+    try:
+        for index in range(len(sequence)):
+            sequence[index]
+        hits, misses = cache.hits, cache.misses
+        for _ in range(loops - 1):
+            for index in range(len(sequence)):
+                sequence[index]
+    finally:
+        sequence.unpin()
+    print(f"{path} {size[0]}x{size[1]}: {len(sequence)} frame, {cache.bytes / 2 ** 20:.0f} MB, "
+          f"từ vòng 2: {cache.hits - hits} lần trúng cache, {cache.misses - misses} lần tạo lại")
+    return cache.misses == misses
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Kiểm tra GIF phát lặp có trúng cache frame từ vòng thứ hai.")
+    parser.add_argument("--gif", nargs="+", default=[r"image/meo2.gif", r"image/meo_dh2.gif"])
+    parser.add_argument("--size", type=int, default=480)
+    parser.add_argument("--loops", type=int, default=3)
+    args = parser.parse_args()
+    ok = all([check_playback(path, (args.size, args.size), args.loops) for path in args.gif])
+    print("✅ Đạt" if ok else "❌ Có frame bị tạo lại khi phát lặp")
+    sys.exit(0 if ok else 1)
@@ -1,156 +1,452 @@
-from get_library import *
+import collections
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
 from toUart import *
+from inference_backend import resolve_model, select_backend
+from frame_grabber import FrameGrabber
+from motion_gate import MotionGate
+from roi import RegionOfInterest
+from line_counter import LineCounter
+from track_store import TrackStateStore
+from metrics import MetricsServer, StageMetrics
+from inference_worker import InferenceWorker, detections_to_rows
+from print_spooler import Win32Backend, build_receipt_text, win32_available
+from event_bus import CountEvent, EventBus, FrameEvent
+from annotator import Annotator
+from adaptive import AdaptiveController
+from centroid_tracker import create_tracker, is_local_tracker
+
+CLASS_NAMES = {0: "bottle", 1: "can"}
+UART_COMMANDS = {0: 1, 1: 2}  # class id -> lệnh servo
+
+
+def compute_points(bottles, cans):
+    """Điểm tích luỹ: 1.5 điểm/chai, 0.5 điểm/lon."""
+    return (bottles * 1.5) + (cans * 0.5)
+
+
+# --- Đếm vật và gửi lệnh servo (dùng chung cho YOLOProcessor và Lane trong multi_lane.py) ---
+
+def publish_count(owner, event, lane=None):
+    """
+    Cộng một lần cắt line vào owner.bottle_count / can_count và publish CountEvent
+    lên owner.bus. Class khác chai/lon bị bỏ qua (không đếm, không gửi lệnh servo).
+
+    Returns:
+        CountEvent, hoặc None nếu bỏ qua.
+    """
+    if event.cls_id == 0:
+        owner.bottle_count += 1
+    elif event.cls_id == 1:
+        owner.can_count += 1
+    else:
+        return None
+    owner.count_seq += 1
+    count = CountEvent(owner.count_seq, time.time(), lane, *event, owner.bottle_count, owner.can_count)
+    owner.bus.publish(count)
+    return count
+
+
+def subscribe_counts(bus, send_uart=None, on_event=None, lane=None):
+    """
+    Gắn UART (lệnh servo theo UART_COMMANDS) và on_event(event) làm subscriber của
+    kênh counts. lane: chỉ nhận CountEvent của lane này khi nhiều lane dùng chung bus.
+    """
+    def send_command(event):
+        if event.lane == lane:
+            send_uart.send_packet(UART_COMMANDS[event.cls_id])
+
+    def notify(event):
+        if event.lane == lane:
+            on_event(event)
+
+    if send_uart:
+        bus.subscribe(CountEvent, send_command)
+    if on_event:
+        bus.subscribe(CountEvent, notify)
+
 
 class YOLOProcessor(threading.Thread):
     """
     A dedicated thread to handle YOLO model processing to avoid freezing the GUI.
+
+    Không phụ thuộc giao diện: kết quả đi qua bus (EventBus). Kênh frames chỉ được
+    vẽ và publish khi có subscriber (hoặc output_queue), kênh counts nhận một
+    CountEvent cho mỗi vật đi qua line. UART và on_event(event) cũng chỉ là
+    subscriber của kênh counts; uart_port=None để tắt UART.
     """
-    def __init__(self, video_path, model_path, output_queue):
+    def __init__(self, video_path, model_path, output_queue, backend="auto", frame_buffer_size=1,
+                 line=(10, 190, 630, 190), motion_gate=True, motion_hold_time=1.5, roi_points=None,
+                 tracker=r'tracking/bytetrack.yaml', uart_port='COM5', uart_protocol="v1",
+                 display_size=None, display_rgb=False, on_event=None, metrics_port=None, metrics_host="127.0.0.1",
+                 inference="thread", bus=None, capture_options=None, display_fps=15, adaptive=None,
+                 precision="fp32"):
         super().__init__(daemon=True)
         self.video_path = video_path
-        self.model_path = model_path
+        # precision="int8" = dùng bản lượng tử hoá <model>_int8.onnx (tạo bằng quantize.py) nếu có
+        self.model_path = resolve_model(model_path, precision)
         self.output_queue = output_queue
+        self.bus = bus if bus is not None else EventBus()
+        self.count_seq = 0
         self.running = True
+        self.ready = threading.Event()
+        # Lý do không khởi động được (lỗi nạp model / mở nguồn video), None = chạy bình thường
+        self.error = None
+
+        # Histogram thời gian từng bước; stage_timer có thể thay bằng đối tượng khác có
+        # record(stage, seconds) (ví dụ benchmark) hoặc None để tắt hẳn
+        self.metrics = StageMetrics()
+        self.stage_timer = self.metrics
+        # Endpoint /metrics kiểu Prometheus (metrics_port=None = tắt)
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.metrics_server = None
+        # Thời điểm đưa frame vào output_queue, UI lấy ra để đo độ trễ hand-off
+        self.put_times = collections.deque(maxlen=8)
+
+        # Tổng số vật đã đếm (label 0 = chai, label 1 = lon)
+        self.bottle_count = 0
+        self.can_count = 0
+
+        # 'auto' = đo và chọn backend nhanh nhất (cuda/openvino/onnx/torch)
+        self.backend_preference = backend
+        self.backend = None
+        # 'process' = model chạy ở tiến trình riêng (InferenceWorker), frame đi qua shared memory
+        if inference not in ("thread", "process"):
+            raise ValueError(f"Chế độ suy luận không hợp lệ: {inference}")
+        self.inference = inference
+        self.worker = None
+
+        # Luồng đọc camera riêng, chỉ giữ frame_buffer_size frame mới nhất
+        self.frame_buffer_size = frame_buffer_size
+        # Tham số thêm cho FrameGrabber, ví dụ {"fourcc": "YUYV", "fps": 30} hoặc {"api": "gstreamer"}
+        self.capture_options = capture_options or {}
+        self.grabber = None
+        self.frames_processed = 0
+        self.fps = 0.0
+        self.last_frame_time = None
+
+        # Frame gửi lên UI đã ở đúng kích thước / hệ màu hiển thị (làm trên luồng này, không phải luồng Tk)
+        self.display_size = display_size
+        self.display_rgb = display_rgb
+        # Chỉ vẽ tối đa display_fps frame/giây, và chỉ khi có nơi nhận frame (render)
+        self.annotator = Annotator(CLASS_NAMES, max_fps=display_fps)
+        self.last_tracks = np.empty((0, 7), dtype=np.float32)
+        self.highlight_until = 0.0
+
+        # Line đếm: [x1, y1, x2, y2], polyline [[x, y], ...] hoặc nhiều line
+        self.line = line  # Adjust line position if needed
+        # Trạng thái track hết hạn sau track_buffer frame của tracker
+        self.tracker = tracker
+        # tracker_type: centroid = tracker NumPy chạy ở luồng này (predict + update),
+        # không dùng model.track(persist=True); ByteTrack/BoT-SORT vẫn chạy trong model
+        self.local_tracker = create_tracker(tracker) if is_local_tracker(tracker) else None
+        self.counter = LineCounter(line, store=TrackStateStore(tracker_config=tracker))
+
+        # ROI: chỉ đưa vùng quanh line (chọn bằng get_zone) vào model với imgsz nhỏ hơn
+        self.roi = RegionOfInterest(roi_points) if roi_points else None
+        self.imgsz = self.roi.imgsz if self.roi else 640
+        if self.roi and not self.roi.contains_line(self.counter.bounds()):
+            print("⚠️ Line đếm nằm ngoài ROI, vật phẩm có thể không được đếm.")
+
+        # Chỉ chạy YOLO khi có chuyển động quanh line đếm
+        self.motion_gate = MotionGate(self.counter.bounds(), hold_time=motion_hold_time) if motion_gate else None
+
+        # Điều khiển thích ứng imgsz / bỏ frame theo độ trễ: None = tắt (luôn self.imgsz, mọi frame),
+        # dict = tham số cho AdaptiveController, ví dụ {"budget_ms": 120}
+        if isinstance(adaptive, dict):
+            adaptive = AdaptiveController(max_imgsz=self.imgsz, **adaptive)
+        self.adaptive = adaptive
 
         #--- Khởi tạo truyền gói tin---
-        self.send_uart = ESP32_UART(port='COM5', baudrate=9600)
+        # 'v2' = khung có seq/CRC, chờ ACK và điều tiết theo chu kỳ servo (cần firmware mới)
+        self.send_uart = ESP32_UART(port=uart_port, baudrate=9600, protocol=uart_protocol) if uart_port else None
+        subscribe_counts(self.bus, self.send_uart, on_event)
 
-    def run(self):
-        """Main loop for video processing."""
-        try:
-            model = YOLO(self.model_path)
-        except Exception as e:
-            print(f"⚠️ Lỗi tải model: {e}")
-            return
+    @property
+    def render(self):
+        """Chỉ vẽ khung hình khi có nơi nhận frame."""
+        return self.output_queue is not None or self.bus.frames.active
+
+    def frame_stats(self):
+        """Số frame đã chụp / đã xử lý / đã bỏ."""
+        grabber = self.grabber
+        return {
+            "captured": grabber.captured if grabber else 0,
+            "processed": self.frames_processed,
+            "dropped": grabber.dropped if grabber else 0,
+            "duplicated": grabber.duplicated if grabber else 0,
+            "missed": grabber.missed if grabber else 0,
+            "skipped": self.motion_gate.frames_skipped if self.motion_gate else 0,
+            "tracks": len(self.counter.store),
+        }
+
+    def metrics_gauges(self):
+        """Các giá trị tức thời cho endpoint /metrics."""
+        gauges = {"fps": self.fps, "bottle_count": self.bottle_count, "can_count": self.can_count}
+        gauges.update({f"frames_{k}": v for k, v in self.frame_stats().items()})
+        if self.send_uart:
+            gauges.update({f"uart_{k}": v for k, v in self.send_uart.metrics().items()})
+        gauges.update({f"bus_{k}": v for k, v in self.bus.stats().items()})
+        gauges.update({"annotate_drawn": self.annotator.drawn, "annotate_skipped": self.annotator.skipped})
+        if self.adaptive:
+            gauges.update({f"adaptive_{k}": v for k, v in self.adaptive.stats().items()})
+        return gauges
+
+    def _update_fps(self):
+        """FPS xử lý (trung bình trượt), UI dùng để chỉnh nhịp lấy frame."""
+        now = time.perf_counter()
+        if self.last_frame_time is not None and now > self.last_frame_time:
+            instant = 1.0 / (now - self.last_frame_time)
+            self.fps = instant if self.fps == 0.0 else 0.9 * self.fps + 0.1 * instant
+        self.last_frame_time = now
+
+    def _prepare_display(self, frame):
+        if self.display_size and (frame.shape[1], frame.shape[0]) != tuple(self.display_size):
+            frame = cv2.resize(frame, self.display_size, interpolation=cv2.INTER_AREA)
+        if self.display_rgb:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # Frame gửi sang UI không được trỏ vào pool buffer mà FrameGrabber sẽ ghi đè
+        return self.grabber.detach(frame)
 
+    def load_model(self):
+        """Chọn backend và nạp model. Trả về False nếu lỗi."""
         try:
-            cap = cv2.VideoCapture(self.video_path)
-            if not cap.isOpened():
-                raise IOError(f"Không thể mở video tại: {self.video_path}")
+            frame_shape = (*self.roi.shape, 3) if self.roi else (480, 640, 3)
+            if self.inference == "process":
+                tracker = None if self.local_tracker is not None else self.tracker
+                self.worker = InferenceWorker(self.model_path, self.backend_preference, tracker=tracker,
+                                              imgsz=self.imgsz, shape=frame_shape).start()
+                # Worker có name / device / latency_ms như InferenceBackend
+                self.backend = self.worker
+                print(f"✅ Worker suy luận ({self.worker.name}) chạy ở tiến trình riêng.")
+            else:
+                self.backend = select_backend(self.model_path, self.backend_preference, imgsz=self.imgsz, frame_shape=frame_shape)
         except Exception as e:
-            print(f"⚠️ Lỗi mở video: {e}")
+            self.error = f"Lỗi tải model: {e}"
+            print(f"⚠️ {self.error}")
+            return False
+        return True
+
+    def setup(self):
+        """Nạp model và mở nguồn video. Trả về False nếu lỗi."""
+        if not self.load_model():
+            return False
+
+        self.grabber = FrameGrabber(self.video_path, size=(640, 480), buffer_size=self.frame_buffer_size,
+                                    **self.capture_options)
+        self.grabber.stage_timer = self.stage_timer
+        self.grabber.start()
+        self.grabber.opened.wait()
+        if self.grabber.error:
+            self.error = f"Lỗi mở video: {self.grabber.error}"
+            print(f"⚠️ {self.error}")
+            return False
+
+        if self.metrics_port is not None and self.stage_timer is self.metrics:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, self.metrics_gauges,
+                                                    host=self.metrics_host, port=self.metrics_port)
+                self.metrics_server.start()
+                print(f"✅ Metrics: http://{self.metrics_host}:{self.metrics_server.port}/metrics")
+            except OSError as e:
+                print(f"⚠️ Không mở được cổng metrics {self.metrics_port}: {e}")
+        self.ready.set()
+        return True
+
+    def process_frame(self, frame, annotate=None):
+        """
+        Suy luận và đếm cho một frame 640x480; vẽ kết quả lên frame nếu annotate.
+
+        annotate=None: chỉ vẽ khi có nơi nhận frame (render) và tới lượt theo display_fps.
+
+        Returns:
+            tuple: (frame, danh sách CrossingEvent mới).
+        """
+        start = time.perf_counter()
+        gate_open = self.motion_gate is None or self.motion_gate.update(frame)
+        mark = self._record("gate", start)
+        adaptive = self.adaptive
+        imgsz = adaptive.imgsz if adaptive else self.imgsz
+        data = None  # None = không chạy tracker ở frame này (cổng đóng hoặc bị bỏ qua)
+        if gate_open and (adaptive is None or adaptive.should_infer()):
+            source = self.roi.crop(frame) if self.roi else frame
+            if self.worker is not None:
+                detections, infer_ms, track_ms = self.worker.track(source, imgsz=imgsz)
+                data = detections_to_rows(detections)
+                now = time.perf_counter()
+                # Phần còn lại ngoài suy luận + tracker là chép frame và chuyển qua tiến trình
+                self._record("infer", now - infer_ms / 1000.0)
+                self._record("transport", mark + (infer_ms + track_ms) / 1000.0, now)
+                if self.local_tracker is not None:
+                    data = self.local_tracker.update(data[:, [0, 1, 2, 3, 5, 6]])[:, :7]
+                    self._record("track", now)
+                else:
+                    self._record("track", now - track_ms / 1000.0)
+            elif self.local_tracker is not None:
+                result = self.backend.predict([source], imgsz=imgsz, conf=0.25)[0]
+                infer = time.perf_counter()
+                self._record("infer", mark, infer)
+                data = self.local_tracker.update(result.boxes.cpu().numpy(), source)[:, :7]
+                self._record("track", infer)
+            else:
+                results = self.backend.track(source, imgsz=imgsz, conf=0.25, persist=True, tracker=self.tracker)
+                # results.speed chỉ gồm tiền xử lý + suy luận + hậu xử lý; phần còn lại là tracker
+                infer = sum(v for v in results.speed.values() if v) / 1000.0
+                now = time.perf_counter()
+                self._record("infer", now - infer)
+                self._record("track", mark + infer, now)
+                # Một lần chuyển tensor: [x1, y1, x2, y2, id, conf, cls]
+                if results.boxes and results.boxes.is_track:
+                    data = results.boxes.data.cpu().numpy()
+                else:
+                    data = np.empty((0, 7), dtype=np.float32)
+
+        events = []
+        if data is not None:
+            if self.roi and len(data):
+                # Toạ độ theo ROI -> toạ độ frame
+                data = self.roi.tracks_to_frame(data)
+            centers = (data[:, 0:2] + data[:, 2:4]) * 0.5
+            track_ids = data[:, 4].astype(np.int64)
+            cls_ids = data[:, -1].astype(np.int64)
+
+            # Gọi cả khi không có track để đồng hồ TTL của track store chạy đúng
+            count_start = time.perf_counter()
+            events = self.counter.update(track_ids, centers, cls_ids)
+            for event in events:
+                publish_count(self, event)
+            self._record("count", count_start)
+            if events:
+                self.highlight_until = time.monotonic() + 0.3
+            self.last_tracks = data
+            if adaptive:
+                adaptive.observe((time.perf_counter() - start) * 1000.0,
+                                 self.counter.distance(centers) if len(centers) else None)
+                if self.worker is None:
+                    adaptive.tune_tracker(self._tracker())
+        elif not gate_open:
+            # Cổng chuyển động đóng = máng trống, không còn box nào để vẽ
+            self.last_tracks = np.empty((0, 7), dtype=np.float32)
+            if adaptive:
+                adaptive.idle()
+
+        if annotate is None:
+            annotate = self.render and self.annotator.due()
+        if annotate:
+            draw_start = time.perf_counter()
+            self.annotate(frame)
+            self._record("draw", draw_start)
+        return frame, events
+
+    def annotate(self, frame):
+        """Vẽ box, id, line đếm, ROI và bộ đếm của frame vừa xử lý lên frame (tại chỗ)."""
+        self.annotator.draw(
+            frame, self.last_tracks, counter=self.counter, roi=self.roi,
+            counts=[("bottle", self.bottle_count, (255, 0, 0)), ("can", self.can_count, (0, 255, 0))],
+            highlight=time.monotonic() < self.highlight_until,
+        )
+        return frame
+
+    def _tracker(self):
+        """Tracker đang dùng (Ultralytics: có sau lần track đầu tiên), None nếu không truy cập được."""
+        if self.local_tracker is not None:
+            return self.local_tracker
+        trackers = getattr(getattr(getattr(self.backend, "model", None), "predictor", None), "trackers", None)
+        return trackers[0] if trackers else None
+
+    def _record(self, stage, start, end=None):
+        """Ghi thời gian một bước (start -> end) nếu đang đo, trả về thời điểm end."""
+        end = time.perf_counter() if end is None else end
+        if self.stage_timer is not None:
+            self.stage_timer.record(stage, end - start)
+        return end
+
+    def run(self):
+        """Main loop for video processing."""
+        if not self.setup():
+            if self.worker:
+                self.worker.close()
             return
-        
-        track_history = {}
-        line = [10, 190, 630, 190]  # Adjust line position if needed
-        count_set = set()
-        total_label_0 = 0
-        total_label_1 = 0
-
-        while self.running and cap.isOpened():
-            success, frame = cap.read()
-            if not success:
-                if isinstance(self.video_path, str):
-                    print("⚠️ Hết video.")
-                    break 
+
+        while self.running:
+            wait_start = time.perf_counter()
+            frame = self.grabber.read(timeout=0.5)
+            if frame is None:
+                if self.grabber.finished:
+                    break
                 continue
+            start = self._record("wait", wait_start)
+            self.frames_processed += 1
+            self._update_fps()
 
-            frame = cv2.resize(frame, (640, 480))
-            results = model.track(source=frame, imgsz=640, conf=0.25, verbose=False, device="0", persist=True, tracker=r'tracking/bytetrack.yaml')[0]
-            
-            cv2.line(frame, (line[0], line[1]), (line[2], line[3]), (0, 255, 255), 3)
-            
-            if results.boxes and results.boxes.is_track:
-                boxes = results.boxes.xywh.cpu().numpy()
-                track_ids = results.boxes.id.int().cpu().tolist()
-                cls_ids = results.boxes.cls.int().cpu().tolist()  
-
-                frame = results.plot(boxes=True, color_mode='instance')
-
-                for box, track_id, cls_id in zip(boxes, track_ids, cls_ids):
-                    x, y, w, h = box
-                    center_x = int(x)
-                    center_y = int(y)
-                    cv2.circle(frame, (center_x, center_y), 3, (0, 255, 0), -1)  
-
-                    if line[1] - 10 < center_y < line[1] + 10:
-                        if track_id not in count_set:
-                            count_set.add(track_id)
-
-                            if cls_id == 0:
-                                total_label_0 += 1
-                                self.send_uart.send_packet(1)  
-                            elif cls_id == 1:
-                                total_label_1 += 1
-                                self.send_uart.send_packet(2)
-                            
-                            cv2.line(frame, (line[0], line[1]), (line[2], line[3]), (0, 0, 255), 3)
-                            
-            cv2.putText(frame, f"bottle: {total_label_0}", (20, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-            cv2.putText(frame, f"can: {total_label_1}", (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+            annotate = self.render and self.annotator.due()
+            frame, _ = self.process_frame(frame, annotate=annotate)
 
-            try:
-                self.output_queue.put_nowait((frame, total_label_0, total_label_1))
-            except queue.Full:
-                pass
-        
-        cap.release()
-        print("Luồng YOLO đã dừng.")
+            if annotate:
+                mark = time.perf_counter()
+                display = self._prepare_display(frame)
+                mark = self._record("display", mark)
+                if self.bus.frames.active:
+                    self.bus.publish(FrameEvent(display, self.bottle_count, self.can_count, time.perf_counter(), None))
+                if self.output_queue is not None:
+                    self.put_times.append(time.perf_counter())
+                    try:
+                        self.output_queue.put_nowait((display, self.bottle_count, self.can_count))
+                    except queue.Full:
+                        self.put_times.pop()
+                self._record("queue", mark)
+            self._record("frame", start)
+
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.worker:
+            self.worker.close()
+        self.grabber.stop()
+        if self.send_uart:
+            self.send_uart.close()
+        stats = self.frame_stats()
+        print(f"Luồng YOLO đã dừng. Frame: chụp {stats['captured']}, xử lý {stats['processed']}, bỏ {stats['dropped']}, "
+              f"bỏ qua YOLO {stats['skipped']}, track đang giữ {stats['tracks']}.")
 
     def stop(self):
         """Signals the thread to stop."""
         self.running = False
+        if self.grabber:
+            self.grabber.stop()
 
 
 # ===============================================================
 # CLASS IN PHIẾU
 # ===============================================================
 
-try:
-    import win32print
-    IS_WINDOWS = True
-except ImportError:
-    IS_WINDOWS = False
-    print("Cảnh báo: Thư viện 'pywin32' không được tìm thấy. Chức năng in sẽ không hoạt động.")
-    print("Để cài đặt, chạy lệnh: pip install pywin32")
+IS_WINDOWS = win32_available()
 
 
 class ReceiptPrinter:
     """
     Một class chuyên dụng để xử lý việc tạo và in phiếu tích điểm.
+
+    In đồng bộ (chặn tới khi máy in nhận xong); giao diện dùng PrintSpooler
+    trong print_spooler.py để không bị treo khi máy in chậm hoặc mất kết nối.
     """
     def __init__(self):
         self.is_ready = IS_WINDOWS
         if not self.is_ready:
             print("Cảnh báo: Chức năng in không có sẵn (chỉ hỗ trợ Windows và yêu cầu pywin32).")
 
-    def print_receipt(self, user_name, bottles, cans, points):
+    def print_receipt(self, user_name, bottles, cans, points, balance=None):
         if not self.is_ready:
             return False, "Chức năng in không có sẵn trên hệ điều hành này hoặc do thiếu thư viện."
 
         try:
-            now = datetime.datetime.now()
-            date_str = now.strftime("%d/%m/%Y")
-            time_str = now.strftime("%H:%M:%S")
-
-            receipt_content = (
-                "   PHIEU TICH DIEM TAI CHE\n"
-                "--------------------------------\n"
-                f"Khach hang: {user_name}\n"
-                f"Ngay: {date_str}\n"
-                f"Gio: {time_str}\n"
-                "--------------------------------\n"
-                "So luong vat pham:\n"
-                f"- Chai nhua:      {bottles}\n"
-                f"- Lon kim loai:   {cans}\n"
-                "--------------------------------\n"
-                # f"TONG DIEM TICH LUY: {points}\n\n"
-                "Cam on ban da chung tay bao ve\n"
-                "         moi truong!\n\n\n."
-            )
-
-            printer_name = win32print.GetDefaultPrinter()
-            h_printer = win32print.OpenPrinter(printer_name)
-            try:
-                h_job = win32print.StartDocPrinter(h_printer, 1, ("Phieu Tich Diem", None, "RAW"))
-                try:
-                    win32print.StartPagePrinter(h_printer)
-                    win32print.WritePrinter(h_printer, receipt_content.encode('utf-8'))
-                    win32print.EndPagePrinter(h_printer)
-                finally:
-                    win32print.EndDocPrinter(h_printer)
-            finally:
-                win32print.ClosePrinter(h_printer)
+            receipt_content = build_receipt_text(user_name, bottles, cans, points, balance=balance)
+            Win32Backend().send(receipt_content)
 
             success_message = f"Đã gửi phiếu của '{user_name}' đến máy in thành công."
             print(success_message)
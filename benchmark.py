@@ -0,0 +1,328 @@
+import argparse
+import collections
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# ===============================================================
+# BENCHMARK OFFLINE: phát lại video qua pipeline đếm của YOLOProcessor
+# ===============================================================
+#
+# Mỗi frame đi qua decode -> motion gate -> infer -> track -> count (-> draw
+# nếu --render), nhanh nhất có thể, không UART, không giao diện. Kết quả gồm
+# fps, độ trễ p50/p95/p99 từng bước, RSS đỉnh và số chai/lon so với file
+# ground truth; có thể so với baseline đã lưu để phát hiện hồi quy.
+#
+# File ground truth (mặc định <video>.gt.json, cạnh video; data/metal_can_video.gt.json
+# đi kèm repo). Video không có file này thì số đếm KHÔNG được kiểm tra hồi quy:
+#   {"bottle": 3, "can": 12}
+
+STAGES = ("decode", "gate", "infer", "track", "count", "draw", "total")
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    """Gom thời gian (giây) theo từng bước, YOLOProcessor gọi record() qua stage_timer."""
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def summary(self):
+        """{stage: {count, mean_ms, p50_ms, p95_ms, p99_ms}}"""
+        result = {}
+        for stage in STAGES:
+            values = self.samples.get(stage)
+            if not values:
+                continue
+            ms = np.asarray(values) * 1000.0
+            stats = {"count": len(ms), "mean_ms": round(float(ms.mean()), 3)}
+            for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+                stats[f"p{p}_ms"] = round(float(value), 3)
+            result[stage] = stats
+        return result
+
+
+class TrackIdStats:
+    """
+    Thống kê id track khi phát lại, không cần nhãn: số id, số id ngắn (thấy dưới
+    min_frames frame: nhiễu hoặc track bị vỡ) và số lần đổi id ước lượng. Một id
+    mới xuất hiện trong radius pixel quanh chỗ một id khác vừa biến mất (trong
+    window frame trước) được coi là cùng một vật bị tracker đổi id.
+    """
+    def __init__(self, min_frames=3, window=10, radius=40.0):
+        self.min_frames = min_frames
+        self.window = window
+        self.radius = radius
+        self.frames_seen = {}
+        self.last = {}  # id -> (frame, tâm) lần thấy cuối
+        self.switches = 0
+
+    def update(self, frame_index, tracks):
+        present = set()
+        for x1, y1, x2, y2, track_id in tracks[:, :5]:
+            track_id = int(track_id)
+            center = np.array([(x1 + x2) * 0.5, (y1 + y2) * 0.5])
+            present.add(track_id)
+            if track_id not in self.frames_seen:
+                for other, (seen, point) in list(self.last.items()):
+                    if (other not in present and 0 < frame_index - seen <= self.window
+                            and np.hypot(*(point - center)) <= self.radius):
+                        self.switches += 1
+                        del self.last[other]
+                        break
+            self.frames_seen[track_id] = self.frames_seen.get(track_id, 0) + 1
+            self.last[track_id] = (frame_index, center)
+        # Bỏ id đã mất quá window frame để vòng lặp trên luôn ngắn
+        self.last = {k: v for k, v in self.last.items() if frame_index - v[0] <= self.window}
+
+    def summary(self):
+        return {"ids": len(self.frames_seen),
+                "short_ids": sum(1 for n in self.frames_seen.values() if n < self.min_frames),
+                "id_switches": self.switches}
+
+
+def peak_rss_mb():
+    """RSS đỉnh của tiến trình (MB), None nếu không đo được trên hệ điều hành này."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về byte
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def ground_truth_path(video_path, path=None):
+    return path or os.path.splitext(video_path)[0] + ".gt.json"
+
+
+def load_ground_truth(video_path, path=None):
+    """Đọc số chai/lon thật của video, None nếu không có file."""
+    path = ground_truth_path(video_path, path)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {"bottle": int(data.get("bottle", 0)), "can": int(data.get("can", 0))}
+
+
+def replay_video(video_path, model_path, backend="torch", tracker=r"tracking/bytetrack.yaml",
+                 line=(10, 190, 630, 190), roi_points=None, motion_gate=True, render=False,
+                 max_frames=None, frame_size=(640, 480), latency_budget=None):
+    """
+    Phát lại một video qua YOLOProcessor.process_frame, trả về dict kết quả.
+
+    Decode chạy đồng bộ ngay trong vòng lặp (không qua FrameGrabber) để không
+    bỏ frame nào và đo được riêng thời gian decode.
+    """
+    from backend_count import YOLOProcessor
+
+    processor = YOLOProcessor(
+        video_path=video_path,
+        model_path=model_path,
+        output_queue=None,
+        backend=backend,
+        line=list(line),
+        motion_gate=motion_gate,
+        roi_points=roi_points,
+        tracker=tracker,
+        uart_port=None,
+        adaptive={"budget_ms": latency_budget} if latency_budget else None,
+    )
+    if not processor.load_model():
+        raise RuntimeError(f"Không nạp được model {model_path}")
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Không mở được video {video_path}")
+
+    timer = StageTimer()
+    processor.stage_timer = timer
+    id_stats = TrackIdStats()
+    frames = 0
+    start = time.perf_counter()
+    try:
+        while max_frames is None or frames < max_frames:
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, frame_size)
+            t1 = time.perf_counter()
+            # render: vẽ mọi frame (không qua Annotator.due(), vốn giới hạn 15 fps theo đồng hồ thật),
+            # để bước draw đo đúng chi phí vẽ, không phụ thuộc tốc độ phát lại
+            processor.process_frame(frame, annotate=render)
+            t2 = time.perf_counter()
+            id_stats.update(frames, processor.last_tracks)
+            timer.record("decode", t1 - t0)
+            timer.record("total", t2 - t0)
+            frames += 1
+    finally:
+        cap.release()
+    elapsed = time.perf_counter() - start
+
+    stats = processor.frame_stats()
+    result = {
+        "video": os.path.basename(video_path),
+        "backend": processor.backend.name,
+        "frames": frames,
+        "skipped": stats["skipped"],
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+        "stages": timer.summary(),
+        "counts": {"bottle": processor.bottle_count, "can": processor.can_count},
+        "tracker": os.path.basename(tracker),
+        "ids": id_stats.summary(),
+    }
+    if processor.adaptive:
+        result["adaptive"] = processor.adaptive.stats()
+    return result
+
+
+def count_error(counts, truth):
+    """Tổng sai lệch tuyệt đối chai + lon so với ground truth."""
+    return sum(abs(counts[k] - truth[k]) for k in ("bottle", "can"))
+
+
+def compare_baseline(report, baseline, tolerance=0.10):
+    """
+    So report với baseline, trả về danh sách hồi quy (rỗng = đạt).
+
+    Hồi quy khi fps giảm hoặc p95 tổng tăng quá tolerance, sai lệch đếm tăng, hoặc
+    baseline có ground truth mà lần này không có (số đếm không còn được kiểm tra).
+    """
+    regressions = []
+    previous = {v["video"]: v for v in baseline.get("videos", [])}
+    for video in report["videos"]:
+        base = previous.get(video["video"])
+        if base is None:
+            continue
+        name = video["video"]
+        if video["fps"] < base["fps"] * (1.0 - tolerance):
+            regressions.append(f"{name}: fps {video['fps']} < baseline {base['fps']}")
+        p95, base_p95 = video["stages"]["total"]["p95_ms"], base["stages"]["total"]["p95_ms"]
+        if p95 > base_p95 * (1.0 + tolerance):
+            regressions.append(f"{name}: p95 tổng {p95} ms > baseline {base_p95} ms")
+        if "error" in video and "error" in base and video["error"] > base["error"]:
+            regressions.append(f"{name}: sai lệch đếm {video['error']} > baseline {base['error']}")
+        elif "error" in base and "error" not in video:
+            regressions.append(f"{name}: baseline có kiểm tra số đếm nhưng lần này thiếu ground truth")
+    return regressions
+
+
+def print_report(report):
+    for video in report["videos"]:
+        print(f"\n📼 {video['video']} [{video['backend']}] {video['frames']} frame, "
+              f"{video['fps']} fps, bỏ qua YOLO {video['skipped']}")
+        print(f"   {'bước':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, stats in video["stages"].items():
+            print(f"   {stage:<8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+        counts = video["counts"]
+        line = f"   Đếm: chai {counts['bottle']}, lon {counts['can']}"
+        if "truth" in video:
+            line += f" | thật: chai {video['truth']['bottle']}, lon {video['truth']['can']} (sai lệch {video['error']})"
+        else:
+            line += " | ⚠️ không có ground truth, số đếm không được kiểm tra"
+        print(line)
+        if "ids" in video:
+            ids = video["ids"]
+            print(f"   Tracker {video['tracker']}: {ids['ids']} id, {ids['short_ids']} id ngắn, "
+                  f"~{ids['id_switches']} lần đổi id")
+    print(f"\nRSS đỉnh: {report['peak_rss_mb']} MB")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline đếm chai/lon trên video ghi sẵn.")
+    parser.add_argument("--video", nargs="+", default=[r"data/metal_can_video.mp4"])
+    parser.add_argument("--model", default=r"model/best.pt")
+    parser.add_argument("--backend", default="torch", choices=["auto", "cuda", "openvino", "onnx", "torch"],
+                        help="Mặc định torch trên CPU để kết quả so sánh được giữa các máy CI")
+    parser.add_argument("--tracker", default=r"tracking/bytetrack.yaml")
+    parser.add_argument("--line", type=json.loads, default=[10, 190, 630, 190])
+    parser.add_argument("--roi", type=json.loads, default=None)
+    parser.add_argument("--no-motion-gate", action="store_true")
+    parser.add_argument("--render", action="store_true", help="Tính cả bước vẽ khung hình")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--latency-budget", type=float, default=None,
+                        help="Bật điều khiển thích ứng imgsz / bỏ frame với budget này (ms)")
+    parser.add_argument("--ground-truth", default=None,
+                        help="File ground truth (chỉ dùng khi có một video), mặc định <video>.gt.json")
+    parser.add_argument("--output", default=None, help="Ghi báo cáo JSON ra file")
+    parser.add_argument("--baseline", default=r"data/benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Lưu kết quả lần chạy này làm baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Mức chênh cho phép so với baseline")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    videos = []
+    missing = []
+    # Log nạp model / chọn backend ra stderr, stdout chỉ chứa báo cáo
+    with contextlib.redirect_stdout(sys.stderr):
+        for video_path in args.video:
+            result = replay_video(
+                video_path, args.model, backend=args.backend, tracker=args.tracker, line=args.line,
+                roi_points=args.roi, motion_gate=not args.no_motion_gate, render=args.render,
+                max_frames=args.max_frames, latency_budget=args.latency_budget,
+            )
+            gt_path = ground_truth_path(video_path, args.ground_truth if len(args.video) == 1 else None)
+            truth = load_ground_truth(video_path, gt_path)
+            if truth is not None:
+                result["truth"] = truth
+                result["error"] = count_error(result["counts"], truth)
+            else:
+                missing.append((video_path, gt_path))
+            videos.append(result)
+
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "peak_rss_mb": peak_rss_mb(),
+        "videos": videos,
+    }
+    print_report(report)
+    for video_path, gt_path in missing:
+        print(f"⚠️ CẢNH BÁO: không có ground truth cho {video_path} ({gt_path}), "
+              "hồi quy số đếm KHÔNG được kiểm tra, chỉ so fps/độ trễ.")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ Đã lưu baseline: {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Hồi quy so với baseline:")
+            for item in regressions:
+                print(f"   - {item}")
+            return 1
+        print("✅ Không có hồi quy so với baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
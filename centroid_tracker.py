@@ -0,0 +1,183 @@
+import numpy as np
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.trackers.utils.matching import linear_assignment
+from ultralytics.utils import IterableSimpleNamespace
+from ultralytics.utils.checks import check_yaml
+
+try:
+    from ultralytics.utils import YAML
+    load_yaml = YAML.load
+except ImportError:  # Ultralytics cũ
+    from ultralytics.utils import yaml_load as load_yaml
+
+# ===============================================================
+# TRACKER IoU / TÂM BOX CHO MỘT MÁNG NẠP (chỉ NumPy)
+# ===============================================================
+#
+# Máng chỉ có vài vật cùng lúc và vật đi một chiều, nên không cần Kalman như
+# ByteTrack: mỗi track giữ box lần cuối và vận tốc tâm (trung bình trượt), vị
+# trí dự đoán = box cũ + vận tốc x số frame đã mất dấu. Ghép detection với
+# track theo IoU với box dự đoán, hụt IoU thì theo khoảng cách tâm (tính bằng
+# đường chéo box); các cặp qua được ngưỡng được ghép tối ưu theo tổng chi phí
+# (linear_assignment của Ultralytics, lap.lapjv như ByteTrack). Track mới cần
+# min_hits frame liên tiếp mới được trả ra (lọc detection nhiễu một frame), kể
+# cả ở frame đầu tiên; track mất dấu quá track_buffer lần cập nhật bị xoá.
+#
+# Dùng như tracker Ultralytics: update(boxes, img) -> mảng (N, 8)
+# [x1, y1, x2, y2, id, conf, cls, idx]; chọn bằng tracking/centroid.yaml. Trạng
+# thái nằm trong đối tượng tracker, không trong model, nên không cần persist=True.
+
+TRACKER_TYPES = (*TRACKER_MAP, "centroid")
+
+
+def load_tracker_config(config=r"tracking/bytetrack.yaml"):
+    return IterableSimpleNamespace(**load_yaml(check_yaml(config)))
+
+
+def is_local_tracker(config):
+    """Tracker chạy ngoài model (predict + update) thay vì model.track(persist=True)."""
+    return load_tracker_config(config).tracker_type == "centroid"
+
+
+def create_tracker(config=r"tracking/bytetrack.yaml", frame_rate=30):
+    """Tạo một tracker ByteTrack/BoT-SORT/centroid độc lập từ file cấu hình."""
+    cfg = load_tracker_config(config)
+    if cfg.tracker_type not in TRACKER_TYPES:
+        raise ValueError(f"Tracker không hỗ trợ: {cfg.tracker_type}")
+    if cfg.tracker_type == "centroid":
+        return CentroidTracker(args=cfg, frame_rate=frame_rate)
+    tracker_cls = TRACKER_MAP[cfg.tracker_type]
+    try:
+        return tracker_cls(args=cfg, frame_rate=frame_rate)
+    except TypeError:  # Ultralytics mới đọc frame_rate từ cfg
+        cfg.frame_rate = frame_rate
+        return tracker_cls(args=cfg)
+
+
+def _as_detections(results):
+    """Boxes của Ultralytics (đã .cpu().numpy()) hoặc mảng (N, 6) -> mảng (N, 6) [x1, y1, x2, y2, conf, cls]."""
+    if hasattr(results, "xyxy"):
+        return np.column_stack([results.xyxy, results.conf, results.cls]).astype(np.float32).reshape(-1, 6)
+    return np.asarray(results, dtype=np.float32).reshape(-1, 6)
+
+
+def _box_iou(a, b):
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class CentroidTracker:
+    def __init__(self, args, frame_rate=30):
+        """
+        args (từ centroid.yaml):
+            track_low_thresh: conf tối thiểu để detection được ghép vào track có sẵn.
+            new_track_thresh: conf tối thiểu để mở track mới.
+            match_thresh: 1 - IoU tối đa để ghép theo IoU (giống ByteTrack).
+            max_distance: khoảng cách tâm tối đa (theo đường chéo box) để ghép khi IoU không đủ.
+            min_hits: số frame liên tiếp trước khi track mới được trả ra.
+            track_buffer: số lần cập nhật giữ track đã mất dấu.
+        """
+        self.args = args
+        self.max_frames_lost = int(args.track_buffer)
+        self.min_hits = int(getattr(args, "min_hits", 2))
+        self.reset()
+
+    def reset(self):
+        self.frame_id = 0
+        self.next_id = 1
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.velocity = np.empty((0, 2), dtype=np.float32)
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.hits = np.empty(0, dtype=np.int64)
+        self.conf = np.empty(0, dtype=np.float32)
+        self.cls = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return self.ids.size
+
+    def _match(self, predicted, dets):
+        """Ghép track <-> detection tối ưu theo tổng chi phí. Trả về (chỉ số track, chỉ số detection)."""
+        if not len(predicted) or not len(dets):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        iou = _box_iou(predicted, dets[:, :4])
+        centers_t = (predicted[:, :2] + predicted[:, 2:]) * 0.5
+        centers_d = (dets[:, :2] + dets[:, 2:4]) * 0.5
+        diag = np.maximum(np.hypot(*(predicted[:, 2:] - predicted[:, :2]).T), 1.0)
+        dist = np.hypot(*(centers_t[:, None, :] - centers_d[None, :, :]).transpose(2, 0, 1)) / diag[:, None]
+
+        # Cặp không qua ngưỡng IoU lẫn khoảng cách nhận chi phí vượt cost_limit nên không bao giờ được ghép
+        cost = (1.0 - iou) + dist
+        valid = (1.0 - iou <= self.args.match_thresh) | (dist <= self.args.max_distance)
+        limit = float(cost[valid].max()) + 1.0 if valid.any() else 1.0
+        matches, _, _ = linear_assignment(np.where(valid, cost, limit * 2.0), thresh=limit)
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        return matches[:, 0], matches[:, 1]
+
+    def update(self, results, img=None, feats=None):
+        """
+        Cập nhật với detection của một frame.
+
+        Returns:
+            np.ndarray: (N, 8) [x1, y1, x2, y2, id, conf, cls, idx] của các track đã
+            xác nhận và thấy ở frame này; idx là chỉ số detection tương ứng.
+        """
+        self.frame_id += 1
+        dets = _as_detections(results)
+        det_index = np.flatnonzero(dets[:, 4] >= self.args.track_low_thresh)
+        dets = dets[det_index]
+
+        # Dự đoán theo vận tốc: vật trong máng đi một chiều, gần như thẳng đều
+        gap = (self.frame_id - self.last_seen).astype(np.float32)[:, None]
+        predicted = self.boxes + np.tile(self.velocity * gap, 2)
+        t_idx, d_idx = self._match(predicted, dets)
+
+        if t_idx.size:
+            new_boxes = dets[d_idx, :4]
+            old_centers = (self.boxes[t_idx, :2] + self.boxes[t_idx, 2:]) * 0.5
+            new_centers = (new_boxes[:, :2] + new_boxes[:, 2:]) * 0.5
+            step = (new_centers - old_centers) / gap[t_idx]
+            fresh = self.hits[t_idx] == 1
+            self.velocity[t_idx] = np.where(fresh[:, None], step, 0.5 * self.velocity[t_idx] + 0.5 * step)
+            self.boxes[t_idx] = new_boxes
+            self.conf[t_idx] = dets[d_idx, 4]
+            self.cls[t_idx] = dets[d_idx, 5]
+            self.last_seen[t_idx] = self.frame_id
+            self.hits[t_idx] += 1
+
+        # Track chưa xác nhận mà hụt một frame thì bỏ; track đã xác nhận giữ track_buffer lần
+        missed = self.last_seen < self.frame_id
+        keep = ~(missed & (self.hits < self.min_hits)) & (self.frame_id - self.last_seen <= self.max_frames_lost)
+
+        # Detection chưa ghép, đủ conf -> track mới
+        unmatched = np.ones(len(dets), dtype=bool)
+        unmatched[d_idx] = False
+        new = np.flatnonzero(unmatched & (dets[:, 4] >= self.args.new_track_thresh))
+        count = new.size
+        new_ids = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+
+        self.ids = np.concatenate([self.ids[keep], new_ids])
+        self.boxes = np.concatenate([self.boxes[keep], dets[new, :4]])
+        self.velocity = np.concatenate([self.velocity[keep], np.zeros((count, 2), dtype=np.float32)])
+        self.last_seen = np.concatenate([self.last_seen[keep], np.full(count, self.frame_id, dtype=np.int64)])
+        self.hits = np.concatenate([self.hits[keep], np.ones(count, dtype=np.int64)])
+        self.conf = np.concatenate([self.conf[keep], dets[new, 4]])
+        self.cls = np.concatenate([self.cls[keep], dets[new, 5]])
+
+        # Chỉ số detection gốc của từng track (-1 = không thấy ở frame này)
+        source = np.full(keep.size, -1, dtype=np.int64)
+        source[t_idx] = d_idx
+        source = np.concatenate([source[keep], new])
+
+        visible = (self.last_seen == self.frame_id) & (self.hits >= self.min_hits)
+        if not visible.any():
+            return np.empty((0, 8), dtype=np.float32)
+        return np.column_stack([
+            self.boxes[visible], self.ids[visible], self.conf[visible], self.cls[visible],
+            det_index[source[visible]],
+        ]).astype(np.float32)
@@ -6,6 +6,26 @@ Servo myservo_under;
 const byte START_BYTE = 0x02;
 const byte END_BYTE   = 0x03;
 
+// --- Giao thức v2 (xem uart_protocol.py): 0x02 | 0xA2 | SEQ | CMD | CRC8 | 0x03 ---
+const byte PROTO_V2 = 0xA2;
+const byte ACK  = 0x06;   // Đã nhận lệnh, servo bắt đầu chạy
+const byte BUSY = 0x11;   // Servo đang bận, host gửi lại sau
+const byte NAK  = 0x15;   // Lệnh không hỗ trợ
+const byte CMD_HELLO = 0x7E;  // Host bắt đầu phiên mới (mở lại cổng): quên seq cũ
+
+// Thời gian một chu kỳ servo (ms), khớp với SERVO_CYCLE_TIMES phía host
+const unsigned long BOTTLE_CYCLE_MS = 2000;
+const unsigned long CAN_CYCLE_MS    = 0;
+
+unsigned long busy_until = 0;
+bool servo_active = false;
+int last_seq = -1;
+
+// Lệnh v1 tới khi servo đang bận được xếp hàng (giống trước đây nằm trong buffer RX)
+const int PENDING_SIZE = 16;
+byte pending[PENDING_SIZE];
+int pending_count = 0;
+
 void setup() {
   Serial.begin(9600);
 
@@ -19,49 +39,139 @@ void setup() {
 
 void loop() {
   receive_data();
+  update_servo();
 }
 
 // ham xoay servo ve goc ban dau
 void rotate_default () {
-  myservo_under.write(90);  
+  myservo_under.write(90);
   myservo_on.write(90);
 }
 
+bool servo_busy() {
+  return servo_active && (long)(millis() - busy_until) < 0;
+}
+
+// Không dùng delay(): servo trở về vị trí mặc định trong update_servo()
+void start_cycle(unsigned long cycle_ms) {
+  busy_until = millis() + cycle_ms;
+  servo_active = true;
+  if (cycle_ms == 0) {
+    rotate_default();
+    servo_active = false;
+  }
+}
+
 void classify_bottle () {
   myservo_on.write(0); // nga mang xuong
   myservo_under.write(155); // quay sang trai
-  delay(2000);
-  rotate_default();
+  start_cycle(BOTTLE_CYCLE_MS);
 }
 
 void classify_can () {
     myservo_on.write(0);  // nga mang xuong
     myservo_under.write(0);   // quay sang phai
+    start_cycle(CAN_CYCLE_MS);
+}
+
+void update_servo() {
+  if (servo_active && !servo_busy()) {
     rotate_default();
+    servo_active = false;
+  }
+  if (!servo_busy() && pending_count > 0) {
+    byte command = pending[0];
+    for (int i = 1; i < pending_count; i++) pending[i - 1] = pending[i];
+    pending_count--;
+    handle_command(command);
+  }
+}
+
+byte crc8(const byte *data, int len) {
+  byte crc = 0;
+  for (int i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (int b = 0; b < 8; b++) {
+      crc = (crc & 0x80) ? (byte)((crc << 1) ^ 0x07) : (byte)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+void send_reply(byte seq, byte status) {
+  byte body[3] = {PROTO_V2, seq, status};
+  byte frame[6] = {START_BYTE, PROTO_V2, seq, status, crc8(body, 3), END_BYTE};
+  Serial.write(frame, 6);
 }
 
-// Nhận mảng 3 byte từ UART: [START, DATA, END]
+// Nhận khung từ UART: v1 [START, DATA, END] hoặc v2 [START, 0xA2, SEQ, CMD, CRC, END]
 void receive_data() {
-  const int PACKET_SIZE = 3;
-  byte buffer[PACKET_SIZE];
+  static byte buffer[6];
+  static int length = 0;
 
-  while (Serial.available() >= PACKET_SIZE) {
-    Serial.readBytes(buffer, PACKET_SIZE);
+  while (Serial.available() > 0) {
+    byte b = Serial.read();
+    if (length == 0 && b != START_BYTE) {
+      continue;  // Bỏ byte rác cho tới byte bắt đầu
+    }
+    buffer[length++] = b;
+
+    if (length == 3 && buffer[1] != PROTO_V2) {
+      if (buffer[2] == END_BYTE) {
+        handle_v1(buffer[1]);
+      } else {
+        // Nếu không đúng định dạng, bỏ qua
+        Serial.println("Gói không hợp lệ");
+      }
+      length = 0;
+    } else if (length == 6) {
+      if (buffer[5] == END_BYTE && crc8(buffer + 1, 3) == buffer[4]) {
+        handle_v2(buffer[2], buffer[3]);
+      }
+      // Khung v2 lỗi CRC: không trả lời, host sẽ gửi lại khi hết thời gian chờ ACK
+      length = 0;
+    }
+  }
+}
 
-    if (buffer[0] == START_BYTE && buffer[2] == END_BYTE) {
-      handle_command(buffer[1]);  // xử lý byte dữ liệu ở giữa
+void handle_v1(byte command) {
+  if (servo_busy() || pending_count > 0) {
+    if (pending_count < PENDING_SIZE) {
+      pending[pending_count++] = command;
     } else {
-      // Nếu không đúng định dạng, bỏ qua
-      Serial.println("Gói không hợp lệ");
+      Serial.println("Hàng đợi đầy, bỏ lệnh.");
     }
+    return;
   }
+  handle_command(command);
+}
+
+void handle_v2(byte seq, byte command) {
+  if (command == CMD_HELLO) {
+    // Host vừa khởi động lại và đếm seq lại từ đầu: lệnh tiếp theo không phải gói gửi lại
+    last_seq = -1;
+    send_reply(seq, ACK);
+    return;
+  }
+  if (seq == last_seq) {
+    send_reply(seq, ACK);  // Gói gửi lại sau khi ACK bị mất: không chạy servo lần hai
+    return;
+  }
+  if (command != 0x01 && command != 0x02) {
+    send_reply(seq, NAK);
+    return;
+  }
+  if (servo_busy() || pending_count > 0) {
+    send_reply(seq, BUSY);
+    return;
+  }
+  last_seq = seq;
+  send_reply(seq, ACK);
+  handle_command(command);
 }
 
 // Xử lý servo theo lệnh nhận
 void handle_command(byte command) {
-  Serial.print("Lệnh nhận: ");
-  Serial.println(command, HEX);
-
   switch (command) {
     case 0x01:
     classify_bottle();
@@ -0,0 +1,182 @@
+import collections
+import queue
+import threading
+
+# ===============================================================
+# EVENT BUS TRONG TIẾN TRÌNH: nhận diện -> UI / UART / sổ giao dịch
+# ===============================================================
+#
+# Mỗi loại sự kiện đi trên một kênh riêng:
+#   FrameEvent  kênh "frames", mất mát có chủ đích: mỗi subscriber chỉ giữ
+#               frame mới nhất, frame cũ chưa kịp lấy bị thay thế (đếm lại).
+#   CountEvent  kênh "counts", không mất và đúng thứ tự: mỗi subscriber có
+#               hàng đợi riêng không giới hạn, nên UI chậm hay frame bị bỏ
+#               cũng không làm mất lượt đếm.
+#
+# subscribe(event_type) trả về subscription để lấy sự kiện (poll/get/drain,
+# dùng cho luồng Tk); subscribe(event_type, callback) gọi callback ngay trên
+# luồng publish, chỉ dùng cho việc không chặn (UART, sổ giao dịch chỉ đưa vào
+# hàng đợi). Frame được chia sẻ giữa các subscriber: ai cần sửa thì copy.
+
+FrameEvent = collections.namedtuple("FrameEvent", "frame bottle_count can_count published lane")
+# seq tăng dần theo từng nguồn (YOLOProcessor / lane); các trường track_id..point
+# giống CrossingEvent nên mọi hàm nhận CrossingEvent đều dùng được CountEvent.
+CountEvent = collections.namedtuple(
+    "CountEvent", "seq ts lane track_id cls_id direction segment point bottle_count can_count")
+
+
+class LatestSubscription:
+    """Chỉ giữ giá trị mới nhất (latest-wins)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.fresh = threading.Event()
+        self.delivered = 0
+        self.replaced = 0
+
+    def _offer(self, value):
+        with self.lock:
+            if self.value is not None:
+                self.replaced += 1
+            self.value = value
+            self.fresh.set()
+
+    def poll(self):
+        """Giá trị mới nhất chưa lấy, hoặc None."""
+        with self.lock:
+            value, self.value = self.value, None
+            self.fresh.clear()
+        if value is not None:
+            self.delivered += 1
+        return value
+
+    def get(self, timeout=None):
+        self.fresh.wait(timeout)
+        return self.poll()
+
+    def stats(self):
+        return {"delivered": self.delivered, "replaced": self.replaced}
+
+
+class QueueSubscription:
+    """Hàng đợi FIFO không giới hạn: không bỏ sự kiện nào."""
+    def __init__(self):
+        self.items = queue.SimpleQueue()
+        self.delivered = 0
+
+    def _offer(self, value):
+        self.items.put(value)
+
+    def poll(self):
+        try:
+            value = self.items.get_nowait()
+        except queue.Empty:
+            return None
+        self.delivered += 1
+        return value
+
+    def get(self, timeout=None):
+        try:
+            value = self.items.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.delivered += 1
+        return value
+
+    def drain(self):
+        """Lấy hết sự kiện đang chờ theo đúng thứ tự."""
+        values = []
+        while True:
+            value = self.poll()
+            if value is None:
+                return values
+            values.append(value)
+
+    def stats(self):
+        return {"delivered": self.delivered, "pending": self.items.qsize()}
+
+
+class CallbackSubscription:
+    """Gọi callback trên luồng publish; lỗi của một subscriber không ảnh hưởng subscriber khác."""
+    def __init__(self, callback):
+        self.callback = callback
+        self.delivered = 0
+        self.errors = 0
+
+    def _offer(self, value):
+        try:
+            self.callback(value)
+            self.delivered += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Lỗi subscriber {getattr(self.callback, '__qualname__', self.callback)}: {e}")
+
+    def stats(self):
+        return {"delivered": self.delivered, "errors": self.errors}
+
+
+class Channel:
+    def __init__(self, name, lossy):
+        self.name = name
+        self.lossy = lossy
+        self.lock = threading.Lock()
+        # Copy-on-write: publish đọc danh sách không cần khoá
+        self.subscribers = ()
+        self.published = 0
+
+    @property
+    def active(self):
+        """Có subscriber nào không (không có thì nơi publish có thể bỏ qua việc tạo sự kiện)."""
+        return bool(self.subscribers)
+
+    def subscribe(self, callback=None):
+        if callback is not None:
+            subscription = CallbackSubscription(callback)
+        else:
+            subscription = LatestSubscription() if self.lossy else QueueSubscription()
+        with self.lock:
+            self.subscribers = self.subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not subscription)
+
+    def publish(self, event):
+        self.published += 1
+        for subscription in self.subscribers:
+            subscription._offer(event)
+
+    def stats(self):
+        stats = {"published": self.published, "subscribers": len(self.subscribers)}
+        for subscription in self.subscribers:
+            for key, value in subscription.stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+
+class EventBus:
+    def __init__(self):
+        self.frames = Channel("frames", lossy=True)
+        self.counts = Channel("counts", lossy=False)
+        self.channels = {FrameEvent: self.frames, CountEvent: self.counts}
+
+    def channel(self, event_type):
+        try:
+            return self.channels[event_type]
+        except KeyError:
+            raise ValueError(f"Loại sự kiện chưa đăng ký trên bus: {event_type}")
+
+    def subscribe(self, event_type, callback=None):
+        return self.channel(event_type).subscribe(callback)
+
+    def unsubscribe(self, event_type, subscription):
+        self.channel(event_type).unsubscribe(subscription)
+
+    def publish(self, event):
+        self.channels[type(event)].publish(event)
+
+    def stats(self):
+        """Số liệu từng kênh, dạng phẳng cho endpoint /metrics (ví dụ frames_replaced)."""
+        return {f"{channel.name}_{key}": value
+                for channel in self.channels.values() for key, value in channel.stats().items()}
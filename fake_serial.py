@@ -0,0 +1,93 @@
+import os
+import select
+import threading
+import time
+import tty
+
+
+class FakeSerialDevice:
+    """
+    Thiết bị serial giả dựa trên pty (Linux/macOS) để thử ESP32_UART khi không có ESP32.
+
+    Mở ESP32_UART(port=device.port) như một cổng thật; mọi byte host ghi ra được
+    lưu trong device.received. read_delay > 0 mô phỏng thiết bị đọc chậm (buffer
+    pty đầy -> host bị write timeout), close() mô phỏng rút cáp.
+    """
+    def __init__(self, read_delay=0.0):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.read_delay = read_delay
+
+        self.received = bytearray()
+        self.reads = 0
+        self.lock = threading.Lock()
+        self.running = True
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    def _read_loop(self):
+        while self.running:
+            try:
+                ready, _, _ = select.select([self.master], [], [], 0.05)
+                if not ready:
+                    continue
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if not data:
+                break
+            with self.lock:
+                self.received.extend(data)
+                self.reads += 1
+            self.on_data(data)
+            if self.read_delay:
+                time.sleep(self.read_delay)
+
+    def on_data(self, data):
+        """Ghi đè để phản hồi dữ liệu nhận được (xem firmware giả lập)."""
+
+    def reply(self, data):
+        """Gửi dữ liệu từ "thiết bị" về host."""
+        os.write(self.master, data)
+
+    def packets(self, size=3):
+        """Tách dữ liệu đã nhận thành các gói size byte."""
+        with self.lock:
+            data = bytes(self.received)
+        return [data[i:i + size] for i in range(0, len(data) - size + 1, size)]
+
+    def wait_for(self, n_bytes, timeout=2.0):
+        """Chờ tới khi nhận đủ n_bytes hoặc hết timeout. Trả về True nếu đủ."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.received) >= n_bytes:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def close(self):
+        self.running = False
+        self.reader.join(timeout=1.0)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    from toUart import ESP32_UART
+
+    device = FakeSerialDevice()
+    esp32 = ESP32_UART(port=device.port, baudrate=9600)
+    try:
+        for data_byte in (1, 2, 1, 1, 2):
+            esp32.send_packet(data_byte)
+        device.wait_for(15)
+        print("Gói nhận được:", [packet.hex() for packet in device.packets()])
+        print("Số liệu UART:", esp32.metrics())
+    finally:
+        esp32.close()
+        device.close()
@@ -0,0 +1,189 @@
+import argparse
+import random
+import threading
+import time
+
+from fake_serial import FakeSerialDevice
+from toUart import ESP32_UART
+from uart_protocol import ACK, BUSY, CMD_HELLO, NAK, SERVO_CYCLE_TIMES, FrameParser, SortScheduler, encode_frame
+
+
+class FirmwareSimulator(FakeSerialDevice):
+    """
+    Giả lập firmware code_classify/servo.ino qua pty (loopback), không cần ESP32.
+
+    protocol="v1": khung 3 byte, firmware xử lý tuần tự và chặn trong suốt chu kỳ
+    servo; lệnh tới trong lúc đó nằm trong buffer RX (mặc định 64 byte như Arduino),
+    tràn buffer thì lệnh bị mất.
+    protocol="v2": trả ACK/BUSY/NAK theo uart_protocol, lệnh gửi lại cùng seq
+    không bị chạy hai lần.
+    """
+    def __init__(self, protocol="v2", cycle_times=None, rx_buffer=64, time_scale=1.0):
+        self.protocol = protocol
+        self.time_scale = time_scale
+        self.cycle_times = {cmd: t * time_scale for cmd, t in (cycle_times or SERVO_CYCLE_TIMES).items()}
+        self.rx_buffer = rx_buffer
+
+        self.parser = FrameParser()
+        self.busy_until = 0.0
+        self.last_seq = None
+        self.pending = bytearray()
+        self.pending_ready = threading.Condition()
+
+        # --- Kết quả ---
+        self.sorted = []
+        self.lost = 0
+        self.busy_replies = 0
+        self.nak_replies = 0
+        self.sessions = 0
+
+        super().__init__()
+        if protocol == "v1":
+            threading.Thread(target=self._v1_loop, daemon=True).start()
+
+    def on_data(self, data):
+        if self.protocol == "v1":
+            with self.pending_ready:
+                for i in range(0, len(data), 3):
+                    packet = data[i:i + 3]
+                    if len(self.pending) + len(packet) > self.rx_buffer:
+                        self.lost += 1
+                    else:
+                        self.pending.extend(packet)
+                self.pending_ready.notify()
+            return
+
+        for frame in self.parser.feed(data):
+            now = time.monotonic()
+            if frame.value == CMD_HELLO:
+                status = ACK  # Phiên mới của host: quên seq cũ
+                self.last_seq = None
+                self.sessions += 1
+            elif frame.seq == self.last_seq:
+                status = ACK  # Gói gửi lại sau khi ACK bị mất: chỉ xác nhận lại
+            elif frame.value not in self.cycle_times:
+                status = NAK
+                self.nak_replies += 1
+            elif now < self.busy_until:
+                status = BUSY
+                self.busy_replies += 1
+            else:
+                status = ACK
+                self.last_seq = frame.seq
+                self.busy_until = now + self.cycle_times[frame.value]
+                self.sorted.append((frame.value, now))
+            self.reply(encode_frame(frame.seq, status))
+
+    def _v1_loop(self):
+        while self.running:
+            with self.pending_ready:
+                self.pending_ready.wait_for(lambda: len(self.pending) >= 3 or not self.running, 0.1)
+                if len(self.pending) < 3:
+                    continue
+                packet = bytes(self.pending[:3])
+                del self.pending[:3]
+            if packet[0] == 0x02 and packet[2] == 0x03 and packet[1] in self.cycle_times:
+                self.sorted.append((packet[1], time.monotonic()))
+                time.sleep(self.cycle_times[packet[1]])
+
+
+def run_benchmark(protocol="v2", items=40, rate_per_min=30.0, bottle_ratio=0.5, time_scale=0.05, seed=0):
+    """
+    Gửi items lệnh với tốc độ rate_per_min (theo thời gian thật của máy) qua
+    firmware giả lập và trả về số liệu phân loại.
+    """
+    rng = random.Random(seed)
+    firmware = FirmwareSimulator(protocol=protocol, time_scale=time_scale)
+    scheduler = SortScheduler({cmd: t * time_scale for cmd, t in SERVO_CYCLE_TIMES.items()},
+                              min_gap=0.05 * time_scale)
+    uart = ESP32_UART(port=firmware.port, protocol=protocol, scheduler=scheduler,
+                      queue_size=items, command_timeout=60.0, verbose=False)
+
+    interval = 60.0 / rate_per_min * time_scale
+    start = time.monotonic()
+    for _ in range(items):
+        uart.send_packet(1 if rng.random() < bottle_ratio else 2)
+        time.sleep(interval)
+
+    deadline = time.monotonic() + items * 3.0 * time_scale + 5.0
+    while time.monotonic() < deadline and uart.sent + uart.failed + uart.dropped < items:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    elapsed = (time.monotonic() - start) / time_scale
+
+    metrics = uart.metrics()
+    uart.close()
+    firmware.close()
+
+    sorted_count = len(firmware.sorted)
+    return {
+        "protocol": protocol,
+        "offered_per_min": rate_per_min,
+        "items": items,
+        "sorted": sorted_count,
+        "lost": items - sorted_count,
+        "sorted_per_min": sorted_count / elapsed * 60.0 if elapsed else 0.0,
+        "latency_p95_s": metrics["latency_p95_ms"] / 1000.0 / time_scale,
+        "retries": metrics["retries"],
+        "busy": firmware.busy_replies,
+    }
+
+
+def check_reconnect(time_scale=0.05):
+    """
+    Host khởi động lại khi firmware vẫn chạy: seq của host đếm lại từ đầu nên lệnh
+    đầu tiên của phiên mới trùng seq với lệnh cuối của phiên cũ. Trả về True nếu
+    lệnh đó vẫn được phân loại (firmware quên seq cũ nhờ HELLO).
+    """
+    firmware = FirmwareSimulator(protocol="v2", time_scale=time_scale)
+    scheduler = SortScheduler({cmd: t * time_scale for cmd, t in SERVO_CYCLE_TIMES.items()},
+                              min_gap=0.05 * time_scale)
+    try:
+        for session in range(2):
+            uart = ESP32_UART(port=firmware.port, protocol="v2", scheduler=scheduler, verbose=False)
+            uart.send_packet(1)
+            deadline = time.monotonic() + 5.0
+            while time.monotonic() < deadline and uart.sent + uart.failed < 1:
+                time.sleep(0.01)
+            uart.close()
+            time.sleep(scheduler.cycle_times[1] + 0.05)
+    finally:
+        firmware.close()
+    ok = len(firmware.sorted) == 2
+    print(f"Kết nối lại: phân loại {len(firmware.sorted)}/2 lệnh, {firmware.sessions} phiên {'✅' if ok else '❌'}")
+    return ok
+
+
+def find_max_rate(protocol="v2", rates=(10, 20, 30, 40, 60, 90, 120), max_latency=5.0, **kwargs):
+    """Tốc độ (vật/phút) lớn nhất không mất lệnh và độ trễ p95 không vượt max_latency giây."""
+    best = 0
+    for rate in rates:
+        result = run_benchmark(protocol=protocol, rate_per_min=rate, **kwargs)
+        ok = result["lost"] == 0 and result["latency_p95_s"] <= max_latency
+        print(f"{protocol} {rate:>5} vật/phút -> phân loại {result['sorted']}/{result['items']}, "
+              f"p95 {result['latency_p95_s']:.2f} s {'✅' if ok else '❌'}")
+        if ok:
+            best = rate
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo thông lượng phân loại qua firmware giả lập.")
+    parser.add_argument("--protocol", choices=["v1", "v2"], default="v2")
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=30.0, help="Số vật đưa vào mỗi phút")
+    parser.add_argument("--bottle-ratio", type=float, default=0.5)
+    parser.add_argument("--time-scale", type=float, default=0.05, help="Hệ số tăng tốc mô phỏng (<1 = nhanh hơn)")
+    parser.add_argument("--sweep", action="store_true", help="Tìm tốc độ lớn nhất không mất lệnh")
+    parser.add_argument("--check-reconnect", action="store_true",
+                        help="Kiểm tra lệnh đầu tiên sau khi host khởi động lại vẫn được phân loại")
+    args = parser.parse_args()
+
+    if args.check_reconnect:
+        raise SystemExit(0 if check_reconnect(args.time_scale) else 1)
+
+    common = dict(items=args.items, bottle_ratio=args.bottle_ratio, time_scale=args.time_scale)
+    if args.sweep:
+        print(f"Tốc độ tối đa ({args.protocol}): {find_max_rate(args.protocol, **common)} vật/phút")
+    else:
+        print(run_benchmark(protocol=args.protocol, rate_per_min=args.rate, **common))
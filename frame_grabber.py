@@ -0,0 +1,268 @@
+import collections
+import os
+import platform
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# ===============================================================
+# MỞ NGUỒN VIDEO: chọn backend và thương lượng độ phân giải
+# ===============================================================
+#
+# source có thể là:
+#   0, 1, ...                     webcam; Linux dùng V4L2, xin camera trả thẳng
+#                                 đúng size/fps với fourcc MJPG (hoặc YUYV)
+#   "gst:<pipeline>"              pipeline GStreamer tự viết (phải kết thúc bằng appsink)
+#   "rtsp://...", file video      FFmpeg, bật giải mã phần cứng nếu OpenCV hỗ trợ;
+#                                 api="gstreamer" thì dựng pipeline decodebin + videoscale
+#                                 để bộ giải mã trả frame đúng size, không resize lại.
+
+
+def gstreamer_available():
+    return "GStreamer:                   YES" in cv2.getBuildInformation()
+
+
+def gstreamer_pipeline(source, size):
+    """Pipeline GStreamer giải mã file / RTSP và scale về size ngay trong pipeline."""
+    width, height = size
+    if "://" in source:
+        src = f"rtspsrc location={source} latency=100 ! decodebin" if source.startswith("rtsp") \
+            else f"souphttpsrc location={source} ! decodebin"
+    else:
+        src = f"filesrc location={source} ! decodebin"
+    return (f"{src} ! videoconvert ! videoscale ! video/x-raw,format=BGR,width={width},height={height} "
+            "! appsink drop=false max-buffers=2 sync=false")
+
+
+def open_capture(source, size=(640, 480), fps=None, fourcc="MJPG", api="auto"):
+    """
+    Mở cv2.VideoCapture cho source (xem đầu file) và xin kích thước size từ camera.
+
+    Returns:
+        tuple: (cap, mô tả chế độ đã thương lượng). cap.isOpened() == False nếu lỗi.
+    """
+    if isinstance(source, str) and source.startswith("gst:"):
+        cap = cv2.VideoCapture(source[4:], cv2.CAP_GSTREAMER)
+        return cap, "gstreamer"
+
+    if isinstance(source, int):
+        # V4L2 trực tiếp trên Linux: CAP_ANY có thể chọn GStreamer và bỏ qua các thuộc tính dưới
+        api_pref = cv2.CAP_V4L2 if platform.system() == "Linux" and api == "auto" else cv2.CAP_ANY
+        cap = cv2.VideoCapture(source, api_pref)
+        if not cap.isOpened():
+            return cap, "camera"
+        # Thứ tự quan trọng với V4L2: fourcc trước, rồi kích thước, rồi fps
+        if fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        if fps:
+            cap.set(cv2.CAP_PROP_FPS, fps)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        code = int(cap.get(cv2.CAP_PROP_FOURCC))
+        mode = "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)) if code > 0 else "?"
+        return cap, f"camera {mode}"
+
+    if api == "gstreamer" or (api == "auto" and isinstance(source, str) and os.environ.get("RVM_GSTREAMER")):
+        if gstreamer_available():
+            cap = cv2.VideoCapture(gstreamer_pipeline(source, size), cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                return cap, "gstreamer"
+        print("⚠️ OpenCV không có GStreamer, dùng FFmpeg.")
+
+    params = []
+    if hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+        params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+    if not cap.isOpened():
+        cap = cv2.VideoCapture(source)
+        return cap, "default"
+    accel = cap.get(cv2.CAP_PROP_HW_ACCELERATION) if params else 0
+    return cap, "ffmpeg" + (" hw" if accel and accel > 0 else "")
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Luồng đọc camera/video riêng, tách khỏi vòng lặp suy luận.
+
+    Frame được giữ trong một ring nhỏ (buffer_size frame). Với camera, khi ring đầy
+    thì frame cũ nhất bị bỏ và consumer luôn lấy frame mới nhất, nên độ trễ từ lúc
+    chụp tới lúc ra quyết định không bị dồn lên khi model chạy chậm hơn camera.
+    Với file video, mặc định không bỏ frame nào (producer chờ consumer).
+
+    Frame được giải mã / resize thẳng vào các buffer cấp phát sẵn (pool), không tạo
+    mảng mới mỗi frame; khi nguồn đã trả đúng size thì bỏ hẳn bước resize. Một frame
+    lấy từ read() chỉ còn hợp lệ trong spare_buffers lần read() tiếp theo, sau đó
+    buffer bị ghi đè: luồng đọc frame được dùng tự do, còn frame chuyển sang luồng
+    khác (UI, bus, hàng đợi hiển thị) phải đi qua detach(). Frame lặp lại (camera trả
+    lại buffer cũ) bị bỏ qua; frame nguồn bị mất được suy ra từ timestamp.
+    """
+    def __init__(self, source, size=(640, 480), buffer_size=1, drop_frames=None,
+                 fps=None, fourcc="MJPG", api="auto", spare_buffers=3):
+        super().__init__(daemon=True)
+        self.source = source
+        self.size = size
+        self.frames = collections.deque(maxlen=max(1, buffer_size))
+        self.drop_frames = not isinstance(source, str) if drop_frames is None else drop_frames
+        self.condition = threading.Condition()
+        self.opened = threading.Event()
+        self.running = True
+        self.finished = False
+        self.error = None
+
+        # --- Thương lượng với nguồn ---
+        self.fps = fps
+        self.fourcc = fourcc
+        self.api = api
+        self.mode = None
+        self.native_size = None
+
+        # Pool buffer: ring + spare_buffers frame đã giao cho consumer + frame đang ghi
+        self.pool = [np.empty((size[1], size[0], 3), dtype=np.uint8)
+                     for _ in range(self.frames.maxlen + spare_buffers + 1)]
+        self.handed_out = collections.deque(maxlen=spare_buffers)
+        self.decode_buffer = None
+        self.frame_interval = None
+
+        # --- Bộ đếm ---
+        self.captured = 0
+        self.dropped = 0       # Bỏ vì consumer chậm hơn nguồn
+        self.duplicated = 0    # Nguồn trả lại đúng frame trước đó
+        self.missed = 0        # Nguồn nhảy cóc timestamp (frame mất trước khi tới đây)
+        self.last_timestamp = None
+        self.last_signature = None
+
+        # Đối tượng có record(stage, seconds) để đo thời gian đọc / resize, None = tắt
+        self.stage_timer = None
+
+    def run(self):
+        cap, self.mode = open_capture(self.source, self.size, self.fps, self.fourcc, self.api)
+        if not cap.isOpened():
+            self.error = IOError(f"Không thể mở video tại: {self.source}")
+            self._finish()
+            self.opened.set()
+            return
+        self.native_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        source_fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / source_fps if 0 < source_fps < 1000 else None
+        print(f"📷 Nguồn video: {self.mode}, {self.native_size[0]}x{self.native_size[1]}"
+              f"{f' @ {source_fps:g} fps' if self.frame_interval else ''}"
+              f"{'' if self.native_size == tuple(self.size) else f' -> resize {self.size[0]}x{self.size[1]}'}")
+        self.opened.set()
+
+        while self.running:
+            start = time.perf_counter()
+            out = self._free_buffer()
+            direct = self.native_size == tuple(self.size)
+            success, frame = cap.read(out if direct else self.decode_buffer)
+            if not success:
+                if isinstance(self.source, str):
+                    print("⚠️ Hết video.")
+                    break
+                time.sleep(0.005)
+                continue
+
+            read_done = time.perf_counter()
+            if frame.shape[1::-1] == tuple(self.size):
+                if frame is not out:  # Nguồn đổi kích thước giữa chừng
+                    np.copyto(out, frame)
+                self.native_size = tuple(self.size)
+            else:
+                self.decode_buffer = frame  # Lần sau giải mã đè lên chính buffer này
+                cv2.resize(frame, tuple(self.size), dst=out)
+            if self.stage_timer is not None:
+                self.stage_timer.record("capture", read_done - start)
+                self.stage_timer.record("resize", time.perf_counter() - read_done)
+            if self._is_duplicate(cap, out):
+                continue
+            with self.condition:
+                if not self.drop_frames:
+                    while self.running and len(self.frames) == self.frames.maxlen:
+                        self.condition.wait(0.1)
+                if len(self.frames) == self.frames.maxlen:
+                    self.dropped += 1
+                self.frames.append(out)
+                self.captured += 1
+                self.condition.notify_all()
+
+        cap.release()
+        self._finish()
+
+    def _free_buffer(self):
+        """Buffer không nằm trong ring và không nằm trong spare_buffers frame vừa giao cho consumer."""
+        with self.condition:
+            busy = {id(frame) for frame in self.frames} | {id(frame) for frame in self.handed_out}
+        for frame in self.pool:
+            if id(frame) not in busy:
+                return frame
+        raise RuntimeError("FrameGrabber: hết buffer trống")  # Không xảy ra với kích thước pool ở trên
+
+    def _is_duplicate(self, cap, frame):
+        """
+        Phát hiện frame lặp / frame mất: ưu tiên timestamp của nguồn, không có thì so
+        chữ ký thưa của ảnh (~300 pixel, rẻ hơn nhiều so với một lần suy luận).
+        """
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        if timestamp > 0:
+            previous, self.last_timestamp = self.last_timestamp, timestamp
+            if previous is not None:
+                if timestamp == previous:
+                    self.duplicated += 1
+                    return True
+                if self.frame_interval and timestamp - previous > 1.5 * self.frame_interval:
+                    self.missed += int(round((timestamp - previous) / self.frame_interval)) - 1
+            return False
+        signature = frame[::32, ::32].tobytes()
+        if signature == self.last_signature:
+            self.duplicated += 1
+            return True
+        self.last_signature = signature
+        return False
+
+    def _finish(self):
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def read(self, timeout=None):
+        """
+        Lấy frame tiếp theo cho vòng suy luận.
+
+        Chế độ bỏ frame: trả về frame mới nhất, các frame cũ hơn trong ring bị bỏ.
+        Chế độ không bỏ frame: trả về frame cũ nhất (FIFO).
+        Trả về None khi hết thời gian chờ hoặc nguồn đã kết thúc.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.finished, timeout)
+            if not self.frames:
+                return None
+            if self.drop_frames:
+                frame = self.frames.pop()
+                self.dropped += len(self.frames)
+                self.frames.clear()
+            else:
+                frame = self.frames.popleft()
+            self.handed_out.append(frame)
+            self.condition.notify_all()
+            return frame
+
+    def detach(self, frame):
+        """
+        Trả về frame an toàn để giao cho luồng khác: nếu frame còn dùng chung bộ nhớ
+        với pool thì copy, còn frame đã là mảng mới (resize, đổi màu) thì giữ nguyên.
+        """
+        if any(np.shares_memory(frame, buffer) for buffer in self.pool):
+            return frame.copy()
+        return frame
+
+    def stats(self):
+        return {"captured": self.captured, "dropped": self.dropped,
+                "duplicated": self.duplicated, "missed": self.missed}
+
+    def stop(self):
+        """Signals the thread to stop."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
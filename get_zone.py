@@ -12,18 +12,24 @@ def mouse_callback(event, x, y, flags, params):
         selected_points.append([x, y])
         print(f"Đã chọn điểm: ({x}, {y})")
 
-def run_video_selection(video_path):
+def run_video_selection(video_path, frame_size=(640, 480)):
     """
     Hàm chính để chạy video, cho phép chọn điểm và lưu tọa độ.
 
     Args:
         video_path (str): Đường dẫn đến tệp video.
+        frame_size (tuple): Kích thước resize frame, trùng với frame mà YOLOProcessor
+            xử lý để toạ độ dùng được trực tiếp làm roi_points. None để giữ nguyên.
+
+    Returns:
+        list: Các điểm đã lưu lần cuối (nhấn 'c'), dùng cho YOLOProcessor(roi_points=...).
     """
+    saved_points = []
     cap = cv2.VideoCapture(video_path)
 
     if not cap.isOpened():
         print("Lỗi: Không thể mở tệp video.")
-        return
+        return saved_points
 
     cv2.namedWindow("Video")
     cv2.setMouseCallback("Video", mouse_callback)
@@ -34,6 +40,9 @@ def run_video_selection(video_path):
             print("Video đã kết thúc hoặc có lỗi khi đọc khung hình.")
             break
 
+        if frame_size:
+            frame = cv2.resize(frame, frame_size)
+
         # Vẽ các điểm đã chọn lên khung hình
         for point in selected_points:
             cv2.circle(frame, tuple(point), 5, (0, 0, 255), -1)
@@ -46,6 +55,7 @@ def run_video_selection(video_path):
         if key == ord('c'):
             if selected_points:
                 print("Tọa độ các điểm đã lưu:", selected_points)
+                saved_points = [list(point) for point in selected_points]
                 # Xóa danh sách điểm sau khi lưu để có thể chọn lại
                 selected_points.clear() 
             else:
@@ -57,6 +67,7 @@ def run_video_selection(video_path):
 
     cap.release()
     cv2.destroyAllWindows()
+    return saved_points
 
 if __name__ == "__main__":
     # Thay thế "your_video.mp4" bằng đường dẫn thực tế đến tệp video của bạn
@@ -0,0 +1,100 @@
+import time
+
+
+class GifPlayer:
+    """
+    Phát một dãy frame (CTkFrameSequence hoặc list CTkImage) lên một label Tk.
+
+    - Mỗi frame hiển thị đúng thời gian của nó (frames.duration(i), mặc định 100 ms).
+    - Lịch phát bám theo đồng hồ thật: khi vòng lặp Tk bị trễ (luồng khác đang
+      bận), player nhảy tới frame đúng thời điểm thay vì phát bù từng frame,
+      nên không dồn callback và không chiếm thêm CPU của luồng nhận diện.
+    - Chỉ giữ một callback after() tại một thời điểm; play() mới huỷ cái cũ.
+    - Dãy frame có pin()/unpin() (CTkFrameSequence) được pin trong lúc phát để
+      cache không bỏ frame của vòng lặp đang chạy.
+    """
+    def __init__(self, label, default_duration=100, min_delay=10):
+        self.label = label
+        self.default_duration = default_duration
+        self.min_delay = min_delay
+        self.frames = None
+        self.loop = True
+        self.on_complete = None
+        self.after_id = None
+        self.index = -1
+        self.next_due = 0.0
+
+        # --- Thống kê ---
+        self.shown = 0
+        self.dropped = 0
+
+    def play(self, frames, loop=True, on_complete=None):
+        self.stop()
+        if not frames:
+            return
+        self.frames = frames
+        if hasattr(frames, "pin"):
+            frames.pin()
+        self.loop = loop
+        self.on_complete = on_complete
+        self.index = -1
+        self.next_due = time.monotonic()
+        self._tick()
+
+    def stop(self):
+        if self.after_id is not None:
+            try:
+                self.label.after_cancel(self.after_id)
+            except Exception:
+                pass
+            self.after_id = None
+        self._release()
+
+    def _release(self):
+        """Bỏ pin dãy frame đang phát (nếu có)."""
+        if self.frames is not None and hasattr(self.frames, "unpin"):
+            self.frames.unpin()
+        self.frames = None
+
+    @property
+    def playing(self):
+        return self.after_id is not None
+
+    def _duration(self, index):
+        duration = getattr(self.frames, "duration", None)
+        return (duration(index) if duration else self.default_duration) / 1000.0
+
+    def _tick(self):
+        self.after_id = None
+        if not self.label.winfo_exists():
+            self._release()
+            return
+        now = time.monotonic()
+        total = len(self.frames)
+
+        # Tiến tới frame ứng với thời điểm hiện tại, bỏ qua các frame đã trễ
+        index, skipped = self.index, -1
+        while now >= self.next_due:
+            index += 1
+            if index >= total:
+                if not self.loop:
+                    self._release()
+                    if self.on_complete:
+                        self.on_complete()
+                    return
+                index = 0
+            self.next_due += self._duration(index)
+            skipped += 1
+            if skipped > total:
+                # Trễ quá một vòng (ví dụ cửa sổ bị treo): bắt đầu lại lịch từ bây giờ
+                self.next_due = now + self._duration(index)
+                break
+
+        if index != self.index:
+            self.dropped += max(0, skipped)
+            self.index = index
+            self.label.configure(image=self.frames[index])
+            self.shown += 1
+
+        delay = max(self.min_delay, int((self.next_due - time.monotonic()) * 1000))
+        self.after_id = self.label.after(delay, self._tick)
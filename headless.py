@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# Mã thoát: 0 = chạy xong, 1 = pipeline không khởi động được (model / nguồn video),
+# 2 = sai tham số dòng lệnh (argparse), 3 = không in được phiếu --receipt
+EXIT_OK = 0
+EXIT_SETUP_FAILED = 1
+EXIT_RECEIPT_FAILED = 3
+
+
+class JsonLinesWriter:
+    """Ghi sự kiện dạng JSON lines, an toàn khi gọi từ nhiều luồng."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def parse_source(value):
+    """'0' -> webcam 0, còn lại là đường dẫn file / URL stream."""
+    return int(value) if value.isdigit() else value
+
+
+def crossing_record(processor, event, class_names, lane=None):
+    record = {
+        "type": "crossing",
+        "ts": time.time(),
+        "frame": processor.frames_processed,
+        "track_id": event.track_id,
+        "cls": event.cls_id,
+        "label": class_names.get(event.cls_id, str(event.cls_id)),
+        "direction": event.direction,
+        "x": round(event.point[0], 1),
+        "y": round(event.point[1], 1),
+        "bottle": processor.bottle_count,
+        "can": processor.can_count,
+    }
+    if lane is not None:
+        record["lane"] = lane
+    return record
+
+
+def stats_record(processor, kind="stats", backend=None, lane=None):
+    backend = backend or processor.backend
+    record = {
+        "type": kind,
+        "ts": time.time(),
+        "fps": round(processor.fps, 2),
+        "backend": backend.name if backend else None,
+        "bottle": processor.bottle_count,
+        "can": processor.can_count,
+        **processor.frame_stats(),
+    }
+    adaptive = getattr(processor, "adaptive", None)
+    if adaptive:
+        record.update({f"adaptive_{k}": v for k, v in adaptive.stats().items()})
+    if lane is not None:
+        record["lane"] = lane
+    return record
+
+
+def error_record(message):
+    return {"type": "error", "ts": time.time(), "error": message}
+
+
+def load_lanes(path, defaults, on_event):
+    """
+    Đọc cấu hình nhiều lane từ file JSON: danh sách các object, mỗi object gồm
+    "name", "source" và tuỳ chọn "line", "roi", "uart_port", "uart_protocol", "motion_gate", "capture".
+    """
+    from multi_lane import Lane
+
+    with open(path, encoding="utf-8") as f:
+        configs = json.load(f)
+    lanes = []
+    for i, cfg in enumerate(configs):
+        lanes.append(Lane(
+            name=cfg.get("name", f"lane{i}"),
+            source=parse_source(str(cfg["source"])),
+            line=cfg.get("line", defaults.line),
+            roi_points=cfg.get("roi"),
+            tracker=cfg.get("tracker", defaults.tracker),
+            motion_gate=cfg.get("motion_gate", not defaults.no_motion_gate),
+            uart_port=cfg.get("uart_port"),
+            uart_protocol=cfg.get("uart_protocol", defaults.uart_protocol),
+            on_event=on_event,
+            capture_options=cfg.get("capture", defaults.capture),
+        ))
+    return lanes
+
+
+def run_lanes(args, writer, ledger=None):
+    """Chế độ nhiều lane: một model, suy luận theo lô cho mọi camera trong --lanes. Trả về mã thoát."""
+    from backend_count import CLASS_NAMES
+    from inference_backend import resolve_model
+    from multi_lane import MultiLaneProcessor
+
+    def on_event(lane, event):
+        writer.write(crossing_record(lane, event, CLASS_NAMES, lane=lane.name))
+        if ledger:
+            ledger.record_crossing(event, lane=lane.name)
+
+    lanes = load_lanes(args.lanes, args, on_event)
+    engine = MultiLaneProcessor(lanes, resolve_model(args.model, args.precision), backend=args.backend)
+    engine.start()
+
+    def write_stats(kind):
+        for lane in engine.lanes:
+            writer.write(stats_record(lane, kind=kind, backend=engine.backend, lane=lane.name))
+
+    try:
+        while engine.is_alive():
+            engine.join(timeout=args.stats_interval)
+            if engine.is_alive() and engine.backend:
+                write_stats("stats")
+    except KeyboardInterrupt:
+        engine.stop()
+        engine.join(timeout=2.0)
+    if engine.error:
+        writer.write(error_record(engine.error))
+        return EXIT_SETUP_FAILED
+    write_stats("summary")
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Chạy nhận diện & đếm chai/lon không cần giao diện.")
+    parser.add_argument("--source", default="0", help="Webcam (0, 1, ...) hoặc đường dẫn video / URL stream")
+    parser.add_argument("--model", default=r"model/best.pt")
+    parser.add_argument("--backend", default="auto", choices=["auto", "cuda", "openvino", "onnx", "torch"])
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "int8"],
+                        help="int8 = dùng model lượng tử hoá <model>_int8.onnx (tạo bằng quantize.py)")
+    parser.add_argument("--tracker", default=r"tracking/bytetrack.yaml")
+    parser.add_argument("--line", type=json.loads, default=[10, 190, 630, 190],
+                        help="Line đếm dạng JSON, ví dụ '[10, 190, 630, 190]'")
+    parser.add_argument("--roi", type=json.loads, default=None,
+                        help="Các điểm ROI dạng JSON (từ get_zone), ví dụ '[[0, 120], [640, 260]]'")
+    parser.add_argument("--no-motion-gate", action="store_true", help="Chạy YOLO trên mọi frame")
+    parser.add_argument("--capture", type=json.loads, default=None,
+                        help="Tuỳ chọn mở nguồn dạng JSON, ví dụ '{\"fourcc\": \"YUYV\", \"fps\": 30}' "
+                             "hoặc '{\"api\": \"gstreamer\"}'")
+    parser.add_argument("--inference", default="thread", choices=["thread", "process"],
+                        help="'process' = chạy model ở tiến trình riêng, frame đi qua shared memory")
+    parser.add_argument("--latency-budget", type=float, default=None,
+                        help="Độ trễ tối đa mỗi frame (ms): tự đổi imgsz / bỏ frame để giữ dưới mức này")
+    parser.add_argument("--uart-port", default=None, help="Cổng ESP32 (bỏ trống để tắt UART)")
+    parser.add_argument("--uart-protocol", default="v1", choices=["v1", "v2"])
+    parser.add_argument("--events", default="-", help="File JSON lines để ghi sự kiện ('-' = stdout)")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="Chu kỳ ghi dòng thống kê (giây)")
+    parser.add_argument("--receipt", default=None, help="In phiếu tổng kết cho khách hàng này khi kết thúc")
+    parser.add_argument("--printer", default=None,
+                        help="Máy in: win32, usb:VID:PID, network:HOST:PORT, file:/dev/..., dummy:FILE "
+                             "(mặc định: biến môi trường RVM_PRINTER, rồi máy in Windows)")
+    parser.add_argument("--lanes", default=None,
+                        help="File JSON cấu hình nhiều lane (bỏ qua --source/--roi/--uart-port)")
+    parser.add_argument("--ledger", default=None,
+                        help="File SQLite sổ giao dịch (ví dụ data/ledger.db), ghi mọi lượt đếm và phiếu in")
+    return parser
+
+
+def main(argv=None):
+    """Trả về mã thoát (EXIT_*); lỗi khởi động được ghi thành bản ghi {"type": "error"} thay cho summary."""
+    args = build_parser().parse_args(argv)
+    stream = sys.stdout if args.events == "-" else open(args.events, "a", encoding="utf-8")
+    writer = JsonLinesWriter(stream)
+
+    # Log thường (kể cả cảnh báo lúc import backend) ra stderr để stdout chỉ chứa JSON lines
+    code = EXIT_OK
+    with contextlib.redirect_stdout(sys.stderr):
+        ledger = None
+        if args.ledger:
+            from ledger import Ledger
+            ledger = Ledger(args.ledger)
+
+        if args.lanes:
+            code = run_lanes(args, writer, ledger)
+            if ledger:
+                ledger.close()
+            if stream is not sys.stdout:
+                stream.close()
+            return code
+
+        from backend_count import CLASS_NAMES, YOLOProcessor, compute_points
+        from print_spooler import PrintSpooler, create_backend
+
+        def on_event(event):
+            writer.write(crossing_record(processor, event, CLASS_NAMES))
+            if ledger:
+                ledger.record_crossing(event)
+
+        processor = YOLOProcessor(
+            video_path=parse_source(args.source),
+            model_path=args.model,
+            precision=args.precision,
+            output_queue=None,
+            backend=args.backend,
+            line=args.line,
+            motion_gate=not args.no_motion_gate,
+            roi_points=args.roi,
+            tracker=args.tracker,
+            uart_port=args.uart_port,
+            uart_protocol=args.uart_protocol,
+            inference=args.inference,
+            capture_options=args.capture,
+            adaptive={"budget_ms": args.latency_budget} if args.latency_budget else None,
+            on_event=on_event,
+        )
+        processor.start()
+        try:
+            while processor.is_alive():
+                processor.join(timeout=args.stats_interval)
+                if processor.is_alive() and processor.backend:
+                    writer.write(stats_record(processor))
+        except KeyboardInterrupt:
+            processor.stop()
+            processor.join(timeout=2.0)
+
+        if processor.error:
+            writer.write(error_record(processor.error))
+            code = EXIT_SETUP_FAILED
+        else:
+            writer.write(stats_record(processor, kind="summary"))
+
+        if args.receipt and code == EXIT_OK:
+            spooler = PrintSpooler(create_backend(args.printer) if args.printer else None,
+                                   on_update=ledger.record_receipt if ledger else None)
+            points = compute_points(processor.bottle_count, processor.can_count)
+            job = spooler.submit(args.receipt, processor.bottle_count, processor.can_count, points)
+            if not job.wait(timeout=60.0):
+                print(f"⚠️ Chưa in được phiếu ({job.status}): {job.error}")
+                writer.write(error_record(f"Chưa in được phiếu ({job.status}): {job.error}"))
+                code = EXIT_RECEIPT_FAILED
+            spooler.close(timeout=1.0)
+
+        if ledger:
+            ledger.close()
+
+    if stream is not sys.stdout:
+        stream.close()
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
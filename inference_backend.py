@@ -0,0 +1,189 @@
+import importlib.util
+import json
+import os
+import time
+
+import numpy as np
+from ultralytics import YOLO
+
+# Thứ tự ưu tiên khi không đo được độ trễ (nhanh -> chậm trên máy kiosk không GPU)
+BACKEND_NAMES = ("cuda", "openvino", "onnx", "torch")
+
+
+class InferenceBackend:
+    """
+    Gói model YOLO đã nạp cùng thông tin backend và thiết bị chạy.
+    """
+    def __init__(self, name, model, device, weights):
+        self.name = name
+        self.model = model
+        self.device = device
+        self.weights = weights
+        self.latency_ms = None
+
+    def track(self, frame, **kwargs):
+        """Chạy model.track trên một frame và trả về Results đầu tiên."""
+        return self.model.track(source=frame, device=self.device, verbose=False, **kwargs)[0]
+
+    def predict(self, frames, **kwargs):
+        """Chạy model.predict trên một lô frame (list ảnh), trả về list Results cùng thứ tự."""
+        return self.model.predict(source=list(frames), device=self.device, verbose=False, **kwargs)
+
+    def measure_latency(self, imgsz=640, frame_shape=(480, 640, 3), warmup=2, runs=5):
+        """
+        Đo độ trễ trung bình (ms/frame) trên một frame giả có kích thước của camera.
+        """
+        dummy = np.zeros(frame_shape, dtype=np.uint8)
+        for _ in range(warmup):
+            self.model.predict(source=dummy, imgsz=imgsz, device=self.device, verbose=False)
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.model.predict(source=dummy, imgsz=imgsz, device=self.device, verbose=False)
+        self.latency_ms = (time.perf_counter() - start) * 1000.0 / runs
+        return self.latency_ms
+
+    def __repr__(self):
+        latency = f"{self.latency_ms:.1f} ms/frame" if self.latency_ms is not None else "chưa đo"
+        return f"InferenceBackend({self.name}, device={self.device}, {latency})"
+
+
+def cuda_available():
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except Exception:
+        return False
+
+
+def available_backends():
+    """Liệt kê các backend có thể dùng trên máy hiện tại."""
+    names = []
+    if cuda_available():
+        names.append("cuda")
+    if importlib.util.find_spec("openvino") is not None:
+        names.append("openvino")
+    if importlib.util.find_spec("onnxruntime") is not None:
+        names.append("onnx")
+    names.append("torch")
+    return names
+
+
+def exported_path(model_path, fmt):
+    """Đường dẫn file/thư mục mà Ultralytics sinh ra khi export model_path sang fmt."""
+    stem = os.path.splitext(model_path)[0]
+    if fmt == "onnx":
+        return stem + ".onnx"
+    if fmt == "openvino":
+        return stem + "_openvino_model"
+    raise ValueError(f"Định dạng export không hỗ trợ: {fmt}")
+
+
+def export_cached(model_path, fmt, imgsz=640, dynamic=True):
+    """
+    Export model .pt sang ONNX/OpenVINO một lần và dùng lại bản đã cache.
+    Bản cache bị coi là cũ nếu file .pt mới hơn hoặc tham số export khác.
+    Mặc định export với kích thước đầu vào động để chạy được ROI / imgsz nhỏ.
+    """
+    target = exported_path(model_path, fmt)
+    stamp_path = target.rstrip("/\\") + ".export.json"
+    export_args = {"imgsz": imgsz, "dynamic": dynamic}
+
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(model_path):
+        try:
+            with open(stamp_path, "r", encoding="utf-8") as f:
+                if json.load(f) == export_args:
+                    return target
+        except (OSError, ValueError):
+            pass
+
+    print(f"⏳ Đang export model sang {fmt} (chỉ chạy lần đầu)...")
+    exported = YOLO(model_path).export(format=fmt, imgsz=imgsz, dynamic=dynamic, verbose=False)
+    target = str(exported) if exported else target
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        json.dump(export_args, f)
+    return target
+
+
+def quantized_path(model_path):
+    """model/best.pt -> model/best_int8.onnx (bản INT8 do quantize.py tạo)."""
+    return os.path.splitext(model_path)[0] + "_int8.onnx"
+
+
+def resolve_model(model_path, precision="fp32"):
+    """
+    Đường dẫn model theo độ chính xác: 'fp32' = model gốc, 'int8' = bản lượng tử hoá
+    cạnh model gốc. Chưa có bản INT8 thì cảnh báo và dùng model gốc.
+    """
+    if precision == "fp32":
+        return model_path
+    if precision != "int8":
+        raise ValueError(f"Độ chính xác không hợp lệ: {precision}")
+    path = quantized_path(model_path)
+    if not os.path.exists(path):
+        print(f"⚠️ Chưa có model INT8 {path} (tạo bằng: python quantize.py), dùng FP32.")
+        return model_path
+    return path
+
+
+def load_backend(model_path, name):
+    """Nạp model với một backend cụ thể ('cuda', 'openvino', 'onnx', 'torch')."""
+    if name not in BACKEND_NAMES:
+        raise ValueError(f"Backend không hợp lệ: {name}")
+
+    if model_path.endswith(".onnx"):
+        # Model ONNX có sẵn (ví dụ bản INT8): chỉ chạy bằng ONNX Runtime, không export lại
+        if name != "onnx":
+            raise ValueError(f"Model ONNX {model_path} chỉ chạy với backend onnx, không phải {name}")
+        return InferenceBackend(name, YOLO(model_path, task="detect"), "cpu", model_path)
+
+    if name == "cuda":
+        return InferenceBackend(name, YOLO(model_path), "0", model_path)
+    if name == "torch":
+        return InferenceBackend(name, YOLO(model_path), "cpu", model_path)
+
+    weights = export_cached(model_path, name)
+    return InferenceBackend(name, YOLO(weights, task="detect"), "cpu", weights)
+
+
+def select_backend(model_path, preferred="auto", imgsz=640, frame_shape=(480, 640, 3)):
+    """
+    Chọn backend suy luận.
+
+    Args:
+        model_path (str): Đường dẫn model gốc (.pt) hoặc model ONNX có sẵn (.onnx).
+        preferred (str): 'auto' để đo và chọn backend nhanh nhất,
+            hoặc tên một backend cụ thể trong BACKEND_NAMES.
+        imgsz (int): Kích thước ảnh đầu vào dùng khi đo độ trễ.
+        frame_shape (tuple): Kích thước ảnh thực tế đưa vào model (frame hoặc ROI).
+
+    Returns:
+        InferenceBackend: backend đã nạp, kèm latency_ms đã đo.
+    """
+    if preferred != "auto":
+        backend = load_backend(model_path, preferred)
+        backend.measure_latency(imgsz=imgsz, frame_shape=frame_shape)
+        print(f"✅ Backend suy luận: {backend.name} ({backend.device}) - {backend.latency_ms:.1f} ms/frame")
+        return backend
+
+    # Có GPU thì PyTorch CUDA gần như luôn nhanh nhất, không cần export thêm
+    candidates = ["cuda"] if cuda_available() else [n for n in available_backends() if n != "cuda"]
+    if model_path.endswith(".onnx"):
+        candidates = ["onnx"]
+
+    best = None
+    for name in candidates:
+        try:
+            backend = load_backend(model_path, name)
+            backend.measure_latency(imgsz=imgsz, frame_shape=frame_shape)
+        except Exception as e:
+            print(f"⚠️ Bỏ qua backend {name}: {e}")
+            continue
+        print(f"   - {backend.name}: {backend.latency_ms:.1f} ms/frame")
+        if best is None or backend.latency_ms < best.latency_ms:
+            best = backend
+
+    if best is None:
+        raise RuntimeError("Không nạp được model với backend nào.")
+
+    print(f"✅ Backend suy luận: {best.name} ({best.device}) - {best.latency_ms:.1f} ms/frame")
+    return best
@@ -0,0 +1,187 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# ===============================================================
+# SUY LUẬN Ở TIẾN TRÌNH RIÊNG, FRAME ĐI QUA SHARED MEMORY
+# ===============================================================
+#
+# Luồng YOLO trong tiến trình giao diện chỉ chép frame vào một ô của ring
+# shared memory và gửi chỉ số ô (vài byte) qua Queue. Tiến trình worker chạy
+# model.track trên ô đó rồi trả về mảng structured DETECTION_DTYPE (28 byte
+# mỗi vật), nên phần việc nặng (tiền xử lý, suy luận, NMS, tracker) không còn
+# tranh GIL với vòng lặp Tk.
+
+DETECTION_DTYPE = np.dtype([
+    ("x1", "f4"), ("y1", "f4"), ("x2", "f4"), ("y2", "f4"),
+    ("track_id", "i4"), ("conf", "f4"), ("cls", "i4"),
+])
+
+
+def detections_to_rows(detections):
+    """Mảng DETECTION_DTYPE -> mảng (N, 7) float32 giống results.boxes.data khi tracking."""
+    return np.column_stack([detections[name].astype(np.float32) for name in DETECTION_DTYPE.names]).reshape(-1, 7)
+
+
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 không có tham số track
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrameRing:
+    """
+    Ring các ô frame cùng kích thước nằm trong một khối shared memory.
+    Tiến trình tạo ring (create=True) chịu trách nhiệm unlink khi đóng.
+    """
+    def __init__(self, slots=2, shape=(480, 640, 3), dtype=np.uint8, name=None, create=True):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.owner = create
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * slots)
+        else:
+            self.shm = _attach_shared_memory(name)
+        self.name = self.shm.name
+        self.array = np.ndarray((slots, *self.shape), dtype=self.dtype, buffer=self.shm.buf)
+        self.next_slot = 0
+
+    def write(self, frame):
+        """Chép frame vào ô kế tiếp, trả về chỉ số ô."""
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.slots
+        np.copyto(self.array[slot], frame)
+        return slot
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _worker_main(model_path, backend, tracker, imgsz, conf, ring_name, slots, shape, tasks, results):
+    """Vòng lặp của tiến trình worker: nạp model, chạy track trên từng ô được gửi tới."""
+    try:
+        from inference_backend import select_backend
+        engine = select_backend(model_path, backend, imgsz=imgsz, frame_shape=(*shape[:2], 3))
+        ring = SharedFrameRing(slots, shape, name=ring_name, create=False)
+    except Exception as e:
+        results.put(("error", repr(e)))
+        return
+    results.put(("ready", engine.name, engine.device, engine.latency_ms))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        frame_id, slot, size = task
+        start = time.perf_counter()
+        if tracker is None:  # Tracker chạy ở tiến trình chính, worker chỉ phát hiện
+            result = engine.predict([ring.array[slot]], imgsz=size, conf=conf)[0]
+        else:
+            result = engine.track(ring.array[slot], imgsz=size, conf=conf, persist=True, tracker=tracker)
+        total_ms = (time.perf_counter() - start) * 1000.0
+        infer_ms = sum(v for v in result.speed.values() if v)
+
+        detections = np.empty(0, dtype=DETECTION_DTYPE)
+        if result.boxes and (result.boxes.is_track or tracker is None):
+            data = result.boxes.data.cpu().numpy()
+            if data.shape[1] == 6:  # Chưa có track_id
+                data = np.insert(data, 4, -1, axis=1)
+            detections = np.empty(len(data), dtype=DETECTION_DTYPE)
+            for i, name in enumerate(DETECTION_DTYPE.names):
+                detections[name] = data[:, i]
+        results.put(("result", frame_id, detections, infer_ms, max(0.0, total_ms - infer_ms)))
+    ring.close()
+
+
+class InferenceWorker:
+    """
+    Model YOLO chạy trong một tiến trình riêng, dùng như InferenceBackend
+    (có name / device / latency_ms) nhưng track() trả về mảng DETECTION_DTYPE.
+
+    Mỗi worker giữ trạng thái tracker của một luồng video, nên mỗi camera
+    dùng một worker riêng; nhiều camera = nhiều worker chạy trên nhiều nhân.
+    tracker=None: worker chỉ phát hiện (track_id = -1), tracker chạy ở phía gọi.
+    """
+    def __init__(self, model_path, backend="auto", tracker=r'tracking/bytetrack.yaml', imgsz=640,
+                 conf=0.25, shape=(480, 640, 3), slots=2, timeout=10.0):
+        self.model_path = model_path
+        self.tracker = tracker
+        self.imgsz = imgsz
+        self.conf = conf
+        self.timeout = timeout
+        self.name = None
+        self.device = None
+        self.latency_ms = None
+        self.frame_id = 0
+
+        # spawn: giống hành vi mặc định trên Windows và an toàn khi đã có luồng đang chạy
+        ctx = mp.get_context("spawn")
+        self.ring = SharedFrameRing(slots, shape)
+        self.tasks = ctx.Queue(maxsize=slots)
+        self.results = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(model_path, backend, tracker, imgsz, conf, self.ring.name, slots, self.ring.shape,
+                  self.tasks, self.results),
+            daemon=True,
+        )
+
+    def start(self, timeout=300.0):
+        """Khởi động tiến trình và chờ model nạp xong. Lỗi nạp model được ném lại ở đây."""
+        self.process.start()
+        try:
+            message = self.results.get(timeout=timeout)
+        except queue.Empty:
+            self.close()
+            raise RuntimeError("Worker suy luận không phản hồi khi nạp model.")
+        if message[0] == "error":
+            self.close()
+            raise RuntimeError(f"Worker suy luận lỗi: {message[1]}")
+        _, self.name, self.device, self.latency_ms = message
+        return self
+
+    def track(self, frame, imgsz=None):
+        """
+        Gửi một frame sang worker và chờ kết quả (giữ đúng thứ tự frame cho tracker).
+        imgsz=None dùng imgsz lúc tạo worker.
+
+        Returns:
+            tuple: (mảng DETECTION_DTYPE theo toạ độ frame gửi đi, ms suy luận, ms tracker).
+        """
+        if frame.shape != self.ring.shape:
+            raise ValueError(f"Frame {frame.shape} khác kích thước ring {self.ring.shape}")
+        self.frame_id += 1
+        slot = self.ring.write(frame)
+        self.tasks.put((self.frame_id, slot, imgsz or self.imgsz), timeout=self.timeout)
+        while True:
+            try:
+                message = self.results.get(timeout=self.timeout)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError("Worker suy luận đã dừng bất thường.")
+                continue
+            if message[0] == "result" and message[1] == self.frame_id:
+                return message[2], message[3], message[4]
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.tasks.put(None, timeout=1.0)
+            except queue.Full:
+                pass
+            self.process.join(timeout=5.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.ring.close()
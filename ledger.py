@@ -0,0 +1,252 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# ===============================================================
+# SỔ GIAO DỊCH (SQLite WAL): đếm, xác nhận, đổi quà, in phiếu
+# ===============================================================
+#
+# Luồng nhận diện / giao diện chỉ gọi record(), tức là đưa một tuple vào
+# hàng đợi (không I/O). Luồng ghi riêng gom nhiều bản ghi thành một
+# transaction (tối đa flush_interval giây hoặc batch_size bản ghi), nên độ
+# trễ nhận diện không đổi và số lần fsync ít. Bảng events chỉ được thêm
+# (trigger chặn UPDATE/DELETE); bảng totals giữ tổng cộng dồn, cập nhật trong
+# cùng transaction, để dashboard đọc số liệu bằng một truy vấn theo khoá.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id       INTEGER PRIMARY KEY,
+    ts       REAL NOT NULL,
+    kind     TEXT NOT NULL,
+    lane     TEXT,
+    track_id INTEGER,
+    cls      INTEGER,
+    bottles  INTEGER NOT NULL DEFAULT 0,
+    cans     INTEGER NOT NULL DEFAULT 0,
+    points   REAL NOT NULL DEFAULT 0,
+    user     TEXT,
+    detail   TEXT
+);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+CREATE INDEX IF NOT EXISTS events_user_ts ON events (user, ts) WHERE user IS NOT NULL;
+CREATE TRIGGER IF NOT EXISTS events_no_update BEFORE UPDATE ON events
+    BEGIN SELECT RAISE(ABORT, 'events chỉ được thêm'); END;
+CREATE TRIGGER IF NOT EXISTS events_no_delete BEFORE DELETE ON events
+    BEGIN SELECT RAISE(ABORT, 'events chỉ được thêm'); END;
+
+CREATE TABLE IF NOT EXISTS totals (
+    scope            TEXT PRIMARY KEY,
+    detected_bottles INTEGER NOT NULL DEFAULT 0,
+    detected_cans    INTEGER NOT NULL DEFAULT 0,
+    bottles          INTEGER NOT NULL DEFAULT 0,
+    cans             INTEGER NOT NULL DEFAULT 0,
+    points_earned    REAL NOT NULL DEFAULT 0,
+    points_redeemed  REAL NOT NULL DEFAULT 0,
+    receipts         INTEGER NOT NULL DEFAULT 0,
+    updated          REAL
+);
+INSERT OR IGNORE INTO totals (scope) VALUES ('all'), ('current');
+"""
+
+# Loại bản ghi -> các cột của totals được cộng thêm
+CROSSING, CONFIRM, REDEEM, RECEIPT, RECEIPT_FAILED, RESET = (
+    "crossing", "confirm", "redeem", "receipt", "receipt_failed", "reset")
+
+TOTAL_COLUMNS = ("detected_bottles", "detected_cans", "bottles", "cans",
+                 "points_earned", "points_redeemed", "receipts")
+
+
+def _totals_delta(kind, bottles, cans, points, user):
+    # Điểm của khách có tài khoản nằm trong customers.balance (accounts.py),
+    # totals chỉ cộng điểm của khách vãng lai; chai/lon thì tính cho mọi khách.
+    if kind == CROSSING:
+        return {"detected_bottles": bottles, "detected_cans": cans}
+    if kind == CONFIRM:
+        return {"bottles": bottles, "cans": cans, **({"points_earned": points} if user is None else {})}
+    if kind == REDEEM:
+        return {"points_redeemed": points} if user is None else {}
+    if kind == RECEIPT:
+        return {"receipts": 1}
+    return {}
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # FULL: mỗi commit được fsync; commit theo lô nên chi phí này nhỏ
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+
+class Ledger(threading.Thread):
+    """
+    Sổ giao dịch chỉ-thêm trên SQLite.
+
+    record*() an toàn khi gọi từ mọi luồng và không chặn; các hàm đọc
+    (summary, daily, recent) dùng kết nối riêng nên đọc song song với luồng ghi.
+    """
+    def __init__(self, path=r"data/ledger.db", flush_interval=0.5, batch_size=256):
+        super().__init__(daemon=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = queue.SimpleQueue()
+        self.written = 0
+        self.commits = 0
+        self.running = True
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.reader = connect(path)
+        self.read_lock = threading.Lock()
+        self.start()
+
+    # --- Ghi (không chặn) ---
+
+    def record(self, kind, bottles=0, cans=0, points=0.0, user=None, lane=None,
+               track_id=None, cls=None, detail=None, ts=None):
+        self.pending.put((ts or time.time(), kind, lane, track_id, cls, bottles, cans, points, user,
+                          json.dumps(detail, ensure_ascii=False) if detail is not None else None))
+
+    def record_crossing(self, event, lane=None):
+        """Một CrossingEvent / CountEvent (label 0 = chai, 1 = lon)."""
+        self.record(CROSSING, bottles=int(event.cls_id == 0), cans=int(event.cls_id == 1),
+                    lane=lane if lane is not None else getattr(event, "lane", None),
+                    track_id=int(event.track_id), cls=int(event.cls_id),
+                    detail={"direction": event.direction, "segment": event.segment})
+
+    def record_confirm(self, bottles, cans, points, user=None):
+        self.record(CONFIRM, bottles=bottles, cans=cans, points=points, user=user)
+
+    def record_redeem(self, points, user=None, detail=None):
+        self.record(REDEEM, points=points, user=user, detail=detail)
+
+    def record_receipt(self, job):
+        """PrintJob đã kết thúc (PrintSpooler on_update); phiếu in lỗi hẳn được ghi riêng là receipt_failed."""
+        if not job.done:
+            return
+        totals = job.totals
+        self.record(RECEIPT if job.status == job.DONE else RECEIPT_FAILED,
+                    bottles=totals.get("bottles", 0), cans=totals.get("cans", 0), points=totals.get("points", 0),
+                    user=totals.get("user"),
+                    detail={"job": job.job_id, "name": job.user_name, "attempts": job.attempts, "error": job.error})
+
+    def record_reset(self, user=None):
+        """Đặt lại số liệu 'current' của dashboard; lịch sử trong events vẫn giữ nguyên."""
+        self.record(RESET, user=user)
+
+    # --- Luồng ghi ---
+
+    def run(self):
+        while True:
+            batch, markers = [], []
+            try:
+                item = self.pending.get(timeout=self.flush_interval)
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if isinstance(item, threading.Event):
+                        markers.append(item)  # flush(): ghi ngay những gì đã nhận
+                        break
+                    batch.append(item)
+                    remaining = deadline - time.monotonic()
+                    if len(batch) >= self.batch_size or remaining <= 0:
+                        break
+                    item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+            if not self.running and (markers or not batch):
+                return
+
+    def _write(self, batch):
+        try:
+            with self.conn:  # Một transaction cho cả lô
+                self.conn.executemany(
+                    "INSERT INTO events (ts, kind, lane, track_id, cls, bottles, cans, points, user, detail) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                for row in batch:
+                    ts, kind, bottles, cans, points, user = row[0], row[1], row[5], row[6], row[7], row[8]
+                    if kind == RESET:
+                        zeros = ", ".join(f"{c} = 0" for c in TOTAL_COLUMNS)
+                        self.conn.execute(f"UPDATE totals SET {zeros}, updated = ? WHERE scope = 'current'", (ts,))
+                        continue
+                    delta = _totals_delta(kind, bottles, cans, points, user)
+                    if delta:
+                        sets = ", ".join(f"{c} = {c} + ?" for c in delta)
+                        self.conn.execute(f"UPDATE totals SET {sets}, updated = ? WHERE scope IN ('all', 'current')",
+                                          (*delta.values(), ts))
+            self.commits += 1
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            print(f"⚠️ Lỗi ghi sổ giao dịch ({len(batch)} bản ghi): {e}")
+
+    def request_flush(self):
+        """
+        Yêu cầu ghi ngay mọi bản ghi gửi trước lời gọi này, không chờ. Trả về
+        threading.Event được set khi đã commit (luồng Tk kiểm tra bằng after()).
+        """
+        marker = threading.Event()
+        self.pending.put(marker)
+        return marker
+
+    def flush(self, timeout=5.0):
+        """Chờ tới khi mọi bản ghi gửi trước lời gọi này đã được commit xuống đĩa."""
+        return self.request_flush().wait(timeout)
+
+    def close(self, timeout=5.0):
+        self.running = False
+        self.flush(timeout)  # Đồng thời đánh thức luồng ghi để nó thoát ngay
+        self.join(timeout)
+        self.conn.close()
+        self.reader.close()
+
+    # --- Đọc ---
+
+    def summary(self, scope="current"):
+        """
+        Tổng cộng dồn ('current' = từ lần reset gần nhất, 'all' = toàn bộ), kèm balance
+        (điểm còn lại của khách vãng lai).
+        """
+        with self.read_lock:
+            row = self.reader.execute(
+                f"SELECT {', '.join(TOTAL_COLUMNS)}, updated FROM totals WHERE scope = ?", (scope,)).fetchone()
+        result = dict(zip((*TOTAL_COLUMNS, "updated"), row))
+        result["balance"] = result["points_earned"] - result["points_redeemed"]
+        return result
+
+    def daily(self, days=7, kind=CONFIRM):
+        """Số chai/lon/điểm theo ngày (giờ địa phương) trong days ngày gần nhất."""
+        since = time.time() - days * 86400
+        with self.read_lock:
+            rows = self.reader.execute(
+                "SELECT date(ts, 'unixepoch', 'localtime') AS day, SUM(bottles), SUM(cans), SUM(points), COUNT(*) "
+                "FROM events WHERE kind = ? AND ts >= ? GROUP BY day ORDER BY day", (kind, since)).fetchall()
+        return [{"day": d, "bottles": b, "cans": c, "points": p, "events": n} for d, b, c, p, n in rows]
+
+    def recent(self, kind=None, limit=20, user=None):
+        """Các bản ghi mới nhất (dùng cho tra soát); user để xem lịch sử một khách hàng."""
+        query = "SELECT id, ts, kind, lane, track_id, cls, bottles, cans, points, user, detail FROM events"
+        conditions, args = [], ()
+        if kind:
+            conditions.append("kind = ?")
+            args += (kind,)
+        if user is not None:
+            conditions.append("user = ?")
+            args += (str(user),)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY " + ("ts" if user is not None else "id") + " DESC LIMIT ?"
+        with self.read_lock:
+            rows = self.reader.execute(query, (*args, limit)).fetchall()
+        keys = ("id", "ts", "kind", "lane", "track_id", "cls", "bottles", "cans", "points", "user", "detail")
+        return [dict(zip(keys, row)) for row in rows]
@@ -0,0 +1,166 @@
+import collections
+
+import cv2
+import numpy as np
+
+from track_store import TrackStateStore
+
+# direction: +1 khi vật đi từ bên trái sang bên phải của đoạn a->b (toạ độ ảnh,
+# với line ngang mặc định là từ trên xuống), -1 theo chiều ngược lại,
+# 0 khi track xuất hiện lần đầu ngay trên line (không biết hướng).
+CrossingEvent = collections.namedtuple("CrossingEvent", "track_id cls_id direction segment point")
+
+
+def to_segments(lines):
+    """
+    Chuẩn hoá cấu hình line đếm thành mảng đoạn thẳng (S, 4) [x1, y1, x2, y2].
+
+    Chấp nhận: một line [x1, y1, x2, y2], một polyline [[x, y], ...]
+    hoặc danh sách nhiều line/polyline.
+    """
+    arr = np.asarray(lines, dtype=np.float32) if not _is_ragged(lines) else None
+    if arr is not None:
+        if arr.ndim == 1 and arr.size == 4:
+            return arr.reshape(1, 4)
+        if arr.ndim == 2 and arr.shape[1] == 2:
+            return np.hstack([arr[:-1], arr[1:]])
+        if arr.ndim == 2 and arr.shape[1] == 4:
+            return arr
+    return np.vstack([to_segments(item) for item in lines])
+
+
+def _is_ragged(lines):
+    try:
+        np.asarray(lines, dtype=np.float32)
+        return False
+    except ValueError:
+        return True
+
+
+def _cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+class LineCounter:
+    """
+    Đếm vật phẩm cắt qua line bằng phép kiểm tra giao đoạn thẳng được vector hoá.
+
+    Với mỗi track, đoạn di chuyển từ tâm ở frame trước tới tâm ở frame hiện tại
+    được kiểm tra giao với mọi đoạn của line đếm cùng lúc, nên vật đi nhanh
+    "nhảy" qua line giữa hai frame vẫn được đếm. Mỗi track chỉ được đếm một lần.
+    """
+    def __init__(self, lines, band=10, direction=None, store=None):
+        """
+        Args:
+            lines: Line đếm (xem to_segments).
+            band (int): Track mới xuất hiện cách line không quá band pixel cũng được đếm.
+            direction (int): Chỉ đếm theo một hướng (+1 / -1), None = cả hai hướng.
+            store (TrackStateStore): Bảng trạng thái track (tâm frame trước, cờ đã đếm).
+        """
+        self.segments = to_segments(lines)
+        self.band = band
+        self.direction = direction
+        self.store = store if store is not None else TrackStateStore()
+
+    def bounds(self):
+        """Hình chữ nhật bao mọi đoạn của line đếm [x_min, y_min, x_max, y_max]."""
+        xs = self.segments[:, [0, 2]]
+        ys = self.segments[:, [1, 3]]
+        return [int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max())]
+
+    def _crossings(self, prev, curr):
+        """Ma trận (N, S) hướng cắt của đoạn prev->curr với từng đoạn line (0 = không cắt)."""
+        ax, ay = self.segments[:, 0], self.segments[:, 1]
+        dx, dy = self.segments[:, 2] - ax, self.segments[:, 3] - ay
+        px, py = prev[:, :1], prev[:, 1:]
+        qx, qy = curr[:, :1], curr[:, 1:]
+
+        side_prev = _cross(dx, dy, px - ax, py - ay)
+        side_curr = _cross(dx, dy, qx - ax, qy - ay)
+        mx, my = qx - px, qy - py
+        side_a = _cross(mx, my, ax - px, ay - py)
+        side_b = _cross(mx, my, ax + dx - px, ay + dy - py)
+
+        hit = ((side_prev < 0) != (side_curr < 0)) & (side_a * side_b <= 0)
+        return np.where(hit, np.where(side_curr >= 0, 1, -1), 0)
+
+    def _near_line(self, points):
+        """Khoảng cách nhỏ nhất (N,) và chỉ số đoạn gần nhất từ mỗi điểm tới line."""
+        ax, ay = self.segments[:, 0], self.segments[:, 1]
+        dx, dy = self.segments[:, 2] - ax, self.segments[:, 3] - ay
+        px, py = points[:, :1], points[:, 1:]
+        length = np.maximum(dx * dx + dy * dy, 1e-6)
+        t = np.clip(((px - ax) * dx + (py - ay) * dy) / length, 0.0, 1.0)
+        dist = np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+        return dist.min(axis=1), dist.argmin(axis=1)
+
+    def distance(self, points):
+        """Khoảng cách (N,) từ mỗi điểm (N, 2) tới đoạn line gần nhất."""
+        return self._near_line(np.asarray(points, dtype=np.float32).reshape(-1, 2))[0]
+
+    def update(self, track_ids, centers, cls_ids):
+        """
+        Cập nhật vị trí các track ở frame hiện tại. Cần gọi mỗi lần tracker chạy,
+        kể cả khi không có track nào, để đồng hồ TTL của store chạy đúng.
+
+        Args:
+            track_ids: Mảng (N,) id track; id lặp lại trong một frame chỉ lấy lần xuất hiện cuối.
+            centers: Mảng (N, 2) tâm box theo toạ độ frame.
+            cls_ids: Mảng (N,) class id.
+
+        Returns:
+            list[CrossingEvent]: Các lần cắt line mới (mỗi track tối đa một lần).
+        """
+        ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)
+        centers = np.asarray(centers, dtype=np.float32).reshape(-1, 2)
+        cls_ids = np.asarray(cls_ids).reshape(-1)
+        self.store.advance()
+        if ids.size == 0:
+            return []
+
+        # Một id xuất hiện nhiều lần trong cùng frame (tracker trả trùng, gộp nhiều nguồn):
+        # chỉ giữ box cuối cùng để mỗi track được kiểm tra / đếm một lần
+        _, last = np.unique(ids[::-1], return_index=True)
+        if last.size < ids.size:
+            keep = np.sort(ids.size - 1 - last)
+            ids, centers, cls_ids = ids[keep], centers[keep], cls_ids[keep]
+
+        idx, known = self.store.lookup(ids)
+
+        directions = np.zeros(ids.size, dtype=np.int8)
+        segments = np.zeros(ids.size, dtype=np.int64)
+        if known.any():
+            crossing = self._crossings(self.store.points[idx[known]], centers[known])
+            hit_segment = np.abs(crossing).argmax(axis=1)
+            directions[known] = crossing[np.arange(crossing.shape[0]), hit_segment]
+            segments[known] = hit_segment
+            self.store.update(idx[known], centers[known])
+
+        new = ~known
+        near = np.zeros(ids.size, dtype=bool)
+        if new.any():
+            dist, nearest = self._near_line(centers[new])
+            near[new] = dist <= self.band
+            segments[new] = nearest
+            self.store.insert(ids[new], centers[new])
+
+        hits = directions != 0
+        if self.direction is not None:
+            hits &= directions == self.direction
+        hits |= near
+
+        hits = np.flatnonzero(hits)
+        if hits.size == 0:
+            return []
+        hits = hits[~self.store.is_counted(ids[hits])]
+        self.store.mark_counted(ids[hits])
+
+        return [
+            CrossingEvent(int(ids[i]), int(cls_ids[i]), int(directions[i]), int(segments[i]),
+                          (float(centers[i, 0]), float(centers[i, 1])))
+            for i in hits
+        ]
+
+    def draw(self, frame, color=(0, 255, 255), thickness=3):
+        for x1, y1, x2, y2 in self.segments.astype(int):
+            cv2.line(frame, (x1, y1), (x2, y2), color, thickness)
@@ -0,0 +1,174 @@
+import bisect
+import collections
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+# ===============================================================
+# ĐO THỜI GIAN TỪNG BƯỚC (histogram) + ENDPOINT KIỂU PROMETHEUS
+# ===============================================================
+
+# Biên bucket (giây), giống cách chia mặc định của Prometheus nhưng dày hơn ở vùng ms
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """
+    Histogram bucket cố định cho một bước. record() chỉ là bisect + cộng số
+    nên gọi được trên mọi frame; thêm một ring nhỏ các giá trị gần nhất để
+    overlay hiển thị p50/p95 của vài giây vừa qua thay vì từ lúc khởi động.
+    """
+    def __init__(self, buckets=BUCKETS, recent=120):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Phần tử cuối: +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=recent)
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def recent_quantile(self, q):
+        values = sorted(self.recent)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class StageMetrics:
+    """
+    Tập histogram theo tên bước (capture, resize, infer, track, ...).
+
+    Cùng giao diện record(stage, seconds) với stage_timer của YOLOProcessor,
+    dùng chung được cho luồng YOLO và luồng giao diện.
+    """
+    def __init__(self, buckets=BUCKETS, recent=120):
+        self.buckets = buckets
+        self.recent = recent
+        self.histograms = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets, self.recent)
+            histogram.record(seconds)
+
+    def span(self, stage):
+        """Đo một đoạn code: with metrics.span("resize"): ..."""
+        return _Span(self, stage)
+
+    def summary(self):
+        """{stage: (p50_ms, p95_ms, count)} trên cửa sổ gần nhất."""
+        with self.lock:
+            return {
+                stage: (h.recent_quantile(0.5) * 1000.0, h.recent_quantile(0.95) * 1000.0, h.count)
+                for stage, h in self.histograms.items()
+            }
+
+    def overlay_lines(self):
+        """Các dòng chữ cho overlay debug trên màn hình."""
+        return [f"{stage:<8} p50 {p50:6.1f}  p95 {p95:6.1f} ms" for stage, (p50, p95, _) in self.summary().items()]
+
+    def prometheus_text(self, gauges=None, prefix="rvm"):
+        """Xuất toàn bộ histogram (và các gauge truyền vào) theo định dạng text của Prometheus."""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Thời gian từng bước của pipeline",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, h in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {h.sum:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+        for name, value in (gauges or {}).items():
+            if value is None:
+                continue
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+
+def draw_overlay(frame, lines, origin=(10, 90), color=(255, 255, 0)):
+    """Vẽ các dòng số liệu lên frame (tại chỗ), nền tối để dễ đọc."""
+    if not lines:
+        return frame
+    x, y = origin
+    height = 18 * len(lines) + 8
+    cv2.rectangle(frame, (x - 4, y - 16), (x + 290, y - 16 + height), (0, 0, 0), -1)
+    for i, text in enumerate(lines):
+        cv2.putText(frame, text, (x, y + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1, cv2.LINE_AA)
+    return frame
+
+
+class _Span:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class MetricsServer(threading.Thread):
+    """
+    HTTP endpoint nhỏ trả về /metrics dạng text Prometheus.
+
+    Mặc định chỉ nghe trên 127.0.0.1; muốn xem từ xa thì đặt host="0.0.0.0"
+    hoặc đi qua SSH tunnel tới máy tại chỗ.
+    """
+    def __init__(self, metrics, gauges=None, host="127.0.0.1", port=9108):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.gauges = gauges  # Hàm trả về dict {tên: giá trị} tại thời điểm được hỏi
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = server.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Không in log mỗi lần bị scrape
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+
+    def render(self):
+        try:
+            gauges = self.gauges() if self.gauges else None
+        except Exception as e:
+            print(f"⚠️ Lỗi lấy số liệu gauge: {e}")
+            gauges = None
+        return self.metrics.prometheus_text(gauges)
+
+    def run(self):
+        self.httpd.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
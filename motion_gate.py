@@ -0,0 +1,76 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Bộ lọc chuyển động đặt trước YOLO: chỉ "đánh thức" model khi vùng quanh
+    line đếm có vật di chuyển.
+
+    Vùng kiểm tra được cắt quanh line, thu nhỏ và chuyển xám, rồi so với nền
+    (trung bình trượt) bằng frame differencing. Khi có chuyển động, cổng mở và
+    giữ mở thêm hold_time giây để tracker không bị đứt giữa lúc vật đi qua.
+    """
+    def __init__(self, line, frame_size=(640, 480), band=60, scale=0.25,
+                 threshold=25, min_area=0.01, hold_time=1.5, learning_rate=0.05):
+        """
+        Args:
+            line (list): Line đếm [x1, y1, x2, y2] theo toạ độ frame.
+            frame_size (tuple): Kích thước frame (width, height).
+            band (int): Số pixel mở rộng quanh line để kiểm tra chuyển động.
+            scale (float): Hệ số thu nhỏ vùng kiểm tra.
+            threshold (int): Ngưỡng chênh lệch mức xám coi là pixel thay đổi.
+            min_area (float): Tỉ lệ pixel thay đổi tối thiểu để coi là có chuyển động.
+            hold_time (float): Số giây giữ cổng mở sau chuyển động cuối cùng.
+            learning_rate (float): Tốc độ cập nhật nền.
+        """
+        width, height = frame_size
+        x1, y1, x2, y2 = line
+        self.x0 = max(0, min(x1, x2) - band)
+        self.x1 = min(width, max(x1, x2) + band)
+        self.y0 = max(0, min(y1, y2) - band)
+        self.y1 = min(height, max(y1, y2) + band)
+
+        self.scale = scale
+        self.threshold = threshold
+        self.min_area = min_area
+        self.hold_time = hold_time
+        self.learning_rate = learning_rate
+
+        self.background = None
+        self.last_motion = None
+
+        # --- Bộ đếm ---
+        self.frames_checked = 0
+        self.frames_skipped = 0
+
+    def _prepare(self, frame):
+        zone = frame[self.y0:self.y1, self.x0:self.x1]
+        gray = cv2.cvtColor(zone, cv2.COLOR_BGR2GRAY)
+        gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def update(self, frame, now=None):
+        """
+        Cập nhật nền với frame mới và trả về True nếu nên chạy YOLO cho frame này.
+        """
+        now = time.monotonic() if now is None else now
+        gray = self._prepare(frame)
+        self.frames_checked += 1
+
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+            self.last_motion = now
+        else:
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+            changed = np.count_nonzero(diff > self.threshold)
+            if changed >= self.min_area * diff.size:
+                self.last_motion = now
+            cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+
+        is_open = now - self.last_motion <= self.hold_time
+        if not is_open:
+            self.frames_skipped += 1
+        return is_open
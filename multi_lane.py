@@ -0,0 +1,323 @@
+import queue
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from backend_count import CLASS_NAMES, publish_count, subscribe_counts
+from centroid_tracker import create_tracker
+from event_bus import EventBus, FrameEvent
+from annotator import Annotator
+from frame_grabber import FrameGrabber
+from inference_backend import select_backend
+from line_counter import LineCounter
+from metrics import MetricsServer, StageMetrics
+from motion_gate import MotionGate
+from roi import RegionOfInterest
+from toUart import ESP32_UART
+from track_store import TrackStateStore
+
+# ===============================================================
+# NHIỀU MÁNG (LANE) TRÊN MỘT MÁY: NẠP MODEL MỘT LẦN, SUY LUẬN THEO LÔ
+# ===============================================================
+
+
+class Lane:
+    """
+    Một máng nạp vật: nguồn camera, tracker, line đếm, motion gate và cổng UART riêng.
+
+    Không tự chạy model; MultiLaneProcessor gom frame của mọi lane thành một lô,
+    suy luận một lần rồi trả Results về từng lane qua update().
+    bus (EventBus, có thể dùng chung cho mọi lane): sự kiện mang tên lane trong trường lane.
+    Đếm, UART và on_event(lane, event) đi qua kênh counts như YOLOProcessor.
+    """
+    def __init__(self, name, source, line=(10, 190, 630, 190), roi_points=None,
+                 tracker=r'tracking/bytetrack.yaml', motion_gate=True, motion_hold_time=1.5,
+                 uart_port=None, uart_protocol="v1", output_queue=None, display_size=None,
+                 display_rgb=False, on_event=None, frame_buffer_size=1, bus=None, capture_options=None,
+                 display_fps=15):
+        self.name = name
+        self.source = source
+        self.output_queue = output_queue
+        self.bus = bus if bus is not None else EventBus()
+        self.count_seq = 0
+        self.display_size = display_size
+        self.display_rgb = display_rgb
+        self.annotator = Annotator(CLASS_NAMES, max_fps=display_fps)
+        self.frame_buffer_size = frame_buffer_size
+        self.capture_options = capture_options or {}
+
+        self.bottle_count = 0
+        self.can_count = 0
+        self.grabber = None
+        self.frames_processed = 0
+        self.fps = 0.0
+        self.last_frame_time = None
+
+        self.line = line
+        self.tracker_config = tracker
+        self.tracker = create_tracker(tracker)
+        self.counter = LineCounter(line, store=TrackStateStore(tracker_config=tracker))
+
+        self.roi = RegionOfInterest(roi_points) if roi_points else None
+        self.imgsz = self.roi.imgsz if self.roi else 640
+        if self.roi and not self.roi.contains_line(self.counter.bounds()):
+            print(f"⚠️ [{name}] Line đếm nằm ngoài ROI, vật phẩm có thể không được đếm.")
+
+        self.motion_gate = MotionGate(self.counter.bounds(), hold_time=motion_hold_time) if motion_gate else None
+        self.send_uart = ESP32_UART(port=uart_port, baudrate=9600, protocol=uart_protocol) if uart_port else None
+        subscribe_counts(self.bus, self.send_uart, (lambda event: on_event(self, event)) if on_event else None, lane=name)
+
+    def open(self):
+        """Mở nguồn video của lane. Trả về False nếu lỗi."""
+        self.grabber = FrameGrabber(self.source, size=(640, 480), buffer_size=self.frame_buffer_size,
+                                    **self.capture_options)
+        self.grabber.start()
+        self.grabber.opened.wait()
+        if self.grabber.error:
+            print(f"⚠️ [{self.name}] Lỗi mở video: {self.grabber.error}")
+            return False
+        return True
+
+    @property
+    def finished(self):
+        grabber = self.grabber
+        return grabber is None or (grabber.finished and not grabber.frames)
+
+    def frame_stats(self):
+        grabber = self.grabber
+        return {
+            "captured": grabber.captured if grabber else 0,
+            "processed": self.frames_processed,
+            "dropped": grabber.dropped if grabber else 0,
+            "duplicated": grabber.duplicated if grabber else 0,
+            "missed": grabber.missed if grabber else 0,
+            "skipped": self.motion_gate.frames_skipped if self.motion_gate else 0,
+            "tracks": len(self.counter.store),
+        }
+
+    def wants_inference(self, frame):
+        """Motion gate của lane: False thì frame này không cần đưa vào lô suy luận."""
+        self.frames_processed += 1
+        now = time.perf_counter()
+        if self.last_frame_time is not None and now > self.last_frame_time:
+            instant = 1.0 / (now - self.last_frame_time)
+            self.fps = instant if self.fps == 0.0 else 0.9 * self.fps + 0.1 * instant
+        self.last_frame_time = now
+        return self.motion_gate is None or self.motion_gate.update(frame)
+
+    def model_input(self, frame):
+        return self.roi.crop(frame) if self.roi else frame
+
+    def update(self, frame, result):
+        """
+        Cập nhật tracker + line đếm của lane bằng kết quả suy luận (None = cổng đóng).
+
+        Returns:
+            tuple: (frame, đã vẽ nếu có nơi nhận và tới lượt theo display_fps; danh sách CrossingEvent mới).
+        """
+        events = []
+        tracks = np.empty((0, 8), dtype=np.float32)
+        if result is not None:
+            # Cột: [x1, y1, x2, y2, id, conf, cls, idx] theo toạ độ ảnh đưa vào model
+            tracks = self.tracker.update(result.boxes.cpu().numpy(), result.orig_img)
+            tracks = np.asarray(tracks, dtype=np.float32).reshape(-1, 8)
+            if self.roi and len(tracks):
+                # Toạ độ theo ROI -> toạ độ frame
+                tracks = self.roi.tracks_to_frame(tracks)
+            centers = (tracks[:, 0:2] + tracks[:, 2:4]) * 0.5
+            events = self.counter.update(tracks[:, 4].astype(np.int64), centers, tracks[:, 6].astype(np.int64))
+            for event in events:
+                publish_count(self, event, lane=self.name)
+
+        if self.render and self.annotator.due():
+            frame = self.draw(frame, tracks, events)
+            self.publish(frame)
+        return frame, events
+
+    @property
+    def render(self):
+        return self.output_queue is not None or self.bus.frames.active
+
+    def draw(self, frame, tracks, events):
+        return self.annotator.draw(
+            frame, tracks[:, :7], counter=self.counter, roi=self.roi,
+            counts=[(f"{self.name} bottle", self.bottle_count, (255, 0, 0)),
+                    (f"{self.name} can", self.can_count, (0, 255, 0))],
+            highlight=bool(events),
+        )
+
+    def publish(self, frame):
+        if self.display_size and (frame.shape[1], frame.shape[0]) != tuple(self.display_size):
+            frame = cv2.resize(frame, self.display_size, interpolation=cv2.INTER_AREA)
+        if self.display_rgb:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame = self.grabber.detach(frame)
+        if self.bus.frames.active:
+            self.bus.publish(FrameEvent(frame, self.bottle_count, self.can_count, time.perf_counter(), self.name))
+        if self.output_queue is not None:
+            try:
+                self.output_queue.put_nowait((frame, self.bottle_count, self.can_count))
+            except queue.Full:
+                pass
+
+    def close(self):
+        if self.grabber:
+            self.grabber.stop()
+        if self.send_uart:
+            self.send_uart.close()
+
+
+class MultiLaneProcessor(threading.Thread):
+    """
+    Một luồng suy luận cho nhiều lane.
+
+    Mỗi vòng lặp lấy frame mới nhất của từng lane, bỏ qua lane có motion gate
+    đóng, chạy model.predict một lần cho cả lô rồi chuyển từng Results về
+    tracker / line đếm / UART của đúng lane. Model chỉ nạp một lần nên N lane
+    tốn ít hơn nhiều so với N tiến trình YOLOProcessor.
+    """
+    def __init__(self, lanes, model_path, backend="auto", conf=0.25, metrics_port=None, metrics_host="127.0.0.1"):
+        super().__init__(daemon=True)
+        names = [lane.name for lane in lanes]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Tên lane bị trùng: {names}")
+        self.lanes = list(lanes)
+        self.model_path = model_path
+        self.backend_preference = backend
+        self.backend = None
+        self.conf = conf
+        # Cả lô dùng chung một imgsz (Ultralytics letterbox từng ảnh về cùng kích thước)
+        self.imgsz = max(lane.imgsz for lane in self.lanes)
+        self.running = True
+        self.ready = threading.Event()
+        # Lý do không khởi động được (lỗi nạp model / mở nguồn của một lane), None = chạy bình thường
+        self.error = None
+
+        self.batches = 0
+        self.batched_frames = 0
+
+        self.metrics = StageMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.metrics_server = None
+
+    @property
+    def bottle_count(self):
+        return sum(lane.bottle_count for lane in self.lanes)
+
+    @property
+    def can_count(self):
+        return sum(lane.can_count for lane in self.lanes)
+
+    def lane(self, name):
+        return next(lane for lane in self.lanes if lane.name == name)
+
+    def metrics_gauges(self):
+        gauges = {
+            "lanes": len(self.lanes),
+            "batches": self.batches,
+            "batch_size_avg": self.batched_frames / self.batches if self.batches else 0.0,
+        }
+        for lane in self.lanes:
+            key = re.sub(r"\W", "_", str(lane.name))
+            gauges[f"lane_{key}_fps"] = lane.fps
+            gauges[f"lane_{key}_bottle_count"] = lane.bottle_count
+            gauges[f"lane_{key}_can_count"] = lane.can_count
+            gauges.update({f"lane_{key}_frames_{k}": v for k, v in lane.frame_stats().items()})
+        return gauges
+
+    def setup(self):
+        """Nạp model một lần và mở nguồn của mọi lane. Trả về False nếu lỗi."""
+        try:
+            self.backend = select_backend(self.model_path, self.backend_preference, imgsz=self.imgsz)
+        except Exception as e:
+            self.error = f"Lỗi tải model: {e}"
+            print(f"⚠️ {self.error}")
+            return False
+        failed = [lane.name for lane in self.lanes if not lane.open()]
+        if failed:
+            self.error = f"Lỗi mở video của lane: {', '.join(failed)}"
+            return False
+        if self.metrics_port is not None:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, self.metrics_gauges,
+                                                    host=self.metrics_host, port=self.metrics_port)
+                self.metrics_server.start()
+            except OSError as e:
+                print(f"⚠️ Không mở được cổng metrics {self.metrics_port}: {e}")
+        self.ready.set()
+        return True
+
+    def gather(self, timeout=0.05):
+        """Frame mới nhất của từng lane còn chạy: list (lane, frame)."""
+        batch = []
+        for lane in self.lanes:
+            frame = lane.grabber.read(timeout=0)
+            if frame is not None:
+                batch.append((lane, frame))
+        if not batch:
+            # Chưa lane nào có frame: chờ lane đầu tiên còn hoạt động thay vì quay vòng rỗng
+            active = [lane for lane in self.lanes if not lane.finished]
+            if active:
+                frame = active[0].grabber.read(timeout=timeout)
+                if frame is not None:
+                    batch.append((active[0], frame))
+        return batch
+
+    def process_batch(self, batch):
+        """Suy luận một lô và cập nhật từng lane. Trả về {tên lane: [CrossingEvent]}."""
+        start = time.perf_counter()
+        gated = [(lane, frame) for lane, frame in batch if lane.wants_inference(frame)]
+        mark = time.perf_counter()
+        self.metrics.record("gate", mark - start)
+
+        results = {}
+        if gated:
+            predictions = self.backend.predict([lane.model_input(frame) for lane, frame in gated],
+                                               imgsz=self.imgsz, conf=self.conf)
+            results = {lane.name: result for (lane, _), result in zip(gated, predictions)}
+            self.batches += 1
+            self.batched_frames += len(gated)
+            now = time.perf_counter()
+            self.metrics.record("infer", now - mark)
+            mark = now
+
+        events = {}
+        for lane, frame in batch:
+            _, events[lane.name] = lane.update(frame, results.get(lane.name))
+        self.metrics.record("lanes", time.perf_counter() - mark)
+        return events
+
+    def run(self):
+        if not self.setup():
+            for lane in self.lanes:
+                lane.close()
+            return
+
+        while self.running:
+            batch = self.gather()
+            if not batch:
+                if all(lane.finished for lane in self.lanes):
+                    break
+                continue
+            self.process_batch(batch)
+
+        if self.metrics_server:
+            self.metrics_server.stop()
+        for lane in self.lanes:
+            lane.close()
+        avg = self.batched_frames / self.batches if self.batches else 0.0
+        print(f"Luồng đa lane đã dừng. {self.batches} lô, trung bình {avg:.2f} frame/lô.")
+        for lane in self.lanes:
+            stats = lane.frame_stats()
+            print(f"   - {lane.name}: chai {lane.bottle_count}, lon {lane.can_count}, "
+                  f"xử lý {stats['processed']}, bỏ {stats['dropped']}, bỏ qua YOLO {stats['skipped']}")
+
+    def stop(self):
+        self.running = False
+        for lane in self.lanes:
+            if lane.grabber:
+                lane.grabber.stop()
@@ -0,0 +1,431 @@
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+# ===============================================================
+# HÀNG ĐỢI IN PHIẾU CHẠY NỀN (không chặn luồng giao diện)
+# ===============================================================
+#
+# UI gọi PrintSpooler.submit() và nhận ngay một PrintJob; luồng spooler in
+# lần lượt từng phiếu với timeout và thử lại. Mỗi phiếu chưa in xong được
+# lưu thành một file JSON trong spool_dir nên mất điện / tắt máy giữa chừng
+# thì lần khởi động sau vẫn in tiếp. Phiếu in lỗi hẳn được đổi tên *.failed.json.
+#
+# Máy in treo quá timeout thì KHÔNG gửi lại: lệnh in cũ có thể vẫn đang chạy và
+# ra giấy sau đó. Phiếu chuyển sang UNKNOWN (file *.unknown.json), spooler chờ
+# lệnh cũ kết thúc rồi mới gửi phiếu tiếp theo, nên mỗi lúc chỉ có một lệnh gửi
+# tới máy in; lệnh cũ xong thì phiếu thành DONE hoặc FAILED theo kết quả.
+#
+# Backend chọn bằng chuỗi cấu hình (create_backend), lấy từ tham số, biến môi
+# trường RVM_PRINTER hoặc máy in mặc định của Windows (default_backend_spec):
+#   "win32"                      máy in mặc định của Windows (pywin32)
+#   "win32:<tên máy in>"
+#   "usb:0x1fc9:0x2016"          ESC/POS qua USB (python-escpos), VID:PID của Xprinter
+#   "network:192.168.1.50:9100"  ESC/POS qua mạng
+#   "file:/dev/usb/lp0"          ESC/POS ghi thẳng vào file thiết bị
+#   "dummy:receipts.txt"         ghi ra file / pty để thử, không cần máy in
+# Không có máy in nào được cấu hình thì phiếu báo lỗi ngay (không giả là đã in).
+
+PRINTER_ENV = "RVM_PRINTER"
+ESC_POS_CUT = b"\x1dV\x00"  # GS V 0: cắt giấy
+
+
+def build_receipt_text(user_name, bottles, cans, points, now=None, balance=None):
+    """
+    Nội dung phiếu tích điểm (không dấu để máy in nhiệt nào cũng in được).
+    balance: số dư tài khoản khách hàng (accounts.py); None với khách vãng lai.
+    """
+    now = now or datetime.datetime.now()
+    account = ""
+    if balance is not None:
+        account = (
+            f"Diem phien nay:   {points:g}\n"
+            f"So du tai khoan:  {balance:g}\n"
+            "--------------------------------\n"
+        )
+    return (
+        "   PHIEU TICH DIEM TAI CHE\n"
+        "--------------------------------\n"
+        f"Khach hang: {user_name}\n"
+        f"Ngay: {now.strftime('%d/%m/%Y')}\n"
+        f"Gio: {now.strftime('%H:%M:%S')}\n"
+        "--------------------------------\n"
+        "So luong vat pham:\n"
+        f"- Chai nhua:      {bottles}\n"
+        f"- Lon kim loai:   {cans}\n"
+        "--------------------------------\n"
+        # f"TONG DIEM TICH LUY: {points}\n\n"
+        f"{account}"
+        "Cam on ban da chung tay bao ve\n"
+        "         moi truong!\n\n\n."
+    )
+
+
+# --- Backend ---
+
+class Win32Backend:
+    """In RAW qua spooler của Windows (pywin32), như ReceiptPrinter trước đây."""
+    name = "win32"
+
+    def __init__(self, printer_name=None):
+        import win32print
+        self.win32print = win32print
+        self.printer_name = printer_name
+
+    def send(self, text):
+        win32print = self.win32print
+        h_printer = win32print.OpenPrinter(self.printer_name or win32print.GetDefaultPrinter())
+        try:
+            win32print.StartDocPrinter(h_printer, 1, ("Phieu Tich Diem", None, "RAW"))
+            try:
+                win32print.StartPagePrinter(h_printer)
+                win32print.WritePrinter(h_printer, text.encode('utf-8'))
+                win32print.EndPagePrinter(h_printer)
+            finally:
+                win32print.EndDocPrinter(h_printer)
+        finally:
+            win32print.ClosePrinter(h_printer)
+
+
+class EscposBackend:
+    """
+    Máy in nhiệt ESC/POS qua python-escpos (xem xprinter/check_xprinter.py).
+    kind: 'usb' (vendor_id, product_id), 'network' (host, port) hoặc 'file' (devfile).
+    Mỗi phiếu mở kết nối mới để rút/cắm lại máy in không làm hỏng spooler.
+    """
+    def __init__(self, kind, **kwargs):
+        from escpos import printer
+        factories = {"usb": printer.Usb, "network": printer.Network, "file": printer.File}
+        if kind not in factories:
+            raise ValueError(f"Kiểu máy in ESC/POS không hỗ trợ: {kind}")
+        self.name = f"escpos-{kind}"
+        self.factory = factories[kind]
+        self.kwargs = kwargs
+
+    def send(self, text):
+        device = self.factory(**self.kwargs)
+        try:
+            device.text(text + "\n")
+            device.cut()
+        finally:
+            device.close()
+
+
+class DummyBackend:
+    """Ghi phiếu (kèm lệnh cắt giấy ESC/POS) vào file thường hoặc pty, dùng để thử."""
+    name = "dummy"
+
+    def __init__(self, path="spool/receipts.txt"):
+        self.path = path
+        print(f"⚠️ Máy in thử (dummy): phiếu chỉ được ghi vào '{path}', KHÔNG in ra giấy.")
+
+    def send(self, text):
+        directory = os.path.dirname(self.path)
+        if directory and not self.path.startswith("/dev/"):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "ab", buffering=0) as f:
+            f.write(text.encode("utf-8") + b"\n" + ESC_POS_CUT)
+
+
+class PrinterNotConfigured(RuntimeError):
+    """Không có máy in thật nào được cấu hình; in lại cũng vô ích."""
+
+
+class NoPrinterBackend:
+    """Dùng khi chưa cấu hình máy in: mọi phiếu lỗi ngay để UI và sổ giao dịch không ghi nhận là đã in."""
+    name = "none"
+
+    def send(self, text):
+        raise PrinterNotConfigured(
+            f"Chưa cấu hình máy in (đặt biến môi trường {PRINTER_ENV}, vd. usb:0x1fc9:0x2016, "
+            "hoặc cài pywin32 trên Windows)")
+
+
+def win32_available():
+    """True nếu in được qua spooler của Windows (có pywin32)."""
+    try:
+        import win32print  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def create_backend(spec):
+    """Tạo backend từ chuỗi cấu hình, xem đầu file."""
+    kind, _, arg = spec.partition(":")
+    if kind == "win32":
+        return Win32Backend(arg or None)
+    if kind == "usb":
+        vendor, _, product = arg.partition(":")
+        return EscposBackend("usb", idVendor=int(vendor, 16), idProduct=int(product, 16))
+    if kind == "network":
+        host, _, port = arg.rpartition(":") if ":" in arg else (arg, "", "9100")
+        return EscposBackend("network", host=host, port=int(port or 9100), timeout=10)
+    if kind == "file":
+        return EscposBackend("file", devfile=arg)
+    if kind == "dummy":
+        return DummyBackend(arg or "spool/receipts.txt")
+    raise ValueError(f"Cấu hình máy in không hợp lệ: {spec}")
+
+
+def default_backend_spec():
+    """
+    Cấu hình máy in mặc định: biến môi trường RVM_PRINTER, không có thì máy in
+    mặc định của Windows (pywin32). Trả về None nếu không có máy in nào.
+    """
+    spec = os.environ.get(PRINTER_ENV, "").strip()
+    if spec:
+        return spec
+    if win32_available():
+        return "win32"
+    return None
+
+
+def default_backend():
+    """Backend theo default_backend_spec(); không có máy in thì cảnh báo và trả về NoPrinterBackend."""
+    spec = default_backend_spec()
+    if spec is None:
+        print("=" * 60)
+        print("⚠️ CHƯA CẤU HÌNH MÁY IN: phiếu tích điểm sẽ báo lỗi, KHÔNG được in.")
+        print(f"   Đặt biến môi trường {PRINTER_ENV} (vd. usb:0x1fc9:0x2016, network:192.168.1.50:9100,")
+        print("   dummy:spool/receipts.txt để thử) hoặc cài pywin32 trên Windows.")
+        print("=" * 60)
+        return NoPrinterBackend()
+    return create_backend(spec)
+
+
+# --- Hàng đợi ---
+
+class PrintJob:
+    """
+    Handle của một phiếu in; UI giữ lại để hỏi trạng thái hoặc chờ kết quả.
+    UNKNOWN: máy in quá timeout, chưa rõ đã in hay chưa (chưa done, không in lại).
+    """
+    QUEUED, PRINTING, UNKNOWN, DONE, FAILED = "queued", "printing", "unknown", "done", "failed"
+
+    def __init__(self, job_id, user_name, text, created=None, attempts=0, totals=None):
+        self.job_id = job_id
+        self.user_name = user_name
+        self.text = text
+        self.totals = totals or {}  # Số chai/lon/điểm in trên phiếu (để ghi sổ giao dịch)
+        self.created = created or time.time()
+        self.attempts = attempts
+        self.status = self.QUEUED
+        self.error = None
+        self.finished = threading.Event()
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """Chờ phiếu in xong hoặc lỗi hẳn; trả về True nếu in thành công."""
+        self.finished.wait(timeout)
+        return self.status == self.DONE
+
+    def to_dict(self):
+        return {"id": self.job_id, "user_name": self.user_name, "text": self.text,
+                "created": self.created, "attempts": self.attempts, "totals": self.totals}
+
+    def __repr__(self):
+        return f"PrintJob({self.job_id}, {self.status}, lần thử {self.attempts})"
+
+
+class PrintSpooler(threading.Thread):
+    """
+    Luồng in nền: hàng đợi lưu trên đĩa, mỗi lần in có timeout, lỗi thì thử lại
+    sau retry_delay * 2^n giây, quá max_retries thì đánh dấu FAILED. Quá timeout
+    thì đánh dấu UNKNOWN và chờ lệnh in đó kết thúc, không gửi lại.
+    on_update(job) được gọi (từ luồng spooler) mỗi khi trạng thái phiếu thay đổi.
+    """
+    def __init__(self, backend=None, spool_dir=r"spool", max_retries=3, timeout=15.0,
+                 retry_delay=2.0, on_update=None):
+        super().__init__(daemon=True)
+        self.backend = backend if backend is not None else default_backend()
+        self.spool_dir = spool_dir
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.on_update = on_update
+
+        self.jobs = []
+        self.condition = threading.Condition()
+        self.running = True
+
+        # Lệnh in quá timeout nhưng chưa kết thúc: (job, thread, outcome)
+        self.inflight = None
+        self.backend_lock = threading.Lock()
+
+        # --- Bộ đếm ---
+        self.printed = 0
+        self.failed = 0
+
+        os.makedirs(spool_dir, exist_ok=True)
+        self._restore()
+        self.start()
+
+    def submit(self, user_name, bottles, cans, points, balance=None, user=None):
+        """
+        Đưa phiếu vào hàng đợi, trả về PrintJob ngay lập tức.
+        balance/user: số dư và id khách hàng khi đang có phiên đăng nhập.
+        """
+        job_id = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        job = PrintJob(job_id, user_name, build_receipt_text(user_name, bottles, cans, points, balance=balance),
+                       totals={"bottles": bottles, "cans": cans, "points": points, "user": user})
+        self._save(job)
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify()
+        return job
+
+    def pending(self):
+        with self.condition:
+            return len(self.jobs)
+
+    def _path(self, job, suffix=".json"):
+        return os.path.join(self.spool_dir, job.job_id + suffix)
+
+    def _save(self, job):
+        tmp = self._path(job, ".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, self._path(job))
+
+    def _restore(self):
+        """Nạp lại các phiếu chưa in được từ lần chạy trước."""
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".json") or name.endswith((".failed.json", ".unknown.json")):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name), encoding="utf-8") as f:
+                    data = json.load(f)
+                self.jobs.append(PrintJob(data["id"], data["user_name"], data["text"],
+                                          data.get("created"), data.get("attempts", 0), data.get("totals")))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Bỏ qua phiếu lỗi trong hàng đợi in {name}: {e}")
+        if self.jobs:
+            print(f"🖨️ Còn {len(self.jobs)} phiếu chưa in từ lần chạy trước, sẽ in tiếp.")
+
+    def _notify(self, job):
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                print(f"⚠️ Lỗi callback hàng đợi in: {e}")
+
+    def _send_with_timeout(self, job):
+        """
+        Gọi backend.send trong luồng phụ để máy in treo không giữ spooler quá timeout.
+        Quá timeout thì giữ luồng đó trong self.inflight (để chờ, không gửi lại) và ném TimeoutError.
+        """
+        outcome = {}
+
+        def work():
+            with self.backend_lock:
+                try:
+                    self.backend.send(job.text)
+                except Exception as e:
+                    outcome["error"] = e
+
+        worker = threading.Thread(target=work, daemon=True)
+        worker.start()
+        worker.join(self.timeout)
+        if worker.is_alive():
+            self.inflight = (job, worker, outcome)
+            raise TimeoutError(f"Máy in không phản hồi sau {self.timeout:g} giây")
+        if "error" in outcome:
+            raise outcome["error"]
+
+    def _finish(self, job, error=None, path=None):
+        """Kết thúc phiếu: DONE nếu error là None, ngược lại FAILED (giữ file *.failed.json)."""
+        path = path or self._path(job)
+        if error is None:
+            job.status = PrintJob.DONE
+            job.error = None
+            self.printed += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            print(f"✅ Đã in phiếu của '{job.user_name}' ({self.backend.name}).")
+        else:
+            job.status = PrintJob.FAILED
+            job.error = str(error)
+            self.failed += 1
+            try:
+                os.replace(path, self._path(job, ".failed.json"))
+            except FileNotFoundError:
+                pass
+            print(f"⚠️ In phiếu {job.job_id} thất bại sau {job.attempts} lần: {error}")
+        job.finished.set()
+        self._notify(job)
+
+    def _retry_or_fail(self, job, error):
+        """Lỗi khi in: xếp lại hàng đợi sau retry_delay * 2^n giây, quá max_retries thì FAILED."""
+        job.error = str(error)
+        if job.attempts <= self.max_retries and not isinstance(error, PrinterNotConfigured):
+            job.status = PrintJob.QUEUED
+            self._save(job)
+            self._notify(job)
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            print(f"⚠️ In phiếu {job.job_id} lỗi ({error}), thử lại sau {delay:g} giây.")
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running, delay)
+            return
+        with self.condition:
+            self.jobs.pop(0)
+        self._finish(job, error)
+
+    def _wait_inflight(self):
+        """Chờ lệnh in bị quá timeout kết thúc rồi mới gửi phiếu khác. False nếu spooler bị dừng trước."""
+        job, worker, outcome = self.inflight
+        while worker.is_alive():
+            with self.condition:
+                if not self.running:
+                    return False
+            worker.join(1.0)
+        self.inflight = None
+        self._finish(job, outcome.get("error"), self._path(job, ".unknown.json"))
+        return True
+
+    def run(self):
+        while True:
+            if self.inflight is not None and not self._wait_inflight():
+                return
+            with self.condition:
+                self.condition.wait_for(lambda: self.jobs or not self.running)
+                if not self.running:
+                    return
+                job = self.jobs[0]
+
+            job.status = PrintJob.PRINTING
+            job.attempts += 1
+            self._notify(job)
+            try:
+                self._send_with_timeout(job)
+            except Exception as e:
+                if self.inflight is None:
+                    self._retry_or_fail(job, e)
+                    continue
+                # Lệnh in có thể vẫn đang chạy và ra giấy sau: không gửi lại để tránh in hai phiếu
+                job.status = PrintJob.UNKNOWN
+                job.error = f"{e}; chưa rõ phiếu đã in hay chưa, không in lại"
+                os.replace(self._path(job), self._path(job, ".unknown.json"))
+                print(f"⚠️ In phiếu {job.job_id}: {job.error}. Chờ máy in xong mới in phiếu tiếp theo.")
+                with self.condition:
+                    self.jobs.pop(0)
+                self._notify(job)
+            else:
+                with self.condition:
+                    self.jobs.pop(0)
+                self._finish(job)
+
+    def close(self, timeout=None):
+        """Dừng luồng in; phiếu còn trong hàng đợi vẫn nằm trong spool_dir cho lần chạy sau."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.join(timeout)
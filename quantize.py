@@ -0,0 +1,368 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from inference_backend import export_cached, load_backend, quantized_path
+
+# ===============================================================
+# LƯỢNG TỬ HOÁ INT8 (ONNX Runtime) + BÁO CÁO ĐỘ CHÍNH XÁC / TỐC ĐỘ
+# ===============================================================
+#
+# 1. Export model/best.pt sang ONNX FP32 (dùng lại bản cache của inference_backend).
+# 2. Lấy đều các frame từ video ghi sẵn trong data/, xử lý giống pipeline thật
+#    (resize 640x480 -> cắt ROI nếu có -> letterbox imgsz), làm dữ liệu hiệu chuẩn.
+# 3. quantize_static (QDQ, trọng số INT8 theo kênh, activation UINT8). Phần giải
+#    mã box cuối Detect head (DFL, Concat, phép cộng/nhân toạ độ) giữ FP32 vì
+#    lượng tử hoá ở đây làm lệch toạ độ box nhiều nhất.
+# 4. So FP32 với INT8 trên cùng ONNX Runtime CPU: độ trễ, mAP50 từng lớp (so
+#    với nhãn thật nếu có --data, luôn kèm mức khớp với dự đoán FP32 trên frame
+#    không dùng để hiệu chuẩn) và số chai/lon khi phát lại video qua pipeline đếm.
+#
+# YOLOProcessor(precision="int8") / headless.py --precision int8 dùng bản
+# model/best_int8.onnx sinh ra ở đây.
+
+VIDEO_PATTERNS = ("*.mp4", "*.avi", "*.mkv", "*.mov")
+
+
+def find_videos(folder=r"data"):
+    return sorted(path for pattern in VIDEO_PATTERNS for path in glob.glob(os.path.join(folder, pattern)))
+
+
+def sample_frames(videos, count=200, frame_size=(640, 480), roi=None, offset=0.0):
+    """
+    Lấy đều khoảng count frame từ các video (chia đều theo số frame mỗi video).
+
+    offset (0..1) dịch vị trí lấy mẫu trong mỗi khoảng, dùng 0.5 để lấy bộ frame
+    đánh giá không trùng bộ frame hiệu chuẩn.
+    """
+    frames = []
+    per_video = max(1, count // max(1, len(videos)))
+    for path in videos:
+        cap = cv2.VideoCapture(path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total <= 0:
+            cap.release()
+            continue
+        step = total / per_video
+        wanted = {min(total - 1, int(step * (i + offset))) for i in range(per_video)}
+        index = 0
+        while wanted:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if index in wanted:
+                wanted.discard(index)
+                frame = cv2.resize(frame, frame_size)
+                frames.append(roi.crop(frame).copy() if roi else frame)
+            index += 1
+        cap.release()
+    return frames
+
+
+def letterbox(frame, imgsz=640):
+    """Ảnh BGR -> tensor (1, 3, imgsz, imgsz) float32 RGB 0..1, viền xám 114 như Ultralytics."""
+    height, width = frame.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def head_nodes(model):
+    """Node giải mã box của Detect head (module cuối): mọi node trừ Conv, và conv DFL."""
+    indices = [int(m.group(1)) for node in model.graph.node for m in [re.match(r"/model\.(\d+)/", node.name)] if m]
+    if not indices:
+        return []
+    prefix = f"/model.{max(indices)}/"
+    return [node.name for node in model.graph.node
+            if node.name.startswith(prefix) and (node.op_type != "Conv" or "/dfl/" in node.name)]
+
+
+def quantize_model(model_path, videos, output=None, imgsz=640, calib_frames=200, method="minmax",
+                   per_channel=True, keep_head_fp32=True, roi=None):
+    """
+    Tạo bản INT8 của model_path, hiệu chuẩn trên frame lấy từ videos.
+
+    Returns:
+        str: Đường dẫn model INT8 (.onnx).
+    """
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                          QuantType, quantize_static)
+
+    fp32_path = export_cached(model_path, "onnx", imgsz=imgsz)
+    output = output or quantized_path(model_path)
+
+    frames = sample_frames(videos, calib_frames, roi=roi)
+    if not frames:
+        raise RuntimeError("Không lấy được frame hiệu chuẩn nào từ video.")
+    print(f"⏳ Hiệu chuẩn trên {len(frames)} frame từ {len(videos)} video ({method})...")
+
+    model = onnx.load(fp32_path)
+    input_name = model.graph.input[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            return None if frame is None else {input_name: letterbox(frame, imgsz)}
+
+    # Chuẩn hoá đồ thị (gộp node, suy kích thước) trước khi lượng tử hoá nếu có thể
+    source = fp32_path
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        source = os.path.splitext(output)[0] + ".pre.onnx"
+        quant_pre_process(fp32_path, source, skip_symbolic_shape=True)
+    except Exception as e:
+        print(f"⚠️ Bỏ qua bước tiền xử lý ONNX: {e}")
+        source = fp32_path
+
+    methods = {"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy,
+               "percentile": CalibrationMethod.Percentile}
+    try:
+        quantize_static(
+            source, output, FrameReader(),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=per_channel,
+            calibrate_method=methods[method],
+            nodes_to_exclude=head_nodes(model) if keep_head_fp32 else [],
+        )
+    finally:
+        if source != fp32_path and os.path.exists(source):
+            os.remove(source)
+
+    # Ultralytics đọc names / stride / imgsz từ metadata của file ONNX
+    quantized = onnx.load(output)
+    existing = {prop.key for prop in quantized.metadata_props}
+    for prop in model.metadata_props:
+        if prop.key not in existing:
+            quantized.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized, output)
+
+    with open(os.path.splitext(output)[0] + ".quant.json", "w", encoding="utf-8") as f:
+        json.dump({"source": fp32_path, "videos": videos, "frames": len(frames), "imgsz": imgsz,
+                   "method": method, "per_channel": per_channel, "keep_head_fp32": keep_head_fp32,
+                   "created": time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False, indent=2)
+    print(f"✅ Model INT8: {output} ({os.path.getsize(output) / 1e6:.1f} MB, "
+          f"FP32 {os.path.getsize(fp32_path) / 1e6:.1f} MB)")
+    return output
+
+
+# ===============================================================
+# ĐÁNH GIÁ
+# ===============================================================
+
+def box_iou(a, b):
+    """IoU giữa các box (N, 4) và (M, 4) dạng x1, y1, x2, y2 -> (N, M)."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def average_precision(predictions, references, cls_id, iou_threshold=0.5):
+    """
+    AP (nội suy mọi điểm, kiểu VOC/COCO) của một lớp.
+
+    predictions / references: danh sách theo frame, mỗi phần tử là mảng (N, 6)
+    [x1, y1, x2, y2, conf, cls]. None nếu lớp không có box tham chiếu nào.
+    """
+    scores, hits, total = [], [], 0
+    for pred, ref in zip(predictions, references):
+        pred = pred[pred[:, 5] == cls_id]
+        ref = ref[ref[:, 5] == cls_id]
+        total += len(ref)
+        if not len(pred):
+            continue
+        pred = pred[np.argsort(-pred[:, 4])]
+        matched = np.zeros(len(ref), dtype=bool)
+        iou = box_iou(pred[:, :4], ref[:, :4]) if len(ref) else np.zeros((len(pred), 0))
+        for i in range(len(pred)):
+            hit = False
+            if iou.shape[1]:
+                candidates = np.where(~matched & (iou[i] >= iou_threshold), iou[i], -1.0)
+                j = int(candidates.argmax())
+                if candidates[j] >= 0:
+                    matched[j] = hit = True
+            scores.append(pred[i, 4])
+            hits.append(hit)
+    if total == 0:
+        return None
+    if not scores:
+        return 0.0
+    order = np.argsort(-np.asarray(scores))
+    tp = np.cumsum(np.asarray(hits)[order])
+    recall = tp / total
+    precision = tp / np.arange(1, len(tp) + 1)
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[1.0], precision, [0.0]])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    return float(np.sum((recall[1:] - recall[:-1]) * precision[1:]))
+
+
+def detect(backend, frames, imgsz, conf=0.001):
+    """Dự đoán (không tracker) cho từng frame -> danh sách mảng (N, 6)."""
+    out = []
+    for frame in frames:
+        result = backend.predict([frame], imgsz=imgsz, conf=conf)[0]
+        out.append(result.boxes.data.cpu().numpy().reshape(-1, 6))
+    return out
+
+
+def agreement_map(predictions, references, class_names, ref_conf=0.25):
+    """mAP50 của predictions khi coi dự đoán FP32 (conf >= ref_conf) là nhãn."""
+    references = [ref[ref[:, 4] >= ref_conf] for ref in references]
+    per_class = {name: average_precision(predictions, references, cls_id) for cls_id, name in class_names.items()}
+    values = [ap for ap in per_class.values() if ap is not None]
+    return {"map50": round(float(np.mean(values)), 4) if values else None,
+            "per_class": {name: None if ap is None else round(ap, 4) for name, ap in per_class.items()}}
+
+
+def validate(weights, data, imgsz):
+    """mAP trên tập nhãn thật (file dataset YAML của Ultralytics)."""
+    from ultralytics import YOLO
+
+    metrics = YOLO(weights, task="detect").val(data=data, imgsz=imgsz, device="cpu", batch=1,
+                                               plots=False, verbose=False)
+    names = metrics.names
+    per_class = {names[int(c)]: round(float(ap), 4) for c, ap in zip(metrics.box.ap_class_index, metrics.box.ap50)}
+    return {"map50": round(float(metrics.box.map50), 4), "map50_95": round(float(metrics.box.map), 4),
+            "per_class": per_class}
+
+
+def compare(model_path, int8_path, videos, imgsz=640, eval_frames=100, data=None, line=(10, 190, 630, 190),
+            roi_points=None, tracker=r"tracking/bytetrack.yaml", runs=30):
+    """Đo FP32 và INT8 (cùng ONNX Runtime CPU), trả về dict báo cáo."""
+    from backend_count import CLASS_NAMES
+    from benchmark import count_error, load_ground_truth, replay_video
+    from roi import RegionOfInterest
+
+    roi = RegionOfInterest(roi_points) if roi_points else None
+    frame_shape = (*roi.shape, 3) if roi else (480, 640, 3)
+    frames = sample_frames(videos, eval_frames, roi=roi, offset=0.5)
+    variants = {"fp32": export_cached(model_path, "onnx", imgsz=imgsz), "int8": int8_path}
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "imgsz": imgsz, "eval_frames": len(frames),
+              "variants": {}}
+    reference = None
+    for name, weights in variants.items():
+        backend = load_backend(weights, "onnx")
+        backend.measure_latency(imgsz=imgsz, frame_shape=frame_shape, warmup=5, runs=runs)
+        predictions = detect(backend, frames, imgsz)
+        if reference is None:
+            reference = predictions
+        entry = {
+            "weights": weights,
+            "size_mb": round(os.path.getsize(weights) / 1e6, 2),
+            "latency_ms": round(backend.latency_ms, 2),
+            "agreement": agreement_map(predictions, reference, CLASS_NAMES),
+            "videos": {},
+        }
+        if data:
+            entry["val"] = validate(weights, data, imgsz)
+        for video in videos:
+            result = replay_video(video, weights, backend="onnx", tracker=tracker, line=line, roi_points=roi_points)
+            counts = result["counts"]
+            item = {"counts": counts, "fps": result["fps"]}
+            truth = load_ground_truth(video)
+            if truth is not None:
+                item["error"] = count_error(counts, truth)
+            if name != "fp32":
+                item["diff_vs_fp32"] = count_error(counts, report["variants"]["fp32"]["videos"][os.path.basename(video)]["counts"])
+            entry["videos"][os.path.basename(video)] = item
+        report["variants"][name] = entry
+
+    fp32, int8 = report["variants"]["fp32"], report["variants"]["int8"]
+    report["speedup"] = round(fp32["latency_ms"] / int8["latency_ms"], 2) if int8["latency_ms"] else None
+    return report
+
+
+def print_report(report):
+    print(f"\n📊 FP32 vs INT8 (ONNX Runtime CPU, imgsz {report['imgsz']}, {report['eval_frames']} frame đánh giá)")
+    for name, entry in report["variants"].items():
+        agreement = entry["agreement"]
+        classes = ", ".join(f"{k} {v}" for k, v in agreement["per_class"].items())
+        print(f"   {name:<5} {entry['latency_ms']:>8.2f} ms/frame  {entry['size_mb']:>6.1f} MB  "
+              f"mAP50 so với FP32 {agreement['map50']} ({classes})")
+        if "val" in entry:
+            print(f"         mAP50 {entry['val']['map50']}  mAP50-95 {entry['val']['map50_95']}  {entry['val']['per_class']}")
+        for video, item in entry["videos"].items():
+            line = f"         📼 {video}: chai {item['counts']['bottle']}, lon {item['counts']['can']}, {item['fps']} fps"
+            if "error" in item:
+                line += f", sai lệch so với thật {item['error']}"
+            if "diff_vs_fp32" in item:
+                line += f", lệch so với FP32 {item['diff_vs_fp32']}"
+            print(line)
+    print(f"   Tăng tốc INT8: x{report['speedup']}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Lượng tử hoá INT8 model YOLO và so sánh với FP32.")
+    parser.add_argument("--model", default=r"model/best.pt")
+    parser.add_argument("--videos", nargs="+", default=None, help="Video hiệu chuẩn / đánh giá, mặc định data/*.mp4")
+    parser.add_argument("--output", default=None, help="File INT8, mặc định <model>_int8.onnx")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--calib-frames", type=int, default=200)
+    parser.add_argument("--eval-frames", type=int, default=100)
+    parser.add_argument("--method", default="minmax", choices=["minmax", "entropy", "percentile"])
+    parser.add_argument("--per-tensor", action="store_true", help="Lượng tử hoá trọng số theo tensor thay vì theo kênh")
+    parser.add_argument("--quantize-head", action="store_true", help="Lượng tử hoá cả phần giải mã box của Detect head")
+    parser.add_argument("--roi", type=json.loads, default=None, help="Cắt ROI như pipeline (từ get_zone)")
+    parser.add_argument("--line", type=json.loads, default=[10, 190, 630, 190])
+    parser.add_argument("--tracker", default=r"tracking/bytetrack.yaml")
+    parser.add_argument("--data", default=None, help="Dataset YAML có nhãn để tính mAP thật")
+    parser.add_argument("--report", default=None, help="Ghi báo cáo JSON ra file")
+    parser.add_argument("--no-quantize", action="store_true", help="Chỉ so sánh với bản INT8 đã có")
+    parser.add_argument("--no-compare", action="store_true", help="Chỉ lượng tử hoá")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    videos = args.videos or find_videos()
+    if not videos:
+        print("⚠️ Không tìm thấy video nào trong data/.", file=sys.stderr)
+        return 1
+
+    # Log export / hiệu chuẩn ra stderr, stdout chỉ chứa báo cáo
+    with contextlib.redirect_stdout(sys.stderr):
+        from roi import RegionOfInterest
+
+        roi = RegionOfInterest(args.roi) if args.roi else None
+        int8_path = args.output or quantized_path(args.model)
+        if not args.no_quantize:
+            int8_path = quantize_model(args.model, videos, output=int8_path, imgsz=args.imgsz,
+                                       calib_frames=args.calib_frames, method=args.method,
+                                       per_channel=not args.per_tensor, keep_head_fp32=not args.quantize_head,
+                                       roi=roi)
+        report = None
+        if not args.no_compare:
+            report = compare(args.model, int8_path, videos, imgsz=args.imgsz, eval_frames=args.eval_frames,
+                             data=args.data, line=args.line, roi_points=args.roi, tracker=args.tracker)
+
+    if report:
+        print_report(report)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
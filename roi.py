@@ -0,0 +1,49 @@
+import math
+
+import cv2
+import numpy as np
+
+
+class RegionOfInterest:
+    """
+    Vùng quan tâm (ROI) quanh line đếm: chỉ phần ảnh này được đưa vào model.
+
+    ROI là hình chữ nhật bao các điểm chọn bằng get_zone.run_video_selection
+    (toạ độ trên frame đã resize về frame_size). imgsz được làm tròn lên bội số
+    của stride để model chạy ở kích thước nhỏ hơn 640.
+    """
+    def __init__(self, points, frame_size=(640, 480), stride=32, max_imgsz=640):
+        points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        if len(points) < 2:
+            raise ValueError("ROI cần ít nhất 2 điểm.")
+
+        width, height = frame_size
+        self.x0 = int(np.clip(points[:, 0].min(), 0, width - 1))
+        self.y0 = int(np.clip(points[:, 1].min(), 0, height - 1))
+        self.x1 = int(np.clip(points[:, 0].max(), self.x0 + 1, width))
+        self.y1 = int(np.clip(points[:, 1].max(), self.y0 + 1, height))
+
+        longest = max(self.x1 - self.x0, self.y1 - self.y0)
+        self.imgsz = min(max_imgsz, max(stride, math.ceil(longest / stride) * stride))
+
+    @property
+    def shape(self):
+        return self.y1 - self.y0, self.x1 - self.x0
+
+    def contains_line(self, line):
+        x1, y1, x2, y2 = line
+        return all(self.x0 <= x <= self.x1 for x in (x1, x2)) and all(self.y0 <= y <= self.y1 for y in (y1, y2))
+
+    def crop(self, frame):
+        """Cắt ROI khỏi frame (view, không copy)."""
+        return frame[self.y0:self.y1, self.x0:self.x1]
+
+    def tracks_to_frame(self, tracks):
+        """Dịch các hàng [x1, y1, x2, y2, ...] từ hệ ROI sang hệ frame (trả về bản sao)."""
+        tracks = np.array(tracks, dtype=np.float32, copy=True)
+        tracks[:, [0, 2]] += self.x0
+        tracks[:, [1, 3]] += self.y0
+        return tracks
+
+    def draw(self, frame, color=(255, 255, 0)):
+        cv2.rectangle(frame, (self.x0, self.y0), (self.x1 - 1, self.y1 - 1), color, 1)
@@ -1,50 +1,290 @@
+import collections
+import queue
 import serial
 import struct
+import threading
+import time
+
+from uart_protocol import ACK, BUSY, CMD_HELLO, NAK, STATUS_NAMES, FrameParser, SortScheduler, encode_frame
 
 class ESP32_UART:
     """
     Lớp để giao tiếp với ESP32 qua kết nối UART (Serial).
+
+    send_packet chỉ đưa lệnh vào hàng đợi có giới hạn và trả về ngay; một luồng
+    ghi riêng gom các lệnh liền nhau thành một lần write, có write timeout và tự
+    kết nối lại khi cổng bị rút, nên cổng chậm/treo không làm đứng vòng nhận diện.
+
+    protocol="v2" dùng khung có số thứ tự + CRC (xem uart_protocol): mỗi lệnh chờ
+    ACK, gửi lại khi BUSY/NAK/timeout, và được điều tiết theo chu kỳ servo.
+    protocol="v1" giữ khung 3 byte cũ cho firmware chưa cập nhật.
     """
-    def __init__(self, port, baudrate=9600):
+    def __init__(self, port, baudrate=9600, queue_size=64, write_timeout=0.5, reconnect_interval=2.0,
+                 protocol="v1", ack_timeout=0.3, max_retries=3, command_timeout=10.0, scheduler=None,
+                 verbose=True):
+        self.port = port
+        self.verbose = verbose
+        self.baudrate = baudrate
+        self.write_timeout = write_timeout
+        self.reconnect_interval = reconnect_interval
+
+        # --- Giao thức v2 ---
+        self.protocol = protocol
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.command_timeout = command_timeout
+        self.scheduler = scheduler if scheduler is not None else SortScheduler()
+        self.parser = FrameParser()
+        self.seq = 0
+        # Phiên v2 chưa bắt đầu: phải gửi CMD_HELLO trước lệnh đầu tiên sau mỗi lần (kết nối lại) cổng
+        self.session_open = False
+        self.ser = None
+        # close() đã bỏ cuộc chờ luồng ghi: luồng ghi không được kết nối lại và tự đóng cổng khi thoát
+        self.closed = False
+        self.last_connect_attempt = 0.0
+        self._connect()
+
+        # --- Số liệu ---
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.writes = 0
+        self.retries = 0
+        self.busy_replies = 0
+        self.latencies = collections.deque(maxlen=1000)
+
+        # --- Hàng đợi lệnh & luồng ghi ---
+        self.commands = queue.Queue(maxsize=queue_size)
+        self.running = True
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+
+    def _connect(self):
+        if self.closed:
+            return
+        self.last_connect_attempt = time.monotonic()
         try:
-            self.ser = serial.Serial(port, baudrate)
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=0.02, write_timeout=self.write_timeout)
+            self.session_open = False
             print(f"✅ Đã kết nối thành công uart")
         except serial.SerialException as e:
             self.ser = None
-            print(f"❌ Lỗi: Không thể mở cổng {port}. {e}")
+            print(f"❌ Lỗi: Không thể mở cổng {self.port}. {e}")
 
-    def send_packet(self, data_byte):
+    def _disconnect(self):
+        try:
+            if self.ser:
+                self.ser.close()
+        except (serial.SerialException, OSError):
+            pass
+        self.ser = None
+
+    @staticmethod
+    def build_packet(data_byte):
         """
         - Byte bắt đầu: 0x02
         - Data: 1 byte
         - Byte kết thúc: 0x03
         """
-        if not self.ser or not self.ser.is_open:
-            print("Lỗi: Kết nối serial chưa được thiết lập hoặc đã đóng.")
-            return
+        start_byte = 0x02
+        end_byte = 0x03
+        return struct.pack('<BBB', start_byte, data_byte, end_byte)
+
+    def send_packet(self, data_byte):
+        """
+        Đưa lệnh vào hàng đợi gửi, không chặn. Lệnh bị bỏ nếu hàng đợi đầy.
+        """
         try:
-            start_byte = 0x02
-            end_byte = 0x03
-            packet = struct.pack('<BBB', start_byte, data_byte, end_byte)
-            self.ser.write(packet)
-            print(f"Đã gửi Data: {hex(data_byte)}")
-            
-        except Exception as e:
+            packet = self.build_packet(data_byte)
+        except struct.error as e:
             print(f"Lỗi khi gửi dữ liệu: {e}")
-            
-    def close(self):
+            return False
+        try:
+            self.commands.put_nowait((time.perf_counter(), data_byte, packet))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"Lỗi: Hàng đợi UART đầy, bỏ lệnh {hex(data_byte)}.")
+            return False
+
+    def _next_batch(self, timeout=0.1, max_batch=32):
+        """Lấy một lệnh (chờ tối đa timeout) cùng mọi lệnh đang chờ ngay sau nó."""
+        try:
+            batch = [self.commands.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < max_batch:
+            try:
+                batch.append(self.commands.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, data):
+        """Ghi dữ liệu, tự kết nối lại một lần nếu cổng đã mất. Trả về True nếu ghi được."""
+        for _ in range(2):
+            if self.closed:
+                return False
+            if not self.ser or not self.ser.is_open:
+                if time.monotonic() - self.last_connect_attempt < self.reconnect_interval:
+                    return False
+                self._connect()
+                if not self.ser:
+                    return False
+            try:
+                self.ser.write(data)
+                return True
+            except serial.SerialTimeoutException as e:
+                print(f"Lỗi khi gửi dữ liệu: quá thời gian ghi ({e})")
+                return False
+            except (serial.SerialException, OSError) as e:
+                print(f"Lỗi khi gửi dữ liệu: {e}. Đang kết nối lại...")
+                self._disconnect()
+                self.last_connect_attempt = 0.0
+        return False
+
+    def _await_reply(self, seq):
+        """Đọc phản hồi v2 có cùng số thứ tự, trả về mã trạng thái hoặc None khi hết giờ."""
+        deadline = time.monotonic() + self.ack_timeout
+        while time.monotonic() < deadline:
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except (serial.SerialException, OSError) as e:
+                print(f"Lỗi khi đọc phản hồi: {e}")
+                self._disconnect()
+                return None
+            for frame in self.parser.feed(data):
+                if frame.seq == seq:
+                    return frame.value
+        return None
+
+    def _open_session(self):
+        """Gửi CMD_HELLO để firmware quên seq của phiên trước. Trả về True nếu firmware đã nhận."""
+        for _ in range(self.max_retries + 1):
+            self.seq = (self.seq + 1) & 0xFF
+            if not self._write(encode_frame(self.seq, CMD_HELLO)):
+                return False
+            status = self._await_reply(self.seq)
+            if status == ACK:
+                self.session_open = True
+                return True
+            if status == NAK:
+                # Firmware cũ chưa hỗ trợ HELLO: vẫn gửi lệnh được, nhưng có thể mất lệnh đầu khi host khởi động lại
+                print("⚠️ Firmware ESP32 chưa hỗ trợ bắt đầu phiên (HELLO), nên cập nhật servo.ino.")
+                self.session_open = True
+                return True
+        print("Lỗi: ESP32 không phản hồi khi bắt đầu phiên.")
+        return False
+
+    def _send_reliable(self, data_byte):
+        """
+        Gửi một lệnh v2: chờ servo rảnh, gửi khung, chờ ACK.
+        BUSY -> chờ rồi gửi lại; NAK/timeout (kể cả khung hỏng CRC, firmware không trả lời) -> gửi lại tối đa max_retries lần.
+        """
+        if not self.session_open and not self._open_session():
+            return False
+        self.seq = (self.seq + 1) & 0xFF
+        frame = encode_frame(self.seq, data_byte)
+        deadline = time.monotonic() + self.command_timeout
+        attempts = 0
+        while attempts <= self.max_retries and time.monotonic() < deadline and not self.closed:
+            wait = self.scheduler.wait_time()
+            if wait:
+                time.sleep(wait)
+            if not self._write(frame):
+                return False
+            status = self._await_reply(self.seq)
+            if status == ACK:
+                self.scheduler.started(data_byte)
+                return True
+            if status == BUSY:
+                self.busy_replies += 1
+                self.scheduler.backoff()
+                continue
+            attempts += 1
+            self.retries += 1
+            print(f"Lỗi: Lệnh {hex(data_byte)} (seq {self.seq}) nhận {STATUS_NAMES.get(status, 'không phản hồi')}, gửi lại.")
+        return False
+
+    def _record(self, batch, success):
+        if not success:
+            self.failed += len(batch)
+            print("Lỗi: Không gửi được lệnh (mất kết nối serial hoặc ESP32 không phản hồi).")
+            return
+        now = time.perf_counter()
+        self.writes += 1
+        self.sent += len(batch)
+        for queued_at, data_byte, _ in batch:
+            self.latencies.append(now - queued_at)
+            if self.verbose:
+                print(f"Đã gửi Data: {hex(data_byte)}")
+
+    def _writer_loop(self):
+        try:
+            while (self.running or not self.commands.empty()) and not self.closed:
+                batch = self._next_batch()
+                if not batch:
+                    continue
+                if self.protocol == "v2":
+                    # Mỗi lệnh chờ ACK riêng, servo chỉ chạy từng lệnh một
+                    for command in batch:
+                        if self.closed:
+                            self.dropped += 1
+                            continue
+                        self._record([command], self._send_reliable(command[1]))
+                else:
+                    self._record(batch, self._write(b"".join(packet for _, _, packet in batch)))
+        finally:
+            if self.closed:
+                # close() đã trả về trước: luồng ghi là nơi duy nhất còn dùng cổng nên tự đóng
+                self.dropped += self.commands.qsize()
+                self._disconnect()
+
+    def metrics(self):
+        """Số liệu hàng đợi và độ trễ (ms) từ lúc xếp lệnh tới lúc ghi xong."""
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000.0 if latencies else 0.0
+        return {
+            "queued": self.commands.qsize(),
+            "sent": self.sent,
+            "writes": self.writes,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "retries": self.retries,
+            "busy": self.busy_replies,
+            "latency_p50_ms": percentile(0.50),
+            "latency_p95_ms": percentile(0.95),
+            "latency_max_ms": latencies[-1] * 1000.0 if latencies else 0.0,
+        }
+
+    def close(self, timeout=1.0):
         """
-        Đóng kết nối serial.
+        Gửi nốt các lệnh còn trong hàng đợi (chờ tối đa timeout giây) rồi đóng kết nối serial.
+
+        Chỉ đóng cổng khi luồng ghi đã dừng. Nếu luồng ghi vẫn đang gửi sau timeout thì
+        đánh dấu closed: luồng ghi bỏ các lệnh còn lại, không kết nối lại và tự đóng cổng
+        khi thoát, nên cổng không bị mở lại sau close() và không bị giữ cho tiến trình sau.
         """
+        writer = getattr(self, "writer", None)
+        if writer and writer.is_alive():
+            self.running = False
+            writer.join(timeout=timeout)
+            if writer.is_alive():
+                self.closed = True
+                print("⚠️ Luồng UART còn đang gửi, cổng serial sẽ được đóng khi lệnh hiện tại kết thúc.")
+                return
+        self.closed = True
         if self.ser and self.ser.is_open:
-            self.ser.close()
+            self._disconnect()
             print("✅ Đã đóng kết nối serial.")
-            
+
     def __del__(self):
         """
         Hàm hủy tự động đóng kết nối khi đối tượng bị xóa.
         """
-        self.close()
+        if not getattr(self, "closed", True):
+            self.close()
 
 # # --- VÍ DỤ SỬ DỤNG ---
 # if __name__ == "__main__":
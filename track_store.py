@@ -0,0 +1,83 @@
+import numpy as np
+import yaml
+
+
+def load_track_buffer(tracker_config, default=30):
+    """Đọc track_buffer từ file cấu hình tracker (bytetrack.yaml / botsort.yaml)."""
+    try:
+        with open(tracker_config, "r", encoding="utf-8") as f:
+            return int(yaml.safe_load(f).get("track_buffer", default))
+    except (OSError, AttributeError, TypeError, ValueError, yaml.YAMLError) as e:
+        print(f"⚠️ Không đọc được track_buffer từ {tracker_config}: {e}")
+        return default
+
+
+class TrackStateStore:
+    """
+    Bảng trạng thái track gọn, lưu bằng mảng NumPy sắp xếp theo id.
+
+    Mỗi dòng gồm: id, tâm ở lần thấy gần nhất, frame thấy gần nhất và cờ đã đếm.
+    Đồng hồ frame chỉ tăng khi tracker thực sự chạy (advance), và track không
+    xuất hiện quá ttl frame sẽ bị xoá, khớp với thời gian tracker còn giữ track
+    đã mất (track_buffer). Nhờ vậy bộ nhớ không tăng mãi trên máy chạy nhiều tuần
+    và id bị tracker dùng lại sau khi reset không bị coi là đã đếm.
+    """
+    __slots__ = ("ttl", "frame_index", "ids", "points", "last_seen", "counted", "evicted")
+
+    def __init__(self, ttl=None, tracker_config=r"tracking/bytetrack.yaml"):
+        self.ttl = ttl if ttl is not None else load_track_buffer(tracker_config)
+        self.frame_index = 0
+        self.evicted = 0
+        self.clear()
+
+    def clear(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.points = np.empty((0, 2), dtype=np.float32)
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.counted = np.empty(0, dtype=bool)
+
+    def __len__(self):
+        return self.ids.size
+
+    def advance(self):
+        """Sang frame tracker mới và xoá các track đã hết hạn."""
+        self.frame_index += 1
+        expired = self.frame_index - self.last_seen > self.ttl
+        if expired.any():
+            keep = ~expired
+            self.evicted += int(expired.sum())
+            self.ids = self.ids[keep]
+            self.points = self.points[keep]
+            self.last_seen = self.last_seen[keep]
+            self.counted = self.counted[keep]
+
+    def lookup(self, ids):
+        """Trả về (chỉ số dòng, mặt nạ id đã có) cho mảng id."""
+        idx = np.searchsorted(self.ids, ids)
+        known = idx < self.ids.size
+        known[known] = self.ids[idx[known]] == ids[known]
+        return idx, known
+
+    def update(self, idx, points):
+        """Cập nhật tâm và thời điểm thấy gần nhất cho các dòng idx."""
+        self.points[idx] = points
+        self.last_seen[idx] = self.frame_index
+
+    def insert(self, ids, points):
+        """Thêm các id mới (chưa có trong bảng)."""
+        ids, first = np.unique(ids, return_index=True)
+        order = np.argsort(np.concatenate([self.ids, ids]), kind="stable")
+        self.ids = np.concatenate([self.ids, ids])[order]
+        self.points = np.concatenate([self.points, points[first]])[order]
+        self.last_seen = np.concatenate([self.last_seen, np.full(ids.size, self.frame_index, dtype=np.int64)])[order]
+        self.counted = np.concatenate([self.counted, np.zeros(ids.size, dtype=bool)])[order]
+
+    def is_counted(self, ids):
+        idx, known = self.lookup(ids)
+        result = np.zeros(ids.size, dtype=bool)
+        result[known] = self.counted[idx[known]]
+        return result
+
+    def mark_counted(self, ids):
+        idx, known = self.lookup(ids)
+        self.counted[idx[known]] = True
@@ -0,0 +1,115 @@
+import collections
+import time
+
+# ===============================================================
+# GIAO THỨC UART V2 (có số thứ tự, CRC và phản hồi ACK/BUSY/NAK)
+# ===============================================================
+#
+# Lệnh host -> ESP32 và phản hồi ESP32 -> host cùng một khung 6 byte:
+#   0x02 | 0xA2 (phiên bản) | SEQ | CMD/STATUS | CRC8 | 0x03
+# CRC8 (đa thức 0x07) tính trên 3 byte VER, SEQ, CMD/STATUS.
+# Khung v1 cũ (0x02 DATA 0x03) vẫn được firmware chấp nhận: byte thứ hai
+# của v1 là lệnh 0x01/0x02 nên không trùng với 0xA2.
+#
+# Khung sai CRC bị firmware bỏ qua, không trả NAK (SEQ trong khung hỏng cũng
+# không đáng tin để trả lời): host không nhận được phản hồi và gửi lại khung
+# khi hết ack_timeout. NAK chỉ dùng cho khung đúng CRC nhưng lệnh không hỗ trợ.
+#
+# Mỗi lần mở cổng, host gửi CMD_HELLO trước lệnh đầu tiên: firmware xoá seq
+# đã nhớ và trả ACK, không chạy servo. Nhờ vậy host khởi động lại (seq lại bắt
+# đầu từ 1) khi ESP32 vẫn chạy không bị coi là gửi lại gói cũ và bị bỏ lệnh.
+
+START_BYTE = 0x02
+END_BYTE = 0x03
+VERSION = 0xA2
+FRAME_SIZE = 6
+
+CMD_BOTTLE = 0x01
+CMD_CAN = 0x02
+CMD_HELLO = 0x7E  # Bắt đầu phiên mới: firmware quên seq cũ
+
+ACK = 0x06   # Đã nhận lệnh, servo bắt đầu chạy
+BUSY = 0x11  # Servo đang bận, gửi lại sau
+NAK = 0x15   # Lệnh không hỗ trợ (khung sai CRC không được trả lời, xem đầu file)
+
+STATUS_NAMES = {ACK: "ACK", BUSY: "BUSY", NAK: "NAK"}
+
+# Thời gian một chu kỳ servo (giây) theo lệnh, khớp với code_classify/servo.ino
+SERVO_CYCLE_TIMES = {CMD_BOTTLE: 2.0, CMD_CAN: 0.0}
+
+Frame = collections.namedtuple("Frame", "seq value")
+
+
+def crc8(data, poly=0x07):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_frame(seq, value):
+    """Đóng khung v2 cho một lệnh (host) hoặc một phản hồi (firmware)."""
+    body = bytes((VERSION, seq & 0xFF, value & 0xFF))
+    return bytes((START_BYTE,)) + body + bytes((crc8(body), END_BYTE))
+
+
+class FrameParser:
+    """
+    Tách khung v2 từ luồng byte nhận được, tự đồng bộ lại khi gặp byte rác
+    (ví dụ dòng log Serial.println của firmware) hoặc khung sai CRC.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.bad_frames = 0
+
+    def feed(self, data):
+        """Nạp thêm byte, trả về danh sách Frame hoàn chỉnh."""
+        self.buffer.extend(data)
+        frames = []
+        while True:
+            start = self.buffer.find(bytes((START_BYTE, VERSION)))
+            if start < 0:
+                # Giữ lại byte cuối nếu có thể là đầu khung
+                del self.buffer[:-1 if self.buffer[-1:] == bytes((START_BYTE,)) else len(self.buffer)]
+                return frames
+            del self.buffer[:start]
+            if len(self.buffer) < FRAME_SIZE:
+                return frames
+            frame = bytes(self.buffer[:FRAME_SIZE])
+            if frame[5] == END_BYTE and crc8(frame[1:4]) == frame[4]:
+                frames.append(Frame(frame[2], frame[3]))
+                del self.buffer[:FRAME_SIZE]
+            else:
+                self.bad_frames += 1
+                del self.buffer[:1]
+
+
+class SortScheduler:
+    """
+    Bộ điều tiết phía host: biết thời gian chu kỳ của servo nên chỉ gửi lệnh
+    tiếp theo khi servo đã rảnh, thay vì dồn lệnh vào buffer serial của firmware.
+    """
+    def __init__(self, cycle_times=None, min_gap=0.05):
+        self.cycle_times = dict(SERVO_CYCLE_TIMES if cycle_times is None else cycle_times)
+        self.min_gap = min_gap
+        self.busy_until = 0.0
+
+    def wait_time(self, now=None):
+        """Số giây còn phải chờ trước khi được gửi lệnh tiếp theo."""
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.busy_until - now)
+
+    def started(self, command, now=None):
+        """Ghi nhận firmware đã nhận lệnh (ACK) và servo bắt đầu chu kỳ."""
+        now = time.monotonic() if now is None else now
+        self.busy_until = now + max(self.min_gap, self.cycle_times.get(command, 0.0))
+
+    def backoff(self, now=None):
+        """Firmware báo BUSY: lùi thêm một khoảng ngắn trước khi gửi lại."""
+        now = time.monotonic() if now is None else now
+        self.busy_until = max(self.busy_until, now + self.min_gap)
+
+    def max_items_per_minute(self, command):
+        return 60.0 / max(self.min_gap, self.cycle_times.get(command, 0.0))